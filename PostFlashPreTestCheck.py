@@ -2,229 +2,369 @@
 # coding: utf-8
 
 from __future__ import print_function
-from time import sleep
+from time import perf_counter, process_time, sleep, time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from common_util import *
+from map_util import MapIndex
+from metrics_util import METRICS_FILE, PROFILERS, RunMetrics
 
-import can.interfaces.vector
+import argparse
 import logging
 import sys
 import os
-import numpy as np
+import threading
 
-MIN_PYTHON = (3, 7)
+# python-can, numpy, pandas and the modules built on them are imported by the stages that need them,
+# so the quick modes (-l, -s) start without them
 
-logging.basicConfig(filename='run.log', filemode='w', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+MIN_PYTHON = (3, 7)
+# Capture window, extended up to MAX_CAPTURE_TIME_S for the messages with long cycle times
+CAPTURE_TIME_S = 5
+# Long enough for CAPTURE_MIN_CYCLES cycles of a 1000 ms message
+MAX_CAPTURE_TIME_S = 12
+CAPTURE_POLL_S = 0.01
+# Cycles measured per message before the capture may end early
+CAPTURE_MIN_CYCLES = 5
+# Interval of the stopped message check of the soak test
+MONITOR_POLL_S = 0.1
+# Keys of report_util.REPORT_WRITERS, listed here so the command line does not import the writers
+REPORT_FORMATS = ['xlsx', 'csv', 'jsonl', 'parquet']
+# history_util.HISTORY_DB
+HISTORY_DB = 'run_history.db'
 
 
 class PostFlashPreTestCheck(object):
-    def __init__(self, variant, map_folder, dbc_folder):
+    def __init__(self, variant, map_folder, dbc_folder, asc_logging=False, tolerances=None, frame_detail=False,
+                 bustype='vector', metrics=None, keep_buses=False):
         """ initialize class variables
         :param variant: str
         :param map_folder: str
         :param dbc_folder: str
+        :param asc_logging: bool, also write the captured frames to CAN<n>_log.asc
+        :param tolerances: dictionary overriding timing_util.DEFAULT_TOLERANCES
+        :param frame_detail: bool, keep the captured frame timestamps for a Frames sheet in the report
+        :param bustype: python-can interface of the XCP and capture buses, 'virtual' for ecu_simulator.py
+        :param metrics: RunMetrics recording the stages of the run, a new one by default
+        :param keep_buses: keep the XCP and capture buses open between checks, until close_buses
         :return None
         """
         self.variant = str(variant).upper()
         self.dbc_folder = Path(dbc_folder)
         self.map_folder = Path(map_folder)
-        self.message_list = []
-        self.message_status = {}
+        self.messages = None
+        self.dbc_files = []
+        self.tolerances = tolerances
+        self.signal_layouts = {}
+        self.signal_status = []
+        self.bustype = bustype
+        self.keep_buses = keep_buses
+        # CAN channel -> (bus, notifier, ListenerSwitch) of the capture buses kept open
+        self.channel_buses = {}
         self.bus = None
+        self.xcp = None
+        self.stub_version = {}
+        self.daq_samples = {}
+        self.flash_verification = []
+        self.map_index = None
+        self.asc_logging = asc_logging
+        self.frame_detail = frame_detail
+        # CAN channel -> dictionary of row -> numpy array of timestamps, with frame_detail
+        self.frame_timestamps = {}
+        self.captures = {}
+        # CAN channels whose capture listeners are detached, guarded by capture_lock
+        self.detached_channels = set()
+        self.capture_lock = threading.Lock()
+        # Ends the capture window while finish_capture is held up, e.g. by the XCP stage
+        self.capture_timer = None
+        # Length of the current capture window, set by start_capture
+        self.capture_window_s = CAPTURE_TIME_S
+        self.capture_start_s = 0.0
+        # Frames needed to measure CAPTURE_MIN_CYCLES cycles after the skipped frames, set by start_capture
+        self.min_frames = None
+        self.metrics = metrics or RunMetrics()
+        self.capture_start_cpu_s = 0.0
 
         # # Display CAN output (only 0x7E0 and 0x7E1 messages)
         # self.notifier = can.Notifier(self.bus2, [can.Printer()])
 
-    def get_stub_variable_addresses(self):
-        """ search for the addresses of StubVersion_Main and StubVersion_Sub in the Build/application.map file
+    def get_map_index(self):
+        """ load the symbol index of the Build/application.map file, once per run
 
-        :return None
+        :return: MapIndex
         """
-        addresses = {'StubVersion_Main': 0x0, 'StubVersion_Sub': 0x0}
-        key_value = 'StubVersion_Main'
-        address_header_found = False
-        addresses_found = False
+        if self.map_index is None:
+            try:
+                with self.metrics.stage('map scan'):
+                    self.map_index = MapIndex(self.map_folder / 'application.map')
+            except IOError as e:
+                print('I/O error({0}): {1}'.format(e.errno, e.strerror))
+                sys.exit()
 
-        print('Checking for the addresses of StubVersion_Main and StubVersion_Sub in application.map..')
-        try:
-            with open(self.map_folder / 'application.map', 'r') as fp:
-                for line in fp:
-                    if line.find('* Symbols (sorted on name)') != -1:
-                        address_header_found = True
-
-                    if address_header_found and line.find(key_value) != -1:
-                        temp_line = line.split()
-                        addresses[key_value] = int(temp_line[3], 16)
-                        if key_value == 'StubVersion_Main':
-                            key_value = 'StubVersion_Sub'
-                        else:
-                            addresses_found = True
-                            break
-
-                    if line.find('* Symbols (sorted on address)') != -1:
-                        break
-            fp.close()
-        except IOError as e:
-            print('I/O error({0}): {1}'.format(e.errno, e.strerror))
-            sys.exit()
+        return self.map_index
+
+    def get_symbol_addresses(self, symbol_names):
+        """ search for the addresses of any list of symbols in the Build/application.map file
+
+        :param symbol_names: list of symbol names
+        :return: dictionary of symbol name -> address (0x0 if not found), True if all the symbols were found
+        """
+        addresses = self.get_map_index().lookup(symbol_names)
+        addresses_found = len(addresses) == len(set(symbol_names))
+        for name in symbol_names:
+            if name not in addresses:
+                logging.info('{} not found in application.map'.format(name))
+                addresses[name] = 0x0
 
         return addresses, addresses_found
 
+    def get_stub_variable_addresses(self):
+        """ search for the addresses of StubVersion_Main and StubVersion_Sub in the Build/application.map file
+
+        :return: dictionary of symbol name -> address (0x0 if not found), True if both symbols were found
+        """
+        print('Checking for the addresses of StubVersion_Main and StubVersion_Sub in application.map..')
+        return self.get_symbol_addresses(['StubVersion_Main', 'StubVersion_Sub'])
+
     def connect_to_xcp(self, xcp_bus):
-        try:
-            self.bus = can.ThreadSafeBus(bustype='vector', channel=xcp_bus-1,
-                                         can_filters=[{"can_id": 0x7e1, "can_mask": 0x7e1, "extended": False}],
-                                         receive_own_messages=True, bitrate=500000, app_name='CANoe')
-        except can.interfaces.vector.VectorError as message:
-            # logging.error(message)
-            print(message)
-            sys.exit()
+        import can
+        from xcp_util import XcpClient, XcpError, XcpTimeout
+
+        if self.bus is None:
+            try:
+                with self.metrics.stage('xcp bus open'):
+                    self.bus = can.ThreadSafeBus(interface=self.bustype, channel=xcp_bus-1,
+                                                 can_filters=[{"can_id": 0x7e1, "can_mask": 0x7e1, "extended": False}],
+                                                 receive_own_messages=True, bitrate=500000, app_name='CANoe')
+            except can.CanError as message:
+                # logging.error(message)
+                print(message)
+                sys.exit()
 
-        msg = can.Message(arbitration_id=0x7e0,
-                          data=[0xFF, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
-                          extended_id=False)
+            self.xcp = XcpClient(self.bus)
         print('Connecting to XCP slave')
-        self.connect_disconnect(msg)
-
-    # Non-short upload commands
-    def connect_disconnect(self, msg):
-        tries = 0
-        self.bus.send(msg)
-        response_message = self.check_xcp_response(self.bus)
-        # Retry connect/disconnect request 10 times
-        while response_message is None and tries < 10:
-            if msg.data[0] == 0xFF:
-                logging.info("XCP slave connect retry {}".format(tries + 1))
-            elif msg.data[0] == 0xFE:
-                logging.info("XCP slave disconnect retry {}".format(tries + 1))
-            self.bus.send(msg)
-            response_message = self.check_xcp_response(self.bus)
-            tries += 1
-            sleep(1)
-
-        if tries == 10:
-            # Connect
-            if msg.data[0] == 0xFF:
-                logging.error("Failed to connect to the XCP slave!")
-            # Disconnect
-            else:
-                logging.error("Failed to disconnect from the XCP slave!")
+        try:
+            with self.metrics.stage('xcp connect'):
+                self.xcp.connect()
+        except XcpTimeout:
+            logging.error("Failed to connect to the XCP slave!")
             sys.exit()
-        else:
-            command = hex(msg.data[0])
-
-            # PID: RES
-            if response_message.data[0] == 0xFF:
-                # CONNECT
-                if msg.data[0] == 0xFF:
-                    logging.info('Connected to XCP slave through {}'.format(self.bus))
-                # DISCONNECT
-                else:
-                    logging.info('Disconnected from XCP slave')
-            # PID: ERR
-            elif response_message.data[0] == 0xFE:
-                # response indicates error, report error
-                if msg.data[0] == 0xFF:
-                    logging.error('Unable to connect to XCP slave through {}'.format(self.bus))
-                else:
-                    logging.error('Unable to disconnect from XCP slave through {}'.format(self.bus))
-                sys.exit()
-            # Error: XCP_ERR_CMD_UNKNOWN
-            elif response_message.data[0] == 0x20:
-                logging.info('Command: {} Response: XCP_ERR_CMD_UNKNOWN'.format(command))
-                sys.exit()
-            else:
-                logging.info('Command: {} Response: {}'.format(command,
-                                                               hex(response_message.data[0])))
-                sys.exit()
+        except XcpError as e:
+            logging.error('Unable to connect to XCP slave through {}'.format(self.bus))
+            logging.error(e)
+            sys.exit()
+        logging.info('Connected to XCP slave through {}'.format(self.bus))
 
-    def get_stub_version(self, msg1, msg2):
-        tries = 0
+    def get_stub_version(self, addresses):
+        """ read StubVersion_Main and StubVersion_Sub in one memory read
+
+        :param addresses: dictionary of symbol name -> address, from get_stub_variable_addresses
+        :return: None
+        """
+        from xcp_util import XcpError, XcpTimeout
 
         logging.info('Checking for the stub version..')
         print('Checking for the stub version..')
 
-        response_message = None
+        try:
+            with self.metrics.stage('stub read'):
+                self.stub_version = self.xcp.read_variables([('StubVersion_Main', addresses['StubVersion_Main'], 'B'),
+                                                             ('StubVersion_Sub', addresses['StubVersion_Sub'], 'B')])
+        except XcpTimeout:
+            logging.info('XCP slave response timeout')
+            return
+        except XcpError as e:
+            logging.info('{} for the stub version'.format(e))
+            return
+        for name, label in (('StubVersion_Main', 'Stub version (Main): '),
+                            ('StubVersion_Sub', 'Stub version (Sub):  ')):
+            logging.info('{}{}'.format(label, self.stub_version[name]))
+            print('{}{}'.format(label, self.stub_version[name]))
 
-        while response_message is None and tries < 10:
-            # StubVersion_Main
-            self.bus.send(msg1)
-            response_message = self.check_xcp_response(self.bus)
-            tries += 1
-            sleep(1)
+    def read_variables(self, variable_formats):
+        """ read variables of the application by their names in the Build/application.map file
 
-        if tries == 10:
-            logging.info('XCP slave response timeout')
-        else:
-            if response_message.data[0] == 0xFF:
-                logging.info(
-                    'Stub version (Main): {}'.format(response_message.data[1])
-                )
-                print('Stub version (Main): {}'.format(response_message.data[1]))
-
-                # StubVersion_Sub
-                self.bus.send(msg2)
-                tries = 0
-                response_message = None
-                while response_message is None and tries < 10:
-                    # StubVersion_Main
-                    self.bus.send(msg2)
-                    response_message = self.check_xcp_response(self.bus)
-                    tries += 1
-                    sleep(1)
-
-                if tries == 10:
-                    logging.info('XCP slave response timeout')
-                else:
-                    if response_message.data[0] == 0xFF:
-                        logging.info(
-                            'Stub version (Sub):  {}'.format(response_message.data[1])
-                        )
-                        print('Stub version (Sub):  {}'.format(response_message.data[1]))
-                    elif response_message.data[0] == 0x20:
-                        logging.info('Command: SHORT_UPLOAD for stub version (Sub) Response: XCP_ERR_CMD_UNKNOWN')
-                    else:
-                        logging.info('Command: SHORT_UPLOAD for stub version (Sub) Response: {}'.format(
-                            hex(response_message.data[0])))
-            elif response_message.data[0] == 0x20:
-                logging.info('Command: SHORT_UPLOAD for stub version (Main) Response: XCP_ERR_CMD_UNKNOWN')
+        :param variable_formats: dictionary of symbol name -> struct format, e.g. {'StubVersion_Main': 'B'}
+        :return: dictionary of symbol name -> value, for the symbols found in the map file
+        """
+        from xcp_util import XcpError, XcpTimeout
+
+        addresses = self.get_map_index().lookup(variable_formats)
+        for name in variable_formats:
+            if name not in addresses:
+                print('{} not found in application.map'.format(name))
+
+        try:
+            values = self.xcp.read_variables([(name, address, variable_formats[name])
+                                              for name, address in addresses.items()])
+        except (XcpTimeout, XcpError) as e:
+            logging.error(e)
+            print(e)
+            return {}
+        for name, value in values.items():
+            logging.info('{} = {}'.format(name, value))
+            print('{} = {}'.format(name, value))
+
+        return values
+
+    def start_watch(self, variable_formats, event_channel=0):
+        """ stream variables of the application through an XCP DAQ list
+
+        :param variable_formats: dictionary of symbol name -> struct format, e.g. {'StubVersion_Main': 'B'}
+        :param event_channel: ECU event channel that triggers the DAQ list
+        :return: True if the DAQ list was started, otherwise, False
+        """
+        from xcp_util import XcpError, XcpTimeout
+
+        addresses = self.get_map_index().lookup(variable_formats)
+        for name in variable_formats:
+            if name not in addresses:
+                print('{} not found in application.map'.format(name))
+
+        try:
+            self.xcp.start_daq([(name, address, variable_formats[name]) for name, address in addresses.items()],
+                               event_channel)
+        except (XcpTimeout, XcpError, ValueError) as e:
+            logging.error(e)
+            print('Unable to start DAQ: {}'.format(e))
+            return False
+        logging.info('DAQ started for {}'.format(', '.join(addresses)))
+
+        return True
+
+    def stop_watch(self):
+        """ stop the DAQ list and summarize the streamed variables
+
+        :return: dictionary of symbol name -> (numpy array of timestamps in seconds, numpy array of values)
+        """
+        from xcp_util import XcpError, XcpTimeout
+
+        try:
+            self.daq_samples = self.xcp.stop_daq()
+        except (XcpTimeout, XcpError) as e:
+            logging.error(e)
+            print('Unable to stop DAQ: {}'.format(e))
+            return {}
+        for name, (timestamps, values) in self.daq_samples.items():
+            if len(values) == 0:
+                summary = '{}: no samples'.format(name)
             else:
-                logging.info('Command: SHORT_UPLOAD for stub version (Main) Response: {}'.format(
-                    hex(response_message.data[0])))
+                summary = '{}: {} samples, min {}, max {}, last {}'.format(name, len(values), values.min(),
+                                                                           values.max(), values[-1])
+            logging.info(summary)
+            print(summary)
+
+        return self.daq_samples
+
+    def verify_flash(self, hex_file):
+        """ compare the checksums of the program flash sections computed by the ECU with BUILD_CHECKSUM
+        against the checksums of the build output
+
+        :param hex_file: Intel HEX file of the build
+        :return: True if all the checksums match, otherwise, False
+        """
+        from checksum_util import CHECKSUM_NAMES, compute_checksum, get_memory, read_intel_hex
+        from xcp_util import BUILD_CHECKSUM, ERR_OUT_OF_RANGE, XcpError, XcpTimeout
+
+        ranges = self.get_map_index().get_section_ranges()
+        if not ranges:
+            print('No program flash sections found in application.map')
+            return False
+
+        print('Verifying the flash checksums of {} memory ranges..'.format(len(ranges)))
+        pool = ThreadPoolExecutor()
+        # The HEX file is read and the local checksums computed while the ECU computes its checksums
+        image = pool.submit(read_intel_hex, hex_file)
+
+        def compute_local_checksum(address, size, checksum_type):
+            return compute_checksum(get_memory(image.result(), address, size), checksum_type, self.xcp.byte_order)
+
+        local_checksums = []
+        try:
+            for address, size in ranges:
+                # A range larger than the MAX_CHECKSUM_BLOCKSIZE of the ECU comes back in several blocks
+                for block_address, block_size, checksum_type, ecu_checksum in self.xcp.build_checksums(address, size):
+                    local_checksums.append((block_address, block_size, checksum_type, ecu_checksum,
+                                            pool.submit(compute_local_checksum, block_address, block_size,
+                                                        checksum_type)))
+        except (XcpTimeout, XcpError) as e:
+            logging.error(e)
+            if isinstance(e, XcpError) and e.command == BUILD_CHECKSUM and e.error_code == ERR_OUT_OF_RANGE:
+                print('Unable to verify the flash: the ECU cannot build the checksum of the range at {} ({} bytes) '
+                      'and reported no smaller block size'.format(hex(address), size))
+            else:
+                print('Unable to verify the flash: {}'.format(e))
+            pool.shutdown(wait=False)
+            return False
+
+        verified = True
+        for address, size, checksum_type, ecu_checksum, local_checksum in local_checksums:
+            try:
+                passed = local_checksum.result() == ecu_checksum
+            except (IOError, ValueError) as e:
+                logging.error(e)
+                passed = False
+            verified = verified and passed
+            self.flash_verification.append([hex(address), size, CHECKSUM_NAMES.get(checksum_type, hex(checksum_type)),
+                                            hex(ecu_checksum), 'Passed' if passed else 'Failed'])
+            logging.info('Flash range {} ({} bytes): {}'.format(hex(address), size, 'Passed' if passed else 'Failed'))
+        pool.shutdown()
+
+        print('Result: Flash {}'.format('verified' if verified else 'verification failed, please refer to run.log'))
+        return verified
 
     def disconnect_from_xcp(self):
-        # self.notifier.stop()
-        msg = can.Message(arbitration_id=0x7e0,
-                          data=[0xFE, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
-                          extended_id=False)
+        from xcp_util import XcpError, XcpTimeout
+
         print('Disconnecting from XCP slave')
-        self.connect_disconnect(msg)
-        self.bus.shutdown()
-
-    @staticmethod
-    def check_xcp_response(bus):
-        # Set timeout for response message
-        received_msg = bus.recv(0.05)
-        print('Waiting for XCP response')
-        while received_msg is None or received_msg.arbitration_id != 0x7E1:
-            received_msg = bus.recv(0.05)
-        # if received_msg.arbitration_id == 0x7E1:
-        return received_msg
+        try:
+            self.xcp.disconnect()
+        except XcpTimeout:
+            logging.error("Failed to disconnect from the XCP slave!")
+            sys.exit()
+        except XcpError as e:
+            logging.error('Unable to disconnect from XCP slave through {}'.format(self.bus))
+            logging.error(e)
+            sys.exit()
+        logging.info('Disconnected from XCP slave')
+        if not self.keep_buses:
+            self.xcp.close()
+            self.bus.shutdown()
+            self.xcp = None
+            self.bus = None
+
+    def close_buses(self):
+        """ close the XCP and capture buses kept open with keep_buses
+
+        :return: None
+        """
+        for can_ch, (bus, notifier, switch) in sorted(self.channel_buses.items()):
+            notifier.stop()
+            bus.shutdown()
+        self.channel_buses = {}
+        if self.bus is not None:
+            self.xcp.close()
+            self.bus.shutdown()
+            self.xcp = None
+            self.bus = None
 
     def create_message_list(self):
         """ Creates a dictionary of CAN message information
 
-            :param dbc_folder: The location of the DBC files relative to the script folder, with 1 folder per variant
-            :return: Updated class variable message_list
+            Parsed DBC files are cached in the .dbc_cache folder.
+
+            :return: Updated class variable messages
         """
+        from dbc_util import find_dbc_files, load_messages
+        from message_util import MessageTable
+        from signal_util import SignalLayout
+
         print('Creating a list of CAN IDs (including DBG signals)')
         if self.variant == 'GC7' or self.variant == 'RE7':
             variant_index = 0
         else:
             # HR3
             variant_index = 1
-        can_ch = 0
         # DBC list
         #          CAN 1   CAN 2   CAN 3   CAN 4
         # GC7/RE7    *       *       *      *
@@ -235,36 +375,14 @@ class PostFlashPreTestCheck(object):
         ]
 
         logging.info('Creating a list of CAN IDs')
-        for root, dirs, files in os.walk(self.dbc_folder):
-            for file in files:
-                if file.endswith(".dbc"):
-                    if root.find(self.variant) != -1:
-                        if can_ch < 4:
-                            if file.find(dbc_list[variant_index][can_ch]) != -1:
-                                current_dbc_file = open(os.path.join(root, file), 'r')
-                                for line in current_dbc_file:
-                                    if line.find('BO_ ') != -1 and line.find('EYE') != -1:
-                                        data = line.split()
-                                        self.message_list.append({'can_ch': can_ch+1, 'can_id': int(data[1]),
-                                                                  'cycle_ms': 0})
-
-                                    if line.find('BA_ ') != -1 and line.find('GenMsgCycleTime') != -1:
-                                        data = line.split()
-                                        for index in range(len(self.message_list)):
-                                            if self.message_list[index]['can_ch'] == can_ch+1 and \
-                                                    self.message_list[index]['can_id'] == int(data[3]):
-                                                if int(data[4][:-1]) == 0:
-                                                    self.message_list.remove(self.message_list[index])
-                                                else:
-                                                    self.message_list[index]['cycle_ms'] = int(data[4][:-1])
-                                                break
-
-                                current_dbc_file.close()
-                                can_ch += 1
-                            else:
-                                pass
-                        else:
-                            break
+        with self.metrics.stage('dbc parse'):
+            self.dbc_files = find_dbc_files(self.dbc_folder, self.variant, dbc_list[variant_index])
+            self.messages = MessageTable(load_messages(self.dbc_files))
+            # Signal layouts are compiled once, the captured payloads of a message are decoded in one call
+            self.signal_layouts = {row: SignalLayout(signals) for row, signals in enumerate(self.messages.signals)
+                                   if signals}
+        self.metrics.set('dbc files', len(self.dbc_files))
+        self.metrics.set('expected messages', len(self.messages))
         print('Done!')
 
     def wait_for_messages(self, can_ch):
@@ -273,167 +391,887 @@ class PostFlashPreTestCheck(object):
         :param can_ch: CAN channel to check for CAN messages
         :return: Result of CAN message-checking for the current CAN channel
         """
-        bus = can.interface.Bus(bustype='vector', channel=can_ch-1,
-                                receive_own_messages=False, bitrate=500000, app_name='CANoe')
-
-        # CAN logger
-        asc_file = 'CAN'+str(can_ch)+'_log.asc'
-        can_log = open(asc_file, 'w+')
-        asc_writer = can.ASCWriter(asc_file)
-        notifier = can.Notifier(bus, [asc_writer])
-        sleep(5)
-        can_log.close()
-        # logging.shutdown()
-        notifier.stop()
-        asc_writer.stop()
-        bus.shutdown()
-
-        message_count = 0
-        check_count = 0
-        # message_status = {}
+        self.start_capture([can_ch])
+        return self.finish_capture()[can_ch]
 
-        print('Checking CAN messages in CAN channel {}'.format(can_ch))
-        for index in range(len(self.message_list)):
-            if self.message_list[index]['can_ch'] == can_ch:
-                can_id = self.message_list[index]['can_id']
-                cycle_ms = self.message_list[index]['cycle_ms']
-                message_count += 1
-                message_found = False
-                message_tx_num = 0
-                time_0_s = 0.0
-                time_diff_ms = 0
-                with open(asc_file, 'r') as fp:
-                    for line in fp:
-                        if line.find('  {}             Rx'.format(str(hex(can_id)[2:]).upper())) != -1:
-                            if not message_found:
-                                message_found = True
-                                check_count += 1
-                            message_tx_num += 1
-                            if message_tx_num > 4:
-                                message_rx = line.split()
-                                if time_0_s == 0.0:
-                                    time_0_s = float(message_rx[0])
-                                else:
-                                    time_diff_ms += (float(message_rx[0]) - time_0_s) * 1000
-                                    time_0_s = float(message_rx[0])
-
-                fp.close()
-                if message_found:
-                    time_diff_ms = round(time_diff_ms / (message_tx_num - 4))
-                    self.message_status[str(index)] = [can_ch, str(hex(can_id))[2:].upper(), cycle_ms, time_diff_ms,
-                                                       'Received', 'Failed' if time_diff_ms > cycle_ms else 'Passed',
-                                                       'Please refer to CAN{}_log.asc'.format(can_ch)
-                                                       if time_diff_ms > cycle_ms else np.nan]
-                    logging.info('CAN CH: {} ID {}: Received'.format(can_ch, str(hex(can_id))[2:5].upper()))
+    def start_capture(self, can_channels):
+        """ Start capturing CAN messages on all the channels specified at the same time
+
+        :param can_channels: list of CAN channels to capture
+        :return: None
+        """
+        import can
+        from capture_util import ACCEPTANCE_FILTER_LIMITS, ExpectedIdListener, ListenerSwitch, TimestampListener, \
+            get_acceptance_filters, get_buffer_sizes, get_capture_deadlines, get_capture_window
+        from timing_util import SKIPPED_FRAMES
+
+        self.min_frames = SKIPPED_FRAMES + CAPTURE_MIN_CYCLES + 1
+        self.capture_window_s = max(get_capture_window(self.messages.definitions[self.messages.get_channel_rows(
+            can_ch)], self.min_frames, CAPTURE_TIME_S, MAX_CAPTURE_TIME_S) for can_ch in can_channels)
+        if self.capture_window_s > CAPTURE_TIME_S:
+            print('Capture window extended to {:.1f} s for the messages with long cycle times'.format(
+                self.capture_window_s))
+        print('Waiting for CAN messages..')
+        self.capture_start_cpu_s = process_time()
+        with self.metrics.stage('capture start', channels=len(can_channels)):
+            for can_ch in can_channels:
+                expected_messages = self.messages.definitions[self.messages.get_channel_rows(can_ch)]
+                # Only the expected IDs are let through by the interface, as far as its acceptance filters allow
+                can_filters = get_acceptance_filters(expected_messages, ACCEPTANCE_FILTER_LIMITS.get(self.bustype))
+                logging.info('CAN CH: {} acceptance filters: {}'.format(can_ch, can_filters))
+                if can_ch in self.channel_buses:
+                    bus, notifier, switch = self.channel_buses[can_ch]
+                    # The expected messages change with the DBC files
+                    bus.set_filters(can_filters)
                 else:
-                    self.message_status[str(index)] = [can_ch, str(hex(can_id))[2:].upper(), cycle_ms, 'N/A',
-                                                       'Not Received', 'N/A']
-                    logging.info('CAN CH: {} ID {}: Not Received'.format(can_ch, str(hex(can_id))[2:5].upper()))
+                    bus = can.interface.Bus(interface=self.bustype, channel=can_ch-1, can_filters=can_filters,
+                                            receive_own_messages=False, bitrate=500000, app_name='CANoe')
+
+                # Timestamps go straight into numeric buffers, the ASC log is optional.
+                # Both drop the other frames the merged filters let through.
+                listener = TimestampListener(get_buffer_sizes(expected_messages, self.capture_window_s))
+                listeners = [listener]
+                if self.asc_logging:
+                    listeners.append(ExpectedIdListener(can.ASCWriter('CAN'+str(can_ch)+'_log.asc'),
+                                                        expected_messages['can_id'].tolist()))
+                # One notifier per channel, a short receive timeout keeps stopping them quick
+                if self.keep_buses:
+                    if can_ch not in self.channel_buses:
+                        switch = ListenerSwitch()
+                        self.channel_buses[can_ch] = (bus, can.Notifier(bus, [switch], timeout=0.1), switch)
+                    notifier, switch = self.channel_buses[can_ch][1:]
+                    switch.set_listeners(listeners)
+                else:
+                    notifier = can.Notifier(bus, listeners, timeout=0.1)
+                deadlines = get_capture_deadlines(expected_messages, self.min_frames, self.capture_window_s)
+                self.captures[can_ch] = (bus, notifier, listeners, deadlines)
+        self.detached_channels = set()
+        self.capture_start_s = time()
+        self.capture_timer = threading.Timer(self.capture_window_s, self.end_capture_window)
+        self.capture_timer.daemon = True
+        self.capture_timer.start()
+
+    def end_capture_window(self):
+        """ Detach the capture listeners at the end of the capture window, runs in the timer thread of start_capture
+
+        The buffers then stop growing even if finish_capture is only called after a slow XCP stage.
+
+        :return: None
+        """
+        logging.info('CAN capture window of {:.1f} s is over'.format(self.capture_window_s))
+        for can_ch in sorted(self.captures):
+            self.detach_capture(can_ch)
+
+    def detach_capture(self, can_ch):
+        """ Stop feeding the frames of a channel to its capture listeners, the bus is left open
+
+        :param can_ch: CAN channel
+        :return: None
+        """
+        with self.capture_lock:
+            if can_ch in self.detached_channels:
+                return
+            bus, notifier, listeners, deadlines = self.captures[can_ch]
+            if can_ch in self.channel_buses:
+                # The bus stays open for the next capture, only the listeners of this one are detached
+                self.channel_buses[can_ch][2].set_listeners([])
+            else:
+                notifier.stop()
+            for listener in listeners:
+                listener.stop()
+            self.detached_channels.add(can_ch)
+
+    def stop_capture_timer(self):
+        """ Cancel the end of the capture window, or wait for it if it is running
+
+        :return: None
+        """
+        if self.capture_timer is not None:
+            self.capture_timer.cancel()
+            if self.capture_timer.is_alive():
+                self.capture_timer.join()
+            self.capture_timer = None
+
+    def finish_capture(self):
+        """ Wait until every expected message can be judged or the capture window is over,
+        then check the captured messages in a worker pool
+
+        :return: dictionary of CAN channel -> result of check_messages
+        """
+        from timing_util import CycleStatistics
+
+        # CAN channel -> time the channel could be judged, deepest receive queue seen
+        complete_s = {}
+        queue_depths = dict.fromkeys(self.captures, None)
+        elapsed_s = time() - self.capture_start_s
+        while True:
+            for can_ch, (bus, notifier, listeners, deadlines) in self.captures.items():
+                if can_ch not in complete_s and listeners[0].is_complete(deadlines, self.min_frames, elapsed_s):
+                    complete_s[can_ch] = elapsed_s
+                # Only some interfaces, like virtual, expose their receive queue
+                if hasattr(getattr(bus, 'queue', None), 'qsize'):
+                    queue_depths[can_ch] = max(queue_depths[can_ch] or 0, bus.queue.qsize())
+            if elapsed_s >= self.capture_window_s or len(complete_s) == len(self.captures):
+                break
+            sleep(CAPTURE_POLL_S)
+            elapsed_s = time() - self.capture_start_s
+        logging.info('CAN capture finished after {:.2f} s'.format(elapsed_s))
+        self.stop_capture_timer()
+        # A capture held up by the XCP stage ended with its window
+        capture_s = min(elapsed_s, self.capture_window_s)
+        start_s = perf_counter() - elapsed_s
+        self.metrics.add_stage('capture', capture_s, process_time() - self.capture_start_cpu_s, start_s,
+                               channels=len(self.captures))
+
+        futures = {}
+        pool = ThreadPoolExecutor(max_workers=len(self.captures))
+        for can_ch in sorted(self.captures):
+            bus, notifier, listeners, deadlines = self.captures[can_ch]
+            self.detach_capture(can_ch)
+            if can_ch not in self.channel_buses:
+                bus.shutdown()
+            self.metrics.add_stage('capture CAN{}'.format(can_ch), complete_s.get(can_ch, capture_s), None, start_s,
+                                   frames=sum(listeners[0].counts.values()), other_frames=listeners[0].other_frames,
+                                   max_lag_ms=round(listeners[0].max_lag_s * 1000, 3),
+                                   max_queue_depth=queue_depths[can_ch])
+            timestamps = {self.messages.rows[(can_ch, can_id)]: can_id_timestamps
+                          for can_id, can_id_timestamps in listeners[0].get_timestamps().items()}
+            if self.frame_detail:
+                self.frame_timestamps[can_ch] = timestamps
+            payloads = {self.messages.rows[(can_ch, can_id)]: can_id_payloads
+                        for can_id, can_id_payloads in listeners[0].get_payloads().items()}
+            futures[can_ch] = pool.submit(self.analyse_messages, can_ch,
+                                          CycleStatistics.from_timestamps(self.messages.cycle_ms, timestamps),
+                                          payloads)
+        self.captures = {}
+        # Printed in channel order once all the channels are checked, so the output of the workers does not mix
+        pool.shutdown(wait=True)
+        results = {}
+        for can_ch in sorted(futures):
+            results[can_ch], summary = futures[can_ch].result()
+            print('Checking CAN messages in CAN channel {}'.format(can_ch))
+            print(summary)
+
+        return results
+
+    def start_monitor(self, can_channels, alert, ring_size):
+        """ Start monitoring the expected messages of the channels specified continuously, for soak tests
+
+        :param can_channels: list of CAN channels to monitor
+        :param alert: callable raising the alerts, e.g. monitor_util.AlertLog
+        :param ring_size: frame gaps kept per message
+        :return: dictionary of CAN channel -> RingBufferMonitor
+        """
+        import can
+        from capture_util import ACCEPTANCE_FILTER_LIMITS, get_acceptance_filters
+        from monitor_util import RingBufferMonitor
+
+        print('Monitoring CAN messages..')
+        monitors = {}
+        for can_ch in can_channels:
+            expected_messages = self.messages.definitions[self.messages.get_channel_rows(can_ch)]
+            can_filters = get_acceptance_filters(expected_messages, ACCEPTANCE_FILTER_LIMITS.get(self.bustype))
+            bus = can.interface.Bus(interface=self.bustype, channel=can_ch-1, can_filters=can_filters,
+                                    receive_own_messages=False, bitrate=500000, app_name='CANoe')
+            monitor = RingBufferMonitor(can_ch, expected_messages, alert, ring_size, self.tolerances)
+            self.captures[can_ch] = (bus, can.Notifier(bus, [monitor], timeout=0.1), [monitor], None)
+            monitors[can_ch] = monitor
+
+        return monitors
+
+    def stop_monitor(self):
+        """ Stop monitoring and keep the rolling statistics of the monitored messages as the check results
+
+        :return: None
+        """
+        import numpy as np
+
+        for can_ch in sorted(self.captures):
+            bus, notifier, listeners, deadlines = self.captures[can_ch]
+            notifier.stop()
+            bus.shutdown()
+            # The monitor has the rows of its channel only
+            rows = self.messages.get_channel_rows(can_ch)
+            results = {}
+            for column, values in listeners[0].get_results().items():
+                results[column] = np.zeros(len(self.messages), dtype=values.dtype)
+                results[column][rows] = values
+            self.messages.set_results(rows, results)
+        self.captures = {}
+
+    def abort_capture(self):
+        """ Stop the capture without checking the captured messages
+
+        :return: None
+        """
+        self.stop_capture_timer()
+        for can_ch in sorted(self.captures):
+            bus, notifier, listeners, deadlines = self.captures[can_ch]
+            self.detach_capture(can_ch)
+            if can_ch not in self.channel_buses:
+                bus.shutdown()
+        self.captures = {}
+
+    def check_messages(self, can_ch, statistics, payloads=None):
+        """ Check the captured CAN messages of a channel against the expected messages
+
+        :param can_ch: CAN channel to check for CAN messages
+        :param statistics: CycleStatistics with one row per row of the message table
+        :param payloads: dictionary of row -> numpy array of payloads, to check the signals against their DBC ranges
+        :return: Result of CAN message-checking for the current CAN channel
+        """
+        result, summary = self.analyse_messages(can_ch, statistics, payloads)
+        print('Checking CAN messages in CAN channel {}'.format(can_ch))
+        print(summary)
+
+        return result
+
+    def analyse_messages(self, can_ch, statistics, payloads=None):
+        """ Check the captured CAN messages of a channel without printing, e.g. in a worker thread
+
+        :param can_ch: CAN channel to check for CAN messages
+        :param statistics: CycleStatistics with one row per row of the message table
+        :param payloads: dictionary of row -> numpy array of payloads, to check the signals against their DBC ranges
+        :return: Result of CAN message-checking for the current CAN channel, result line to print
+        """
+        from can_log_util import EXTENDED_ID_FLAG
+        from message_util import RECEIVED, TIMING_NA
+
+        with self.metrics.stage('analysis CAN{}'.format(can_ch)):
+            rows = self.messages.get_channel_rows(can_ch)
+            self.messages.set_results(rows, statistics.get_results(self.tolerances))
+            status = self.messages.results['status'][rows]
+            message_count = len(rows)
+            check_count = int((status == RECEIVED).sum())
+            # Received, with a cycle time, but too few frames for a gap after the skipped frames
+            not_judged = self.messages.definitions['can_id'][rows][
+                (status == RECEIVED) & (self.messages.results['timing'][rows] == TIMING_NA) &
+                (self.messages.cycle_ms[rows] > 0)]
+
+            for row, can_id, received in zip(rows.tolist(), self.messages.definitions['can_id'][rows].tolist(),
+                                             (status == RECEIVED).tolist()):
+                logging.info('CAN CH: {} ID {}: {}'.format(can_ch, str(hex(can_id))[2:5].upper(),
+                                                           'Received' if received else 'Not Received'))
+                if received and payloads is not None and row in payloads and row in self.signal_layouts:
+                    self.check_signals(can_ch, can_id, self.signal_layouts[row], payloads[row])
+        self.metrics.set('CAN{} frames'.format(can_ch), int(self.messages.results['frames'][rows].sum()))
+        self.metrics.set('CAN{} missed frames'.format(can_ch), int(self.messages.results['missed'][rows].sum()))
 
         if check_count == 0:
-            print('Result: Did not receive any message from CAN channel {}'.format(can_ch))
-            return 2
+            result, summary = 2, 'Result: Did not receive any message from CAN channel {}'.format(can_ch)
         elif check_count < message_count:
-            print('Result: {} of {} messages received from CAN channel {}'.format(check_count, message_count,
-                                                                                  can_ch))
-            return 1
-        elif check_count == message_count:
-            print('Result: All expected messages received from CAN channel {}'.format(can_ch))
-            return 0
+            result, summary = 1, 'Result: {} of {} messages received from CAN channel {}'.format(
+                check_count, message_count, can_ch)
         else:
-            pass
+            result, summary = 0, 'Result: All expected messages received from CAN channel {}'.format(can_ch)
+        if len(not_judged) > 0:
+            warning = 'Warning: too few frames to judge the cycle time of {} from CAN channel {}'.format(
+                ', '.join('{:X}'.format(can_id & ~EXTENDED_ID_FLAG) for can_id in not_judged.tolist()), can_ch)
+            logging.warning(warning)
+            summary = '{}\n{}'.format(summary, warning)
+
+        return result, summary
 
-    def generate_report(self):
-        """ Generates a simple report of the CAN message checking in Excel format
+    def check_signals(self, can_ch, can_id, layout, payloads):
+        """ Decode the captured payloads of a message and check its signals against their DBC ranges
 
+        :param can_ch: CAN channel of the message
+        :param can_id: CAN ID of the message
+        :param layout: SignalLayout of the message
+        :param payloads: numpy array of payloads
         :return: None
         """
+        import numpy as np
+
+        results = layout.check(payloads)
+        for index, name in enumerate(layout.names):
+            out_of_range = int(results['out_of_range'][index])
+            if out_of_range > 0:
+                status = 'Out of Range'
+                logging.info('CAN CH: {} ID {}: {} out of range {} times'.format(
+                    can_ch, str(hex(can_id))[2:].upper(), name, out_of_range))
+            else:
+                status = 'OK'
+            constant = bool(results['constant'][index])
+            if constant:
+                logging.info('CAN CH: {} ID {}: {} is constant at {}'.format(
+                    can_ch, str(hex(can_id))[2:].upper(), name, float(results['last'][index])))
+            self.signal_status.append([can_ch, str(hex(can_id))[2:].upper(), name,
+                                       float(results['min'][index]), float(results['max'][index]),
+                                       float(results['last'][index]),
+                                       float(layout.minimum[index]) if layout.ranged[index] else np.nan,
+                                       float(layout.maximum[index]) if layout.ranged[index] else np.nan,
+                                       out_of_range, constant, status])
+
+    def check_log(self, log_file, can_ch=None, processes=None):
+        """ Check a recorded ASC or BLF log against the expected messages, without a CAN interface
+
+        :param log_file: path of the .asc or .blf log
+        :param can_ch: CAN channel of all the frames in the log, default is the channel recorded in the log
+        :param processes: number of worker processes for large ASC logs
+        :return: dictionary of CAN channel -> result of check_messages
+        """
+        from can_log_util import analyse_log
+
+        print('Analysing {}..'.format(log_file))
+        with self.metrics.stage('log analysis', log_file=str(log_file)):
+            statistics = analyse_log(log_file, self.messages.rows, self.messages.cycle_ms, can_ch, processes)
+        channels = [can_ch] if can_ch else self.messages.get_channels()
+        results = {}
+        for channel in channels:
+            results[channel] = self.check_messages(channel, statistics)
+
+        return results
+
+    def iter_frame_rows(self):
+        """ list the captured frames of the expected messages, one message at a time
+
+        :return: generator of (CAN channel, CAN ID, timestamp in seconds, gap to the previous frame in ms)
+        """
+        import numpy as np
+
+        for can_ch in sorted(self.frame_timestamps):
+            for row, timestamps in sorted(self.frame_timestamps[can_ch].items()):
+                can_id = '{:X}'.format(int(self.messages.definitions['can_id'][row]))
+                gaps_ms = np.concatenate(([np.nan], np.diff(timestamps) * 1000))
+                for timestamp, gap_ms in zip(timestamps.tolist(), gaps_ms.tolist()):
+                    yield can_ch, can_id, timestamp, gap_ms
+
+    def generate_report(self, report_formats=('xlsx',)):
+        """ Generates a simple report of the CAN message checking
+
+        :param report_formats: list of report formats, keys of report_util.REPORT_WRITERS
+        :return: None
+        """
+        from report_util import REPORT_WRITERS
+        from timing_util import JITTER_PERCENTILE
+        import numpy as np
+
         print('Generating report..')
-        # Dump result to an Excel file
-        data_frame = pd.DataFrame.from_dict(self.message_status, orient='index',
-                                            columns=['CAN Channel', 'CAN ID', 'Cycle (ms)', 'Average Cycle (ms)',
-                                                     'Status', 'Timing', 'Notes']
-                                            )
-        write_to_excel(data_frame, 'SVS350_{}_CANTx_Checklist.xlsx'.format(self.variant), self.variant)
+        # The columns of the message table are used as they are
+        columns = self.messages.get_columns(JITTER_PERCENTILE)
+        notes = np.full(len(columns['Timing']), '', dtype=object)
+        if self.asc_logging:
+            failed = columns['Timing'] == 'Failed'
+            notes[failed] = ['Please refer to CAN{}_log.asc'.format(can_ch)
+                             for can_ch in columns['CAN Channel'][failed].tolist()]
+        columns['Notes'] = notes
+
+        for report_format in report_formats:
+            try:
+                writer = REPORT_WRITERS[report_format]('SVS350_{}_CANTx_Checklist'.format(self.variant))
+            except ImportError as e:
+                print('Unable to write the {} report: {}'.format(report_format, e))
+                continue
+            with self.metrics.stage('report {}'.format(report_format)), writer:
+                writer.write_columns(self.variant, columns)
+                if self.signal_status:
+                    writer.write_rows('Signals', ['CAN Channel', 'CAN ID', 'Signal', 'Min', 'Max', 'Last', 'Range Min',
+                                                  'Range Max', 'Out of Range', 'Constant', 'Status'],
+                                      self.signal_status,
+                                      [int, str, str, float, float, float, float, float, int, bool, str])
+                if self.flash_verification:
+                    writer.write_rows('Flash', ['Address', 'Size', 'Checksum Type', 'Checksum', 'Status'],
+                                      self.flash_verification, [str, int, str, str, str])
+                if self.frame_timestamps:
+                    writer.write_rows('Frames', ['CAN Channel', 'CAN ID', 'Timestamp (s)', 'Gap (ms)'],
+                                      self.iter_frame_rows(), [int, str, float, float])
+            logging.info('Report written to {}'.format(', '.join(writer.files)))
         print('Done!')
 
+    def reset_results(self):
+        """ clear the results of the last check before checking the same messages again, the stub version is kept
+
+        :return: None
+        """
+        self.messages.reset_results()
+        self.signal_status = []
+        self.frame_timestamps = {}
+        self.daq_samples = {}
+        self.flash_verification = []
+
+    def get_summary(self):
+        """ summarize the last check: stub version, and per CAN channel the missing and mistimed messages
+
+        :return: dictionary of JSON-serializable values
+        """
+        from message_util import NOT_RECEIVED, RECEIVED, TIMING_FAILED
+
+        channels = {}
+        for can_ch in self.messages.get_channels():
+            rows = self.messages.get_channel_rows(can_ch)
+            status = self.messages.results['status'][rows]
+            can_ids = self.messages.definitions['can_id'][rows]
+            channels[can_ch] = {
+                'expected': len(rows),
+                'received': int((status == RECEIVED).sum()),
+                'not_received': ['{:X}'.format(can_id) for can_id in can_ids[status == NOT_RECEIVED].tolist()],
+                'timing_failed': ['{:X}'.format(can_id) for can_id in
+                                  can_ids[self.messages.results['timing'][rows] == TIMING_FAILED].tolist()],
+            }
+
+        return {'variant': self.variant, 'stub_version': self.stub_version, 'channels': channels}
+
+    def save_history(self, source, db_file):
+        """ store the statistics of this run with the stub version and the map and DBC hashes in the run history
+
+        :param source: 'target' or the recorded log files
+        :param db_file: run history database
+        :return: run ID
+        """
+        from history_util import RunHistory
+        import hashlib
+
+        map_file = self.map_folder / 'application.map'
+        if self.map_index is not None and self.map_index.map_hash is not None:
+            map_hash = self.map_index.map_hash
+        else:
+            map_hash = get_file_hash(map_file) if map_file.exists() else None
+        dbc_hash = hashlib.sha1(''.join(get_file_hash(dbc_file) for can_ch, dbc_file in self.dbc_files)
+                                .encode('ascii')).hexdigest()
+
+        with self.metrics.stage('history'):
+            run_id = RunHistory(db_file).add_run(self.variant, source, self.messages, self.stub_version, map_hash,
+                                                 dbc_hash)
+        print('Run {} saved to {}'.format(run_id, db_file))
+        return run_id
+
+
+def parse_tolerance_argument(text):
+    """ argparse type of the -t option, see timing_util.parse_tolerance """
+    from timing_util import parse_tolerance
+
+    return parse_tolerance(text)
+
 
-if sys.version_info < MIN_PYTHON:
-    sys.exit("Python %s.%s or later is required. Please check your Python version.\n" % MIN_PYTHON)
+def parse_variable_argument(text):
+    """ argparse type of the -r and -w options, see xcp_util.parse_variable """
+    from xcp_util import parse_variable
 
-debug = False
-parser = argparse.ArgumentParser()
-if debug:
-    parser.add_argument('-i', dest='variant', help='set to GC7, for debugging purposes', default='GC7')
-else:
+    return parse_variable(text)
+
+
+def check_recorded_log(argv):
+    """ offline subcommand: check recorded logs against the DBC files, without a CAN interface
+
+    :param argv: command line arguments after 'offline'
+    :return: None
+    """
+    parser = argparse.ArgumentParser(prog='PostFlashPreTestCheck.py offline')
     parser.add_argument("variant", help='variant to be checked', choices=['GC7', 'HR3'])
-parser.add_argument('-m', dest="map_folder", help='path of the MAP file', default='Build/')
-parser.add_argument('-d', dest="dbc_folder", help='path of the DBC folders for each variant', default='DBC/')
-args = parser.parse_args()
-
-if not os.path.exists(args.map_folder):
-    print('{} folder not found!'.format(args.map_folder))
-elif not os.path.exists(os.path.join(args.map_folder, 'application.map')):
-    print('application.map file not found in {} folder!'.format(args.map_folder))
-elif not os.path.exists(args.dbc_folder):
-    print('DBC folder not found!')
-else:
-    dbc_variant_folder_found = False
-    dbc_files_found = False
-    for dbc_root, dbc_dirs, dbc_files in os.walk(args.dbc_folder):
-        if dbc_root.find(args.variant) != -1:
-            dbc_variant_folder_found = True
-            for dbc_file in dbc_files:
-                if dbc_file.endswith(".dbc"):
-                    dbc_files_found = True
-                    break
-            break
-
-    if not dbc_variant_folder_found:
-        print('{} folder not found in the DBC folder!'.format(args.variant))
-    elif not dbc_files_found:
-        print('DBC files for {} not found in the DBC folder!'.format(args.variant))
-    else:
-        pretest_check = PostFlashPreTestCheck(args.variant, args.map_folder, args.dbc_folder)
-
-        # Update with address of StubVersion_Main
-    # if not debug:
-        signal_address, found = pretest_check.get_stub_variable_addresses()
-        if found:
-            print('')
-            message1 = can.Message(arbitration_id=0x7E0,
-                                   data=[0xF4, 1, 0x0, 0x0,
-                                         signal_address['StubVersion_Main'] & 0xFF,
-                                         (signal_address['StubVersion_Main'] >> 8) & 0xFF,
-                                         (signal_address['StubVersion_Main'] >> 16) & 0xFF,
-                                         (signal_address['StubVersion_Main'] >> 24) & 0xFF],
-                                   extended_id=False)
-            message2 = can.Message(arbitration_id=0x7E0,
-                                   data=[0xF4, 1, 0x0, 0x0,
-                                         signal_address['StubVersion_Sub'] & 0xFF,
-                                         (signal_address['StubVersion_Sub'] >> 8) & 0xFF,
-                                         (signal_address['StubVersion_Sub'] >> 16) & 0xFF,
-                                         (signal_address['StubVersion_Sub'] >> 24) & 0xFF],
-                                   extended_id=False)
-            print('Starting post-flash checking..')
-            # Connect to the XCP slave
-            pretest_check.connect_to_xcp(2)
-            # pretest_check.connect()
-            # Poll the output signal every 10ms
-            pretest_check.get_stub_version(message1, message2)
-            sleep(1)
+    parser.add_argument("log_files", nargs='+', help='recorded .asc or .blf logs')
+    parser.add_argument('-d', dest="dbc_folder", help='path of the DBC folders for each variant', default='DBC/')
+    parser.add_argument('-n', dest="can_ch", type=int, choices=[1, 2, 3, 4],
+                        help='CAN channel of all the frames, for single-channel logs like CAN<n>_log.asc')
+    parser.add_argument('-j', dest="processes", type=int, default=None,
+                        help='number of processes for large ASC logs, default is the number of CPUs')
+    parser.add_argument('-t', dest="tolerances", nargs='+', type=parse_tolerance_argument, default=[],
+                        metavar='KEY=VALUE',
+                        help='timing tolerances: mean_pct, jitter_pct, max_missed, max_bursts')
+    parser.add_argument('-o', dest="report_formats", nargs='+', choices=REPORT_FORMATS, default=['xlsx'],
+                        help='report formats, default is xlsx')
+    parser.add_argument('-b', dest="history_db", default=HISTORY_DB, help='run history database, default is {}'
+                        .format(HISTORY_DB))
+    parser.add_argument('-k', dest="metrics_file", default=METRICS_FILE,
+                        help='stage timings and counters, default is {}'.format(METRICS_FILE))
+    parser.add_argument('-z', dest="profiler", choices=PROFILERS,
+                        help='also profile the run with cProfile or trace its memory allocations')
+    args = parser.parse_args(argv)
+
+    metrics = RunMetrics(args.profiler)
+    pretest_check = PostFlashPreTestCheck(args.variant, 'Build/', args.dbc_folder, tolerances=dict(args.tolerances),
+                                          metrics=metrics)
+    pretest_check.create_message_list()
+    for log_file in args.log_files:
+        if not os.path.exists(log_file):
+            print('{} not found!'.format(log_file))
+        else:
+            pretest_check.check_log(log_file, args.can_ch, args.processes)
+    logging.shutdown()
+    pretest_check.generate_report(args.report_formats)
+    pretest_check.save_history(', '.join(os.path.basename(log_file) for log_file in args.log_files), args.history_db)
+    metrics.write(args.metrics_file)
+
+
+def show_history(argv):
+    """ history subcommand: list the latest runs, or the messages that changed since a base run
+
+    :param argv: command line arguments after 'history'
+    :return: None
+    """
+    from history_util import STAT_COLUMNS, RunHistory
+
+    parser = argparse.ArgumentParser(prog='PostFlashPreTestCheck.py history')
+    parser.add_argument("variant", help='variant to be checked', choices=['GC7', 'HR3'])
+    parser.add_argument('-b', dest="history_db", default=HISTORY_DB, help='run history database, default is {}'
+                        .format(HISTORY_DB))
+    parser.add_argument('-s', dest="base_run", type=int, help='base run to compare against')
+    parser.add_argument('-r', dest="run_id", type=int, help='run to compare, default is the latest run')
+    parser.add_argument('-x', dest="change_pct", type=float, default=5.0,
+                        help='smallest change in %% of the base run, default is 5')
+    parser.add_argument('-c', dest="column", choices=STAT_COLUMNS, default='mean_ms',
+                        help='statistic to compare, default is mean_ms')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.history_db):
+        print('{} not found!'.format(args.history_db))
+        return
+    history = RunHistory(args.history_db)
+    if args.base_run is None:
+        for run_id, started, source, stub_main, stub_sub, map_hash, dbc_hash in history.get_runs(args.variant):
+            print('{:>6}  {}  stub {}.{}  map {}  DBC {}  {}'.format(run_id, started, stub_main, stub_sub,
+                                                                     (map_hash or '-')[:8], (dbc_hash or '-')[:8],
+                                                                     source))
+        return
+
+    run_id = args.run_id or history.get_latest_run(args.variant)
+    regressions = history.find_regressions(args.base_run, run_id, args.change_pct, args.column)
+    print('{} messages changed {} by more than {}% from run {} to run {}'.format(
+        len(regressions), args.column, args.change_pct, args.base_run, run_id))
+    for can_ch, can_id, base_value, value, change_pct in regressions:
+        print('CAN CH: {} ID {:X}: {:.3f} -> {:.3f} ({:+.1f}%)'.format(can_ch, can_id, base_value, value, change_pct))
+
+
+def lookup_symbols(map_folder, symbol_names):
+    """ map lookup stage: print the addresses of symbols in application.map, without a CAN interface
+
+    :param map_folder: path of the MAP file
+    :param symbol_names: list of symbol names
+    :return: dictionary of symbol name -> address, for the symbols found
+    """
+    addresses = MapIndex(Path(map_folder) / 'application.map').lookup(symbol_names)
+    for name in symbol_names:
+        print('{}: {}'.format(name, hex(addresses[name]) if name in addresses else 'not found'))
+
+    return addresses
+
+
+def check_xcp(pretest_check, args, watch=True):
+    """ XCP stage: read the stub version, then verify the flash, read and watch the variables requested
+
+    :param pretest_check: PostFlashPreTestCheck
+    :param args: parsed command line arguments of check_target
+    :param watch: start the DAQ list of the -w variables, the XCP connection is then kept open
+    :return: True if the DAQ list was started
+    """
+    signal_address, found = pretest_check.get_stub_variable_addresses()
+    watching = False
+    if found:
+        print('')
+        print('Starting post-flash checking..')
+        # Connect to the XCP slave
+        pretest_check.connect_to_xcp(2)
+        pretest_check.get_stub_version(signal_address)
+        if args.verify_flash:
+            pretest_check.verify_flash(os.path.join(args.map_folder, 'application.hex'))
+        if args.variables:
+            pretest_check.read_variables(dict(args.variables))
+        if watch and args.watch_variables:
+            watching = pretest_check.start_watch(dict(args.watch_variables), args.event_channel)
+        if not watching:
             # Disconnect from XCP slave
             pretest_check.disconnect_from_xcp()
+    else:
+        print('Cannot determine stub version. '
+              'Please make sure the latest version of the application stub modules is used.')
+
+    return watching
+
+
+def check_target(argv=None):
+    """ default command: query the stub version and check the CAN Tx messages of the target
+
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    debug = False
+    parser = argparse.ArgumentParser()
+    if debug:
+        parser.add_argument('-i', dest='variant', help='set to GC7, for debugging purposes', default='GC7')
+    else:
+        parser.add_argument("variant", help='variant to be checked', choices=['GC7', 'HR3'])
+    parser.add_argument('-m', dest="map_folder", help='path of the MAP file', default='Build/')
+    parser.add_argument('-d', dest="dbc_folder", help='path of the DBC folders for each variant', default='DBC/')
+    parser.add_argument('-l', dest="lookup_symbols", nargs='+', default=[], metavar='SYMBOL',
+                        help='only look up the addresses of symbols in application.map')
+    parser.add_argument('-s', dest="stub_only", action='store_true',
+                        help='only check the stub version (and -c, -r), without the CAN check and the report')
+    parser.add_argument('-r', dest="variables", nargs='+', type=parse_variable_argument, default=[],
+                        metavar='SYMBOL[:FORMAT]',
+                        help='variables to read after the stub version, FORMAT is one of bBhHiIlLqQfd, default is B')
+    parser.add_argument('-w', dest="watch_variables", nargs='+', type=parse_variable_argument, default=[],
+                        metavar='SYMBOL[:FORMAT]',
+                        help='variables to stream through XCP DAQ during the CAN capture, FORMAT as for -r')
+    parser.add_argument('-e', dest="event_channel", type=int, default=0, help='XCP event channel of the DAQ list')
+    parser.add_argument('-c', dest="verify_flash", action='store_true',
+                        help='verify the flash checksums against application.hex in the map folder')
+    parser.add_argument('-t', dest="tolerances", nargs='+', type=parse_tolerance_argument, default=[],
+                        metavar='KEY=VALUE', help='timing tolerances: mean_pct, jitter_pct, max_missed, max_bursts')
+    parser.add_argument('-a', dest="asc_logging", help='also log the captured frames to CAN<n>_log.asc',
+                        action='store_true')
+    parser.add_argument('-o', dest="report_formats", nargs='+', choices=REPORT_FORMATS, default=['xlsx'],
+                        help='report formats, default is xlsx')
+    parser.add_argument('-f', dest="frame_detail", action='store_true',
+                        help='add every captured frame of the expected messages to the report')
+    parser.add_argument('-b', dest="history_db", default=HISTORY_DB, help='run history database, default is {}'
+                        .format(HISTORY_DB))
+    parser.add_argument('-u', dest="bustype", choices=['vector', 'virtual'], default='vector',
+                        help='CAN interface, virtual is used with ecu_simulator.py, default is vector')
+    parser.add_argument('-k', dest="metrics_file", default=METRICS_FILE,
+                        help='stage timings and counters, default is {}'.format(METRICS_FILE))
+    parser.add_argument('-z', dest="profiler", choices=PROFILERS,
+                        help='also profile the run with cProfile or trace its memory allocations')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.map_folder):
+        print('{} folder not found!'.format(args.map_folder))
+    elif not os.path.exists(os.path.join(args.map_folder, 'application.map')):
+        print('application.map file not found in {} folder!'.format(args.map_folder))
+    elif args.lookup_symbols:
+        lookup_symbols(args.map_folder, args.lookup_symbols)
+    elif args.stub_only:
+        metrics = RunMetrics(args.profiler)
+        pretest_check = PostFlashPreTestCheck(args.variant, args.map_folder, args.dbc_folder, bustype=args.bustype,
+                                              metrics=metrics)
+        check_xcp(pretest_check, args, watch=False)
+        metrics.write(args.metrics_file)
+    elif not os.path.exists(args.dbc_folder):
+        print('DBC folder not found!')
+    else:
+        dbc_variant_folder_found = False
+        dbc_files_found = False
+        for dbc_root, dbc_dirs, dbc_files in os.walk(args.dbc_folder):
+            if dbc_root.find(args.variant) != -1:
+                dbc_variant_folder_found = True
+                for dbc_file in dbc_files:
+                    if dbc_file.endswith(".dbc"):
+                        dbc_files_found = True
+                        break
+                break
+
+        if not dbc_variant_folder_found:
+            print('{} folder not found in the DBC folder!'.format(args.variant))
+        elif not dbc_files_found:
+            print('DBC files for {} not found in the DBC folder!'.format(args.variant))
         else:
-            print('Cannot determine stub version. '
-                  'Please make sure the latest version of the application stub modules is used.')
+            metrics = RunMetrics(args.profiler)
+            pretest_check = PostFlashPreTestCheck(args.variant, args.map_folder, args.dbc_folder, args.asc_logging,
+                                                  dict(args.tolerances), args.frame_detail, args.bustype, metrics)
+            pretest_check.create_message_list()
+            # Capture all CAN channels in the background while the stub version is checked
+            pretest_check.start_capture([1, 2, 3, 4])
+
+            watching = check_xcp(pretest_check, args)
+
+            pretest_check.finish_capture()
+            if watching:
+                pretest_check.stop_watch()
+                pretest_check.disconnect_from_xcp()
+            logging.shutdown()
+            # print('Please check the run.log file')
+            pretest_check.generate_report(args.report_formats)
+            pretest_check.save_history('target', args.history_db)
+            metrics.write(args.metrics_file)
 
+
+def run_watch_check(pretest_check, args, changed, metrics_file):
+    """ one check of the watch mode, only the stages affected by the changed files are run again
+
+    :param pretest_check: PostFlashPreTestCheck with keep_buses
+    :param args: parsed command line arguments of watch_target
+    :param changed: set of 'map' (a new build) and 'dbc'
+    :param metrics_file: path of the metrics file
+    :return: dictionary of the results, from get_summary
+    """
+    pretest_check.metrics = RunMetrics()
+    if 'dbc' in changed or pretest_check.messages is None:
         pretest_check.create_message_list()
-        print('Waiting for CAN messages..')
-        pretest_check.wait_for_messages(1)
-        pretest_check.wait_for_messages(2)
-        pretest_check.wait_for_messages(3)
-        pretest_check.wait_for_messages(4)
-        logging.shutdown()
-        # print('Please check the run.log file')
-        pretest_check.generate_report()
+    # The signal, frame and flash results of the last check are cleared also when the table is new
+    pretest_check.reset_results()
+    if 'map' in changed:
+        # The map index is cached by the hash of the map file
+        pretest_check.map_index = None
+        pretest_check.stub_version = {}
+    pretest_check.start_capture([1, 2, 3, 4])
+    try:
+        if 'map' in changed and os.path.exists(os.path.join(args.map_folder, 'application.map')):
+            check_xcp(pretest_check, args, watch=False)
+    except BaseException:
+        # The XCP stages exit on fatal errors, the kept buses must not feed this capture until the next check
+        pretest_check.abort_capture()
+        raise
+    pretest_check.finish_capture()
+    pretest_check.generate_report(args.report_formats)
+    run_id = pretest_check.save_history('target', args.history_db)
+    pretest_check.metrics.write(metrics_file)
+
+    return dict(pretest_check.get_summary(), run_id=run_id, changed=sorted(changed))
+
+
+def watch_target(argv):
+    """ watch subcommand: keep the buses and the parsed DBC files, check the target again when
+    application.map or the DBC files change
+
+    :param argv: command line arguments after 'watch'
+    :return: None
+    """
+    from watch_util import WATCH_RESULTS, FileWatcher, ResultPublisher
+
+    parser = argparse.ArgumentParser(prog='PostFlashPreTestCheck.py watch')
+    parser.add_argument("variant", help='variant to be checked', choices=['GC7', 'HR3'])
+    parser.add_argument('-m', dest="map_folder", help='path of the MAP file', default='Build/')
+    parser.add_argument('-d', dest="dbc_folder", help='path of the DBC folders for each variant', default='DBC/')
+    parser.add_argument('-r', dest="variables", nargs='+', type=parse_variable_argument, default=[],
+                        metavar='SYMBOL[:FORMAT]',
+                        help='variables to read after the stub version, FORMAT is one of bBhHiIlLqQfd, default is B')
+    parser.add_argument('-c', dest="verify_flash", action='store_true',
+                        help='verify the flash checksums against application.hex in the map folder')
+    parser.add_argument('-t', dest="tolerances", nargs='+', type=parse_tolerance_argument, default=[],
+                        metavar='KEY=VALUE', help='timing tolerances: mean_pct, jitter_pct, max_missed, max_bursts')
+    parser.add_argument('-o', dest="report_formats", nargs='+', choices=REPORT_FORMATS, default=['xlsx'],
+                        help='report formats, default is xlsx')
+    parser.add_argument('-b', dest="history_db", default=HISTORY_DB, help='run history database, default is {}'
+                        .format(HISTORY_DB))
+    parser.add_argument('-u', dest="bustype", choices=['vector', 'virtual'], default='vector',
+                        help='CAN interface, default is vector')
+    parser.add_argument('-k', dest="metrics_file", default=METRICS_FILE,
+                        help='stage timings and counters of the last check, default is {}'.format(METRICS_FILE))
+    parser.add_argument('-i', dest="interval_s", type=float, default=2.0,
+                        help='seconds between two polls of the files, default is 2')
+    parser.add_argument('-j', dest="results_file", default=WATCH_RESULTS,
+                        help='file with the result of the last check, default is {}'.format(WATCH_RESULTS))
+    parser.add_argument('-p', dest="port", type=int, help='also serve the last result on this local TCP port')
+    args = parser.parse_args(argv)
+    args.watch_variables = []
+
+    map_file = os.path.join(args.map_folder, 'application.map')
+    watcher = FileWatcher({
+        'map': lambda: [map_file],
+        'dbc': lambda: sorted(str(dbc_file) for dbc_file in Path(args.dbc_folder).rglob('*.dbc')
+                              if args.variant in str(dbc_file.parent)),
+    })
+    publisher = ResultPublisher(args.results_file, args.port)
+    pretest_check = PostFlashPreTestCheck(args.variant, args.map_folder, args.dbc_folder,
+                                          tolerances=dict(args.tolerances), bustype=args.bustype, keep_buses=True)
+    print('Watching {} and the {} DBC files, press Ctrl+C to stop'.format(map_file, args.variant))
+    changed = {'map', 'dbc'}
+    try:
+        while True:
+            if changed:
+                logging.info('Checking the target, changed: {}'.format(', '.join(sorted(changed))))
+                try:
+                    result = run_watch_check(pretest_check, args, changed, args.metrics_file)
+                except SystemExit as e:
+                    # The stages exit on fatal errors, the next change is checked again
+                    logging.error('Check aborted: {}'.format(e))
+                    print('Check aborted, waiting for the next change')
+                    result = {'variant': pretest_check.variant, 'changed': sorted(changed), 'error': str(e)}
+                publisher.publish(result)
+                print('Result published to {}'.format(args.results_file))
+            sleep(args.interval_s)
+            changed = watcher.poll()
+    except KeyboardInterrupt:
+        print('Stopped watching')
+    finally:
+        pretest_check.close_buses()
+        publisher.close()
+
+
+def soak_target(argv):
+    """ soak subcommand: monitor the CAN Tx messages of the target continuously with bounded memory,
+    with periodic snapshots and immediate alerts
+
+    :param argv: command line arguments after 'soak'
+    :return: None
+    """
+    from datetime import datetime
+    from monitor_util import ALERTS_FILE, RING_SIZE, SNAPSHOTS_FILE, AlertLog
+    import json
+
+    parser = argparse.ArgumentParser(prog='PostFlashPreTestCheck.py soak')
+    parser.add_argument("variant", help='variant to be checked', choices=['GC7', 'HR3'])
+    parser.add_argument('-d', dest="dbc_folder", help='path of the DBC folders for each variant', default='DBC/')
+    parser.add_argument('-t', dest="tolerances", nargs='+', type=parse_tolerance_argument, default=[],
+                        metavar='KEY=VALUE', help='timing tolerances: mean_pct, jitter_pct, max_missed, max_bursts')
+    parser.add_argument('-l', dest="ring_size", type=int, default=RING_SIZE,
+                        help='frame gaps kept per message for the rolling statistics, default is {}'.format(RING_SIZE))
+    parser.add_argument('-s', dest="snapshot_s", type=float, default=60.0,
+                        help='seconds between two snapshots, default is 60')
+    parser.add_argument('-x', dest="duration_s", type=float, default=0.0,
+                        help='length of the test in seconds, default is until Ctrl+C')
+    parser.add_argument('-f', dest="snapshots_file", default=SNAPSHOTS_FILE,
+                        help='snapshots are appended to this file, default is {}'.format(SNAPSHOTS_FILE))
+    parser.add_argument('-a', dest="alerts_file", default=ALERTS_FILE,
+                        help='alerts are appended to this file, default is {}'.format(ALERTS_FILE))
+    parser.add_argument('-o', dest="report_formats", nargs='+', choices=REPORT_FORMATS, default=['xlsx'],
+                        help='formats of the report at the end of the test, default is xlsx')
+    parser.add_argument('-b', dest="history_db", default=HISTORY_DB, help='run history database, default is {}'
+                        .format(HISTORY_DB))
+    parser.add_argument('-u', dest="bustype", choices=['vector', 'virtual'], default='vector',
+                        help='CAN interface, default is vector')
+    args = parser.parse_args(argv)
+
+    pretest_check = PostFlashPreTestCheck(args.variant, 'Build/', args.dbc_folder, tolerances=dict(args.tolerances),
+                                          bustype=args.bustype)
+    pretest_check.create_message_list()
+    alert_log = AlertLog(args.alerts_file)
+    monitors = pretest_check.start_monitor([1, 2, 3, 4], alert_log, args.ring_size)
+    start_s = time()
+    next_snapshot_s = start_s + args.snapshot_s
+    print('Soak test running, press Ctrl+C to stop')
+    try:
+        with open(args.snapshots_file, 'a') as fp:
+            while not args.duration_s or time() - start_s < args.duration_s:
+                sleep(MONITOR_POLL_S)
+                now_s = time()
+                for monitor in monitors.values():
+                    monitor.check_stopped(now_s)
+                alert_log.write_pending()
+                if now_s >= next_snapshot_s:
+                    next_snapshot_s += args.snapshot_s
+                    snapshot = {'time': datetime.fromtimestamp(now_s).isoformat(timespec='seconds'),
+                                'elapsed_s': round(now_s - start_s, 3), 'alerts': alert_log.count,
+                                'channels': {can_ch: monitor.get_snapshot() for can_ch, monitor in monitors.items()}}
+                    fp.write(json.dumps(snapshot) + '\n')
+                    fp.flush()
+                    print('{} s: {} frames, {} of {} messages in tolerance, {} alerts'.format(
+                        int(now_s - start_s), sum(channel['frames'] for channel in snapshot['channels'].values()),
+                        sum(channel['passed'] for channel in snapshot['channels'].values()),
+                        len(pretest_check.messages), alert_log.count))
+    except KeyboardInterrupt:
+        print('Soak test stopped')
+    finally:
+        pretest_check.stop_monitor()
+        alert_log.close()
+    pretest_check.generate_report(args.report_formats)
+    pretest_check.save_history('soak', args.history_db)
+
+
+def main(argv=None):
+    """ command line entry point
+
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    if sys.version_info < MIN_PYTHON:
+        sys.exit("Python %s.%s or later is required. Please check your Python version.\n" % MIN_PYTHON)
+    argv = sys.argv[1:] if argv is None else argv
+
+    # Configured here so the worker processes of the offline analysis do not truncate the log
+    logging.basicConfig(filename='run.log', filemode='w', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if argv[:1] == ['offline']:
+        check_recorded_log(argv[1:])
+    elif argv[:1] == ['history']:
+        show_history(argv[1:])
+    elif argv[:1] == ['watch']:
+        watch_target(argv[1:])
+    elif argv[:1] == ['soak']:
+        soak_target(argv[1:])
+    else:
+        check_target(argv)
+
+
+if __name__ == '__main__':
+    main()
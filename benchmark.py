@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import print_function
+from contextlib import redirect_stdout
+from datetime import datetime
+from time import perf_counter
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BENCHMARK_RESULTS = 'benchmark_results.jsonl'
+DEFAULT_SIZES = [100, 1000, 4000]
+# Map symbols per expected message
+SYMBOLS_PER_MESSAGE = 100
+# A stage slower than its previous result by more than this is flagged
+REGRESSION_PCT = 10.0
+
+
+def time_stage(function, repeat):
+    """ time a stage, the output of the stage is discarded
+
+    :param function: callable running the stage
+    :param repeat: number of runs
+    :return: shortest run time in seconds
+    """
+    best_s = None
+    for run in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start_s = perf_counter()
+            function()
+            elapsed_s = perf_counter() - start_s
+        best_s = elapsed_s if best_s is None else min(best_s, elapsed_s)
+
+    return best_s
+
+
+def run_benchmarks(work_folder, size, variant, duration_s, repeat):
+    """ generate the synthetic inputs of one size and time the stages on them
+
+    :param work_folder: folder of the generated files, also the working directory of the stages
+    :param size: number of expected messages
+    :param variant: 'GC7' or 'HR3'
+    :param duration_s: length of the capture and of the ASC log in seconds
+    :param repeat: number of runs per stage
+    :return: list of (stage, seconds, details)
+    """
+    from PostFlashPreTestCheck import CAPTURE_TIME_S, PostFlashPreTestCheck
+    from synthetic_util import generate_messages, generate_timestamps, write_asc_log, write_dbc_tree, \
+        write_map_file
+    from timing_util import CycleStatistics
+
+    messages = generate_messages(size)
+    write_dbc_tree(os.path.join(work_folder, 'DBC'), variant, messages)
+    write_map_file(os.path.join(work_folder, 'Build', 'application.map'), size * SYMBOLS_PER_MESSAGE)
+    frame_count = write_asc_log(os.path.join(work_folder, 'bus.asc'), messages, duration_s)
+    os.chdir(work_folder)
+    results = []
+
+    def new_check():
+        return PostFlashPreTestCheck(variant, 'Build/', 'DBC/')
+
+    def create_message_list_cold():
+        shutil.rmtree('.dbc_cache', ignore_errors=True)
+        new_check().create_message_list()
+
+    results.append(('create_message_list (cold)', time_stage(create_message_list_cold, repeat), {}))
+    results.append(('create_message_list (cached)', time_stage(lambda: new_check().create_message_list(), repeat),
+                    {}))
+
+    def get_stub_variable_addresses_cold():
+        shutil.rmtree('.map_cache', ignore_errors=True)
+        new_check().get_stub_variable_addresses()
+
+    results.append(('get_stub_variable_addresses (cold)', time_stage(get_stub_variable_addresses_cold, repeat),
+                    {'symbols': size * SYMBOLS_PER_MESSAGE}))
+    results.append(('get_stub_variable_addresses (cached)',
+                    time_stage(lambda: new_check().get_stub_variable_addresses(), repeat),
+                    {'symbols': size * SYMBOLS_PER_MESSAGE}))
+
+    # The analysis of wait_for_messages, on the timestamps a capture of CAPTURE_TIME_S would buffer
+    pretest_check = new_check()
+    with redirect_stdout(io.StringIO()):
+        pretest_check.create_message_list()
+    capture = generate_timestamps(messages, CAPTURE_TIME_S, seed=1)
+    rows = pretest_check.messages.rows
+    channel_timestamps = {}
+    for message, timestamps in zip(messages, capture):
+        channel_timestamps.setdefault(message['can_ch'], {})[rows[(message['can_ch'], message['can_id'])]] = timestamps
+
+    def analyse_capture():
+        for can_ch, timestamps in sorted(channel_timestamps.items()):
+            pretest_check.check_messages(can_ch, CycleStatistics.from_timestamps(pretest_check.messages.cycle_ms,
+                                                                                 timestamps))
+
+    results.append(('wait_for_messages analysis', time_stage(analyse_capture, repeat),
+                    {'messages': len(pretest_check.messages),
+                     'frames': sum(len(timestamps) for timestamps in capture)}))
+    results.append(('check_log', time_stage(lambda: pretest_check.check_log('bus.asc', processes=1), repeat),
+                    {'frames': frame_count}))
+    for report_format in ('xlsx', 'csv'):
+        results.append(('generate_report ({})'.format(report_format),
+                        time_stage(lambda: pretest_check.generate_report([report_format]), repeat), {}))
+
+    return results
+
+
+def read_results(results_file):
+    """ read the recorded benchmark results
+
+    :param results_file: JSON-lines file
+    :return: list of result dictionaries, oldest first
+    """
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file, 'r') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def get_commit():
+    """ :return: short hash of the checked out commit, or None outside of a git repository """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    """ command line entry point
+
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description='time the stages of PostFlashPreTestCheck on synthetic data')
+    parser.add_argument('-s', dest="sizes", nargs='+', type=int, default=DEFAULT_SIZES,
+                        help='numbers of expected messages, default is {}'.format(DEFAULT_SIZES))
+    parser.add_argument('-i', dest='variant', choices=['GC7', 'HR3'], default='GC7', help='variant, default is GC7')
+    parser.add_argument('-t', dest="duration_s", type=float, default=60.0,
+                        help='length of the synthetic ASC log in seconds, default is 60')
+    parser.add_argument('-n', dest="repeat", type=int, default=3, help='runs per stage, the best is kept')
+    parser.add_argument('-o', dest="results_file", default=BENCHMARK_RESULTS,
+                        help='file the results are appended to, default is {}'.format(BENCHMARK_RESULTS))
+    parser.add_argument('-x', dest="regression_pct", type=float, default=REGRESSION_PCT,
+                        help='slowdown against the previous result flagged as a regression, in %%')
+    args = parser.parse_args(argv)
+
+    results_file = os.path.abspath(args.results_file)
+    previous = {(result['stage'], result['size']): result for result in read_results(results_file)}
+    commit = get_commit()
+    started = datetime.now().isoformat(timespec='seconds')
+    current_folder = os.getcwd()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    regressions = 0
+    print('{:<40} {:>6} {:>10} {:>10} {:>8}'.format('Stage', 'Size', 'Time (s)', 'Previous', 'Change'))
+    for size in args.sizes:
+        work_folder = tempfile.mkdtemp(prefix='benchmark_{}_'.format(size))
+        try:
+            results = run_benchmarks(work_folder, size, args.variant, args.duration_s, args.repeat)
+        finally:
+            os.chdir(current_folder)
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+        with open(results_file, 'a') as fp:
+            for stage, seconds, details in results:
+                fp.write(json.dumps({'started': started, 'commit': commit, 'python': platform.python_version(),
+                                     'stage': stage, 'size': size, 'seconds': seconds, 'details': details}) + '\n')
+                last = previous.get((stage, size))
+                if last is None:
+                    print('{:<40} {:>6} {:>10.4f} {:>10} {:>8}'.format(stage, size, seconds, '-', '-'))
+                    continue
+                change_pct = (seconds - last['seconds']) * 100 / last['seconds']
+                flag = ''
+                if change_pct > args.regression_pct:
+                    regressions += 1
+                    flag = ' REGRESSION since {}'.format(last['commit'] or last['started'])
+                print('{:<40} {:>6} {:>10.4f} {:>10.4f} {:>+7.1f}%{}'.format(stage, size, seconds, last['seconds'],
+                                                                             change_pct, flag))
+
+    print('Results appended to {}'.format(results_file))
+    if regressions:
+        print('{} stages slower by more than {}%'.format(regressions, args.regression_pct))
+
+
+if __name__ == '__main__':
+    main()
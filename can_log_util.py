@@ -0,0 +1,141 @@
+from concurrent.futures import ProcessPoolExecutor
+from timing_util import CycleStatistics
+
+import os
+import numpy as np
+
+EXTENDED_ID_FLAG = 0x80000000
+# Bytes of an ASC log analysed per process
+CHUNK_SIZE = 64 << 20
+# Frames kept in memory before they are added to the statistics
+BATCH_FRAMES = 1 << 20
+
+
+def parse_asc_line(line):
+    """ parse one frame line of an ASC log written by can.ASCWriter
+
+    :param line: str
+    :return: (timestamp, arbitration ID, direction, channel) or None for headers, events and error frames
+    """
+    data = line.split()
+    if len(data) < 4 or data[3] not in ('Rx', 'Tx'):
+        return None
+    try:
+        timestamp = float(data[0])
+        if data[2][-1] in 'xX':
+            can_id = int(data[2][:-1], 16) | EXTENDED_ID_FLAG
+        else:
+            can_id = int(data[2], 16)
+    except ValueError:
+        return None
+
+    return timestamp, can_id, data[3], data[1]
+
+
+def read_log_frames(log_file, direction='Rx'):
+    """ stream the frames of an ASC or BLF log, one frame at a time
+
+    :param log_file: path of the .asc or .blf log
+    :param direction: frame direction to keep from ASC logs, 'Rx' or 'Tx'
+    :return: generator of (timestamp, arbitration ID, CAN channel starting at 1)
+    """
+    if str(log_file).lower().endswith('.blf'):
+        import can
+        for msg in can.BLFReader(str(log_file)):
+            if msg.is_error_frame:
+                continue
+            can_id = msg.arbitration_id | EXTENDED_ID_FLAG if msg.is_extended_id else msg.arbitration_id
+            yield msg.timestamp, can_id, msg.channel + 1 if isinstance(msg.channel, int) else 1
+    else:
+        with open(log_file, 'r') as fp:
+            for line in fp:
+                frame = parse_asc_line(line)
+                if frame is not None and frame[2] == direction and frame[3].isdigit():
+                    yield frame[0], frame[1], int(frame[3])
+
+
+def analyse_frames(frames, message_rows, cycle_ms, can_ch=None):
+    """ compute the cycle time statistics of the expected messages in a stream of frames, in batches
+
+    :param frames: iterable of (timestamp, arbitration ID, CAN channel)
+    :param message_rows: dictionary of (CAN channel, CAN ID) -> row of the message
+    :param cycle_ms: expected cycle time of each row in ms
+    :param can_ch: CAN channel of all the frames, overrides the channel in the log
+    :return: CycleStatistics
+    """
+    statistics = CycleStatistics(cycle_ms)
+    rows = []
+    timestamps = []
+    for timestamp, can_id, frame_ch in frames:
+        row = message_rows.get((can_ch or frame_ch, can_id))
+        if row is None:
+            continue
+        rows.append(row)
+        timestamps.append(timestamp)
+        if len(rows) == BATCH_FRAMES:
+            statistics.merge(CycleStatistics.from_frames(cycle_ms, np.array(rows, dtype=np.int64),
+                                                         np.array(timestamps)))
+            rows = []
+            timestamps = []
+    statistics.merge(CycleStatistics.from_frames(cycle_ms, np.array(rows, dtype=np.int64), np.array(timestamps)))
+
+    return statistics
+
+
+def read_asc_chunk(log_file, start, end, direction='Rx'):
+    """ stream the frames of the lines starting in a byte range of an ASC log
+
+    :param log_file: path of the .asc log
+    :param start: first byte of the chunk
+    :param end: first byte after the chunk
+    :param direction: frame direction to keep, 'Rx' or 'Tx'
+    :return: generator of (timestamp, arbitration ID, CAN channel starting at 1)
+    """
+    with open(log_file, 'rb') as fp:
+        fp.seek(start)
+        if start > 0:
+            # The line crossing the start belongs to the previous chunk
+            fp.seek(start - 1)
+            fp.readline()
+        while fp.tell() < end:
+            line = fp.readline()
+            if not line:
+                break
+            frame = parse_asc_line(line.decode('ascii', 'replace'))
+            if frame is not None and frame[2] == direction and frame[3].isdigit():
+                yield frame[0], frame[1], int(frame[3])
+
+
+def analyse_asc_chunk(log_file, start, end, message_rows, cycle_ms, can_ch=None):
+    """ process pool worker, see analyse_frames """
+    return analyse_frames(read_asc_chunk(log_file, start, end), message_rows, cycle_ms, can_ch)
+
+
+def analyse_log(log_file, message_rows, cycle_ms, can_ch=None, processes=None, chunk_size=CHUNK_SIZE):
+    """ compute the cycle time statistics of the expected messages in a recorded log with constant memory
+
+    ASC logs larger than chunk_size are split into chunks analysed across processes,
+    BLF logs are streamed in this process.
+
+    :param log_file: path of the .asc or .blf log
+    :param message_rows: dictionary of (CAN channel, CAN ID) -> row of the message
+    :param cycle_ms: expected cycle time of each row in ms
+    :param can_ch: CAN channel of all the frames, overrides the channel in the log
+    :param processes: number of worker processes, default is the number of CPUs, 1 to disable
+    :param chunk_size: bytes of the log analysed per process
+    :return: CycleStatistics
+    """
+    file_size = os.path.getsize(log_file)
+    if str(log_file).lower().endswith('.blf') or processes == 1 or file_size <= chunk_size:
+        return analyse_frames(read_log_frames(log_file), message_rows, cycle_ms, can_ch)
+
+    statistics = CycleStatistics(cycle_ms)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        chunks = [pool.submit(analyse_asc_chunk, log_file, start, min(start + chunk_size, file_size),
+                              message_rows, cycle_ms, can_ch)
+                  for start in range(0, file_size, chunk_size)]
+        # Merge in log order
+        for chunk in chunks:
+            statistics.merge(chunk.result())
+
+    return statistics
@@ -0,0 +1,254 @@
+from can_log_util import EXTENDED_ID_FLAG
+from time import time
+
+import can
+import numpy as np
+import threading
+
+# Frames kept on top of the expected count, covering jitter and the capture start-up
+BUFFER_MARGIN = 16
+# A message is given this many times its expected capture time before it is judged
+DEADLINE_FACTOR = 2
+
+STANDARD_ID_BITS = 11
+EXTENDED_ID_BITS = 29
+# Hardware acceptance filters per ID type of each interface, None if any number of filters is supported.
+# The Vector XL driver takes one code/mask filter for standard IDs and one for extended IDs.
+# The virtual interface matches every filter in software, one merged filter is the cheapest.
+ACCEPTANCE_FILTER_LIMITS = {
+    'vector': 1,
+    'virtual': 1,
+}
+
+
+def get_buffer_sizes(messages, capture_s):
+    """ estimate the number of frames per CAN ID in a capture window from the DBC cycle times
+
+    :param messages: numpy array of MESSAGE_DTYPE rows, from MessageTable.definitions
+    :param capture_s: length of the capture window in seconds
+    :return: dictionary of CAN ID -> buffer size
+    """
+    sizes = (capture_s * 1000 / np.maximum(messages['cycle_ms'], 1)).astype(np.int64) + BUFFER_MARGIN
+    return dict(zip(messages['can_id'].tolist(), sizes.tolist()))
+
+
+def get_capture_window(messages, min_frames, capture_s, max_capture_s):
+    """ compute the length of the capture window, extended for the messages with long cycle times
+
+    :param messages: numpy array of MESSAGE_DTYPE rows, from MessageTable.definitions
+    :param min_frames: number of frames wanted of each message
+    :param capture_s: shortest capture window in seconds
+    :param max_capture_s: longest capture window in seconds
+    :return: capture window in seconds
+    """
+    cycle_ms = messages['cycle_ms'][messages['cycle_ms'] > 0]
+    if len(cycle_ms) == 0:
+        return capture_s
+    # The first frame comes up to one cycle after the start of the capture
+    needed_s = (min_frames + 1) * float(cycle_ms.max()) / 1000
+
+    return min(max(capture_s, needed_s), max_capture_s)
+
+
+def get_capture_deadlines(messages, min_frames, max_capture_s):
+    """ compute how long each CAN ID is waited for, based on the DBC cycle times
+
+    :param messages: numpy array of MESSAGE_DTYPE rows, from MessageTable.definitions
+    :param min_frames: number of frames needed for a pass/fail decision
+    :param max_capture_s: hard upper bound of the capture window in seconds
+    :return: dictionary of CAN ID -> deadline in seconds from the start of the capture
+    """
+    deadlines = np.where(messages['cycle_ms'] > 0,
+                         np.minimum(DEADLINE_FACTOR * min_frames * messages['cycle_ms'] / 1000, max_capture_s),
+                         max_capture_s)
+    return dict(zip(messages['can_id'].tolist(), deadlines.tolist()))
+
+
+def count_bits(values, bits):
+    """ count the bits set in each value of a numpy array
+
+    :param values: numpy array of int64
+    :param bits: number of low bits to count
+    :return: numpy array of the counts
+    """
+    counts = np.zeros(values.shape, dtype=np.int64)
+    for bit in range(bits):
+        counts += (values >> bit) & 1
+
+    return counts
+
+
+def merge_acceptance_filters(can_ids, id_bits, max_filters):
+    """ merge exact filters of CAN IDs into at most max_filters code/mask filters,
+    letting through as few other IDs as possible
+
+    Pairs are merged greedily on the number of IDs they add, a merged filter keeps the bits its codes agree on.
+
+    :param can_ids: list of CAN IDs of the same ID type, without EXTENDED_ID_FLAG
+    :param id_bits: STANDARD_ID_BITS or EXTENDED_ID_BITS
+    :param max_filters: largest number of filters, None to keep one exact filter per CAN ID
+    :return: list of (code, mask)
+    """
+    full_mask = (1 << id_bits) - 1
+    codes = np.unique(np.asarray(can_ids, dtype=np.int64))
+    masks = np.full(len(codes), full_mask, dtype=np.int64)
+    if max_filters is None or len(codes) <= max_filters:
+        pass
+    elif max_filters == 1:
+        # The order of the merges does not change the result of merging everything
+        mask = full_mask & ~np.bitwise_or.reduce(codes ^ codes[0])
+        codes = codes[:1] & mask
+        masks = np.array([mask], dtype=np.int64)
+    else:
+        while len(codes) > max_filters:
+            merged_masks = masks[:, None] & masks[None, :] & ~(codes[:, None] ^ codes[None, :])
+            accepted = np.exp2(id_bits - count_bits(merged_masks, id_bits))
+            own = np.exp2(id_bits - count_bits(masks, id_bits))
+            added = accepted - own[:, None] - own[None, :]
+            np.fill_diagonal(added, np.inf)
+            first, second = np.unravel_index(np.argmin(added), added.shape)
+            mask = merged_masks[first, second]
+            code = codes[first] & mask
+            # Drop the pair and any other filter the merged filter covers
+            kept = ((codes & mask) != code) | ((masks & mask) != mask)
+            codes = np.append(codes[kept], code)
+            masks = np.append(masks[kept], mask)
+
+    return [(int(code), int(mask)) for code, mask in zip(codes, masks)]
+
+
+def get_acceptance_filters(messages, max_filters=None):
+    """ compile the expected CAN IDs into can_filters for can.interface.Bus
+
+    :param messages: numpy array of MESSAGE_DTYPE rows, from MessageTable.definitions
+    :param max_filters: largest number of filters per ID type, from ACCEPTANCE_FILTER_LIMITS
+    :return: list of can_filters dictionaries, None if no message is expected
+    """
+    can_ids = messages['can_id'].astype(np.int64)
+    extended = (can_ids & EXTENDED_ID_FLAG) != 0
+    standard_ids = can_ids[~extended]
+    extended_ids = can_ids[extended] & ~EXTENDED_ID_FLAG
+    can_filters = []
+    for can_ids, id_bits, extended in ((standard_ids, STANDARD_ID_BITS, False),
+                                       (extended_ids, EXTENDED_ID_BITS, True)):
+        if len(can_ids) > 0:
+            can_filters.extend({'can_id': code, 'can_mask': mask, 'extended': extended}
+                               for code, mask in merge_acceptance_filters(can_ids, id_bits, max_filters))
+
+    return can_filters or None
+
+
+class ExpectedIdListener(can.Listener):
+    """ Forwards the frames of the expected CAN IDs to another listener, dropping the other frames
+    that merged acceptance filters let through """
+
+    def __init__(self, listener, can_ids):
+        """ initialize the filter
+        :param listener: can.Listener receiving the expected frames
+        :param can_ids: CAN IDs to forward, extended IDs with EXTENDED_ID_FLAG
+        :return None
+        """
+        self.listener = listener
+        self.can_ids = frozenset(can_ids)
+
+    def on_message_received(self, msg):
+        can_id = msg.arbitration_id | EXTENDED_ID_FLAG if msg.is_extended_id else msg.arbitration_id
+        if can_id in self.can_ids:
+            self.listener.on_message_received(msg)
+
+    def stop(self):
+        self.listener.stop()
+
+
+class ListenerSwitch(can.Listener):
+    """ Forwards the frames of a bus kept open between captures to the listeners of the current capture.
+    Without a capture the frames are dropped, so the receive queue of the bus does not fill up.
+    """
+
+    def __init__(self):
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def on_message_received(self, msg):
+        with self.lock:
+            for listener in self.listeners:
+                listener.on_message_received(msg)
+
+    def set_listeners(self, listeners):
+        """ switch to the listeners of a new capture, after the frame being forwarded
+
+        :param listeners: list of can.Listener, empty between captures
+        :return: None
+        """
+        with self.lock:
+            self.listeners = listeners
+
+
+class TimestampListener(can.Listener):
+    """ Stores the receive timestamps and payloads of the expected CAN IDs in preallocated numeric buffers """
+
+    def __init__(self, buffer_sizes):
+        """ initialize the timestamp buffers
+        :param buffer_sizes: dictionary of CAN ID -> initial buffer size
+        :return None
+        """
+        self.buffers = {can_id: np.empty(size, dtype=np.float64) for can_id, size in buffer_sizes.items()}
+        # Payloads as 8-byte little-endian integers, for signal_util.SignalLayout
+        self.payloads = {can_id: np.empty(size, dtype=np.uint64) for can_id, size in buffer_sizes.items()}
+        self.counts = dict.fromkeys(buffer_sizes, 0)
+        # Frames of other CAN IDs let through by the acceptance filters
+        self.other_frames = 0
+        # Longest delay between the reception of a frame and its handling, a sign of a backed up receive queue
+        self.max_lag_s = 0.0
+        # Smallest difference between the local time and the timestamp of a frame. The timestamps of the interface
+        # do not have to count from the epoch, the lag is measured against the frame handled the fastest.
+        self.min_offset_s = None
+
+    def on_message_received(self, msg):
+        if msg.is_error_frame:
+            return
+        offset_s = time() - msg.timestamp
+        if self.min_offset_s is None or offset_s < self.min_offset_s:
+            self.min_offset_s = offset_s
+        lag_s = offset_s - self.min_offset_s
+        if lag_s > self.max_lag_s:
+            self.max_lag_s = lag_s
+        can_id = msg.arbitration_id | EXTENDED_ID_FLAG if msg.is_extended_id else msg.arbitration_id
+        buffer = self.buffers.get(can_id)
+        if buffer is None:
+            self.other_frames += 1
+            return
+        count = self.counts[can_id]
+        if count == len(buffer):
+            # Grow the buffer if the message is sent faster than its DBC cycle time
+            buffer = np.resize(buffer, 2 * len(buffer))
+            self.buffers[can_id] = buffer
+            self.payloads[can_id] = np.resize(self.payloads[can_id], len(buffer))
+        buffer[count] = msg.timestamp
+        self.payloads[can_id][count] = int.from_bytes(bytes(msg.data[:8]), 'little')
+        self.counts[can_id] = count + 1
+
+    def is_complete(self, deadlines, min_frames, elapsed_s):
+        """ check if every CAN ID has enough frames or has passed its deadline
+
+        :param deadlines: dictionary of CAN ID -> deadline in seconds, from get_capture_deadlines
+        :param min_frames: number of frames needed for a pass/fail decision
+        :param elapsed_s: time since the start of the capture in seconds
+        :return: True if the capture can be stopped
+        """
+        return all(self.counts.get(can_id, 0) >= min_frames or elapsed_s >= deadline_s
+                   for can_id, deadline_s in deadlines.items())
+
+    def get_timestamps(self):
+        """ copy out the received timestamps
+
+        :return: dictionary of CAN ID -> numpy array of timestamps in seconds, received IDs only
+        """
+        return {can_id: self.buffers[can_id][:count].copy() for can_id, count in self.counts.items() if count > 0}
+
+    def get_payloads(self):
+        """ copy out the received payloads
+
+        :return: dictionary of CAN ID -> numpy array of payloads, received IDs only
+        """
+        return {can_id: self.payloads[can_id][:count].copy() for can_id, count in self.counts.items() if count > 0}
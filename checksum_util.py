@@ -0,0 +1,143 @@
+from bisect import bisect_right
+
+import binascii
+import zlib
+import numpy as np
+
+# XCP BUILD_CHECKSUM types
+ADD_11 = 0x01
+ADD_12 = 0x02
+ADD_14 = 0x03
+ADD_22 = 0x04
+ADD_24 = 0x05
+ADD_44 = 0x06
+CRC_16 = 0x07
+CRC_16_CITT = 0x08
+CRC_32 = 0x09
+
+# Checksum type -> (element size in bytes, checksum size in bytes) of the additive checksums
+ADD_CHECKSUMS = {
+    ADD_11: (1, 1),
+    ADD_12: (1, 2),
+    ADD_14: (1, 4),
+    ADD_22: (2, 2),
+    ADD_24: (2, 4),
+    ADD_44: (4, 4),
+}
+
+CHECKSUM_NAMES = {
+    ADD_11: 'ADD_11',
+    ADD_12: 'ADD_12',
+    ADD_14: 'ADD_14',
+    ADD_22: 'ADD_22',
+    ADD_24: 'ADD_24',
+    ADD_44: 'ADD_44',
+    CRC_16: 'CRC_16',
+    CRC_16_CITT: 'CRC_16_CITT',
+    CRC_32: 'CRC_32',
+}
+
+# Value of erased flash, used for the gaps of the image
+ERASED_BYTE = 0xFF
+
+
+def make_crc16_table(polynomial):
+    """ compute the CRC of every byte value, for a byte-wise reflected CRC-16
+
+    :param polynomial: reflected polynomial
+    :return: list of 256 ints
+    """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            crc = (crc >> 1) ^ polynomial if crc & 1 else crc >> 1
+        table.append(crc)
+
+    return table
+
+
+# CRC-16/ARC: polynomial 0x8005, reflected 0xA001
+CRC16_TABLE = make_crc16_table(0xA001)
+
+
+def read_intel_hex(hex_file):
+    """ read an Intel HEX file into contiguous memory blocks
+
+    :param hex_file: path of the HEX file
+    :return: list of (start address, bytearray), sorted on address
+    """
+    blocks = []
+    base_address = 0
+    with open(hex_file, 'r') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line.startswith(':'):
+                continue
+            record = bytes.fromhex(line[1:])
+            record_type = record[3]
+            if record_type == 0x00:
+                address = base_address + ((record[1] << 8) | record[2])
+                data = record[4:4 + record[0]]
+                if blocks and blocks[-1][0] + len(blocks[-1][1]) == address:
+                    blocks[-1][1].extend(data)
+                else:
+                    blocks.append((address, bytearray(data)))
+            elif record_type == 0x01:
+                break
+            elif record_type == 0x02:
+                base_address = ((record[4] << 8) | record[5]) << 4
+            elif record_type == 0x04:
+                base_address = ((record[4] << 8) | record[5]) << 16
+
+    blocks.sort(key=lambda block: block[0])
+    return blocks
+
+
+def get_memory(blocks, address, size):
+    """ copy a memory range out of the image, gaps are filled with ERASED_BYTE
+
+    :param blocks: list of (start address, bytearray), from read_intel_hex
+    :param address: start of the range
+    :param size: number of bytes
+    :return: bytes
+    """
+    memory = bytearray([ERASED_BYTE]) * size
+    starts = [block[0] for block in blocks]
+    position = max(bisect_right(starts, address) - 1, 0)
+    for start, data in blocks[position:]:
+        if start >= address + size:
+            break
+        begin = max(start, address)
+        end = min(start + len(data), address + size)
+        if begin < end:
+            memory[begin - address:end - address] = data[begin - start:end - start]
+
+    return bytes(memory)
+
+
+def compute_checksum(data, checksum_type, byte_order='<'):
+    """ compute a checksum the way XCP BUILD_CHECKSUM does
+
+    :param data: bytes
+    :param checksum_type: one of the XCP checksum types
+    :param byte_order: '<' or '>', byte order of the slave
+    :return: checksum as int
+    """
+    if checksum_type == CRC_32:
+        return zlib.crc32(data) & 0xFFFFFFFF
+    elif checksum_type == CRC_16_CITT:
+        return binascii.crc_hqx(data, 0xFFFF)
+    elif checksum_type == CRC_16:
+        # CRC-16/ARC, initial value 0
+        crc = 0
+        for byte in data:
+            crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xFF]
+        return crc
+    elif checksum_type in ADD_CHECKSUMS:
+        element_size, checksum_size = ADD_CHECKSUMS[checksum_type]
+        elements = np.frombuffer(data[:len(data) - len(data) % element_size],
+                                 dtype=np.dtype('{}u{}'.format(byte_order, element_size)))
+        return int(elements.sum(dtype=np.uint64)) & ((1 << (8 * checksum_size)) - 1)
+    else:
+        raise ValueError('Unsupported checksum type {}'.format(hex(checksum_type)))
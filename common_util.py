@@ -1,18 +1,29 @@
-from pandas import ExcelWriter
+from contextlib import contextmanager
 from sqlite3 import Error
 from struct import *
 
 import sqlite3
 import argparse
+import atexit
+import hashlib
 import os
-import pandas as pd
-import numpy as np
+import pickle
+import threading
+
+# numpy and pandas are imported by the helpers that use them, they are slow to import
 
 OFF = 0
 ON = 1
 
+# Rows fetched per round trip by Database.select
+FETCH_ROWS = 1000
+# Open Database connections, (absolute path, thread ID) -> Database
+_databases = {}
+
 
 def uint8_info(limit):
+    import numpy as np
+
     if limit == 'min':
         return np.iinfo(np.uint8).min
     elif limit == 'max':
@@ -24,6 +35,8 @@ def uint8_info(limit):
 
 
 def float32_info(limit):
+    import numpy as np
+
     if limit == 'min':
         return float_to_hex(np.finfo(np.float32).min)
     elif limit == 'max':
@@ -43,6 +56,48 @@ def hex_to_float(h):
     return unpack('!f', bytes.fromhex(h))[0]
 
 
+def get_file_hash(file_path):
+    """ compute the SHA-1 of a file in blocks
+    :param file_path: path of the file
+    :return: hex digest
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+def read_pickle(filename):
+    """ load a pickled object, for cache files
+    :param filename: pickle file
+    :return: the object, or None if the file is missing or unreadable
+    """
+    try:
+        with open(filename, 'rb') as fp:
+            return pickle.load(fp)
+    except (IOError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def write_pickle(obj, filename):
+    """ pickle an object, writing to a temporary file first so a concurrent run never reads a partial file
+    :param obj: object to pickle
+    :param filename: pickle file
+    :return: True if the file was written, otherwise, False
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open('{}.tmp'.format(filename), 'wb') as fp:
+            pickle.dump(obj, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace('{}.tmp'.format(filename), filename)
+        return True
+    except (IOError, OSError) as e:
+        print(e)
+        return False
+
+
 def create_connection(db_file):
     """ create a database connection to the SQLite database
         specified by db_file
@@ -69,17 +124,16 @@ def execute_sql(conn, sql_statement, values=None, select=False, count=False, jus
     :param just_one: True if the SELECT statement returns only 1 row, default is False
     :return: fetchall() rows for SELECT, 0 for success, -1 for locked database, -2 for something else
     """
+    import numpy as np
+
     try:
         c = conn.cursor()
         if values is None:
             c.execute(sql_statement)
             if select:
                 if count:
-                    row_count = 0
                     rows = c.fetchall()
-                    for row in rows:
-                        row_count += 1
-                    return rows, row_count
+                    return rows, len(rows)
                 else:
                     if just_one:
                         return c.fetchone()
@@ -92,11 +146,8 @@ def execute_sql(conn, sql_statement, values=None, select=False, count=False, jus
                 c.execute(sql_statement, values)
                 if select:
                     if count:
-                        row_count = 0
                         rows = c.fetchall()
-                        for row in rows:
-                            row_count += 1
-                        return rows, row_count
+                        return rows, len(rows)
                     else:
                         if just_one:
                             return c.fetchone()
@@ -122,14 +173,145 @@ def commit_disconnect_database(conn):
     conn.close()
 
 
-def write_to_excel(df, filename, sheet_name):
+class Database(object):
+    """ SQLite connection for bulk work: WAL journal, explicit transactions, executemany and streaming SELECTs """
+
+    def __init__(self, db_file, timeout=30.0):
+        """ open the database
+        :param db_file: database file
+        :param timeout: seconds to wait for a lock held by another connection
+        :return None
+        """
+        self.db_file = db_file
+        # Transactions are started explicitly by transaction(), not by the sqlite3 module
+        self.conn = sqlite3.connect(db_file, timeout=timeout, isolation_level=None)
+        # Readers do not block the writer and the other way around, commits do not wait for a full sync
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.depth = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def transaction(self):
+        """ run the statements of a with block in one transaction, rolled back if the block raises,
+        nested blocks join the outer transaction
+
+        :return: context manager of the Database
+        """
+        if self.depth == 0:
+            self.conn.execute('BEGIN')
+        self.depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.depth -= 1
+            if self.depth == 0:
+                self.conn.execute('ROLLBACK')
+            raise
+        self.depth -= 1
+        if self.depth == 0:
+            self.conn.execute('COMMIT')
+
+    def execute(self, sql_statement, values=()):
+        """ run one statement
+        :param sql_statement: SQL statement
+        :param values: values of the statement parameters
+        :return: cursor
+        """
+        return self.conn.execute(sql_statement, values)
+
+    def execute_many(self, sql_statement, rows):
+        """ run one prepared INSERT/UPDATE for many rows, in one transaction
+        :param sql_statement: SQL statement
+        :param rows: iterable of parameter tuples, consumed as it is read
+        :return: number of rows changed
+        """
+        with self.transaction():
+            return self.conn.executemany(sql_statement, rows).rowcount
+
+    def select(self, sql_statement, values=(), fetch_rows=FETCH_ROWS):
+        """ stream the rows of a SELECT statement
+        :param sql_statement: SQL statement
+        :param values: values of the statement parameters
+        :param fetch_rows: rows fetched per round trip
+        :return: generator of rows
+        """
+        cursor = self.conn.execute(sql_statement, values)
+        try:
+            rows = cursor.fetchmany(fetch_rows)
+            while rows:
+                for row in rows:
+                    yield row
+                rows = cursor.fetchmany(fetch_rows)
+        finally:
+            cursor.close()
+
+    def select_one(self, sql_statement, values=()):
+        """ :return: first row of a SELECT statement, or None """
+        return self.conn.execute(sql_statement, values).fetchone()
+
+    def count(self, table, where='', values=()):
+        """ count rows without fetching them
+        :param table: table name
+        :param where: optional WHERE clause, without WHERE
+        :param values: values of the WHERE parameters
+        :return: int
+        """
+        return self.select_one('SELECT COUNT(*) FROM {}{}'.format(table, ' WHERE ' + where if where else ''),
+                               values)[0]
+
+    def close(self):
+        """ close the connection, removing it from the open connections of get_database """
+        for key, database in list(_databases.items()):
+            if database is self:
+                del _databases[key]
+        self.conn.close()
+
+
+def get_database(db_file):
+    """ reuse the open connection of this thread to a database, or open one
+    :param db_file: database file
+    :return: Database
+    """
+    key = (os.path.abspath(db_file), threading.get_ident())
+    if key not in _databases:
+        _databases[key] = Database(db_file)
+
+    return _databases[key]
+
+
+def close_databases():
+    """ close the open connections of get_database in this thread, a connection can only be closed by its own thread
+    :return: None
+    """
+    thread_id = threading.get_ident()
+    for (db_file, database_thread_id), database in list(_databases.items()):
+        if database_thread_id == thread_id:
+            database.close()
+
+
+# Closing the last connection checkpoints the WAL journal and removes the -wal and -shm files, also when the watch
+# and soak modes are stopped with Ctrl+C
+atexit.register(close_databases)
+
+
+def write_to_excel(df, filename, sheet_name, na_rep=''):
+    from pandas import ExcelWriter
+
     writer = ExcelWriter(filename)
-    df.to_excel(writer, sheet_name, index=False)
+    df.to_excel(writer, sheet_name, index=False, na_rep=na_rep)
     writer.save()
     writer.close()
 
 
 def read_excel_file(filename, input_data):
+    import pandas as pd
+
     df = pd.read_excel(filename,
                        sheet_name=input_data[0],
                        usecols=input_data[1],
@@ -168,6 +350,84 @@ def replace(data_frame, from_column, str_before, str_replace):
     return data_frame[from_column].replace(str_before, str_replace)
 
 
+def inject_lines_of_code(section, filename, rows, string, skip_count, spaces):
+    """ inserts declarations global variables or function calls to a stub, reading and writing the file once
+
+    The database is not touched, the Run timings found are returned for the caller to store.
+
+    :param section: code section to update, declarations or functions
+    :param filename: filename of the stub
+    :param rows: list of the lines of code for the current module
+    :param string: a line in the stub that indicates the declarations section of the file
+    :param skip_count: number of lines to skip from the section header's identifying string
+    :param spaces: indentation of the inserted lines
+    :return: True if updating the file is a success, otherwise, False; list of (cycle_ms, module name)
+    """
+    module_name = filename[filename.find('\\')+1:filename.find('.')]
+    run_function = 'FUNC(void, {}_CODE) Run_{}'.format(module_name, module_name)
+    with open(filename, 'r') as fi:
+        lines = fi.readlines()
+
+    header = next((index for index, line in enumerate(lines) if line.find(string) != -1), None)
+    if header is None:
+        print('Section header in {} not found'.format(filename))
+        return False, []
+    # The line skip_count lines after the header has to be empty, the code goes right before it
+    insertion_point = header + skip_count
+    if insertion_point < len(lines) and lines[insertion_point].strip() != '':
+        print('Declarations section of {} is not empty'.format(filename))
+        return False, []
+
+    cycle_updates = []
+    rte_apis = set()
+    rte_api_list_found = False
+    output = []
+    for index, line in enumerate(lines):
+        if index == insertion_point:
+            for row in rows:
+                if section == 'declarations':
+                    output.append('{}{}\n'.format(spaces, row))
+                elif str(row).split('(')[0] in rte_apis:
+                    # Only the RTE APIs listed before the insertion point are called
+                    output.append('{}{}\n'.format(spaces, row))
+                else:
+                    output.append('{}// {}\n'.format(spaces, row))
+        # Check for function call timing
+        if line.find(run_function) != -1:
+            if str(module_name).find('ms') != -1:
+                cycle_ms = module_name[module_name.find('_')+1:module_name.find('ms')]
+            else:
+                cycle_ms = line[line.find('Run_{}_'.format(module_name))+len(
+                    'Run_{}_'.format(module_name)):line.find('ms')]
+            cycle_updates.append((cycle_ms, module_name))
+        if section == 'functions':
+            if line == ' * Input Interfaces:\n':
+                rte_api_list_found = True
+            if rte_api_list_found and line.find(' *   Std_ReturnType ') != -1:
+                rte_apis.add(line.split()[2].split('(')[0])
+            if line.find('<< Start of documentation area >>') != -1:
+                rte_api_list_found = False
+        output.append(line)
+
+    # Replace the stub in one step, an interrupted run leaves the original file
+    with open('{}.tmp'.format(filename), 'w') as fo:
+        fo.writelines(output)
+    os.replace('{}.tmp'.format(filename), filename)
+
+    return True, cycle_updates
+
+
+def update_cycle_times(cycle_updates, db_file='interface.db'):
+    """ store the Run timings of the stubs in one transaction
+    :param cycle_updates: list of (cycle_ms, module name)
+    :param db_file: database file
+    :return: None
+    """
+    if cycle_updates:
+        get_database(db_file).execute_many('''UPDATE internal_signals SET cycle_ms = ? WHERE module = ?''',
+                                           cycle_updates)
+
+
 def insert_lines_of_code(section, filename, data_frame, string, skip_count, spaces):
     """ inserts declarations global variables to the stubs
 
@@ -179,70 +439,33 @@ def insert_lines_of_code(section, filename, data_frame, string, skip_count, spac
     :param spaces:
     :return: return True if updating the file is a success, otherwise, return False
     """
-    line_number = find_section_header(filename, string, skip_count)
-
-    if line_number > 0:
-        conn = create_connection('interface.db')
-        module_name = filename[filename.find('\\')+1:filename.find('.')]
-        line_number = line_number + skip_count
-        os.rename(filename, '{}.tmp'.format(filename))
-        current_line = 1
-        rte_api_list = []
-        rte_api_list_found = False
-        with open('{}.tmp'.format(filename), 'r') as fi:
-            with open(filename, 'w') as fo:
-                for line in fi:
-                    # Check for function call timing
-                    if line.find('FUNC(void, {}_CODE) Run_{}'.format(module_name, module_name)) != -1:
-                        if str(module_name).find('ms') != -1:
-                            cycle_ms = module_name[module_name.find('_')+1:module_name.find('ms')]
-                        else:
-                            cycle_ms = line[line.find('Run_{}_'.format(module_name))+len(
-                                'Run_{}_'.format(module_name)):line.find('ms')]
-                        execute_sql(conn,
-                                    '''UPDATE internal_signals SET cycle_ms = ? WHERE module = ?''',
-                                    (cycle_ms, module_name)
-                                    )
-                        commit_disconnect_database(conn)
-                    if section == 'functions':
-                        if line == ' * Input Interfaces:\n':
-                            rte_api_list_found = True
-                        if rte_api_list_found and line.find(' *   Std_ReturnType ') != -1:
-                            rte_api_list.append(line.split()[2].split('(')[0])
-                        if line.find('<< Start of documentation area >>') != -1:
-                            rte_api_list_found = False
-
-                    fo.write(line)
-                    current_line += 1
-
-                    if current_line == line_number:
-                        data = data_frame.tolist()
-                        for row in data:
-                            if section == 'declarations':
-                                fo.write('{}{}\n'.format(spaces, row))
-                            else:
-                                function_name = str(row).split('(')[0]
-                                rte_api_found = False
-                                # Check if the function call to be inserted is in the list of RTE APIs
-                                for rte_api_function in rte_api_list:
-                                    if rte_api_function == function_name:
-                                        rte_api_found = True
-                                        break
-                                if rte_api_found:
-                                    fo.write('{}{}\n'.format(spaces, row))
-                                else:
-                                    fo.write('{}// {}\n'.format(spaces, row))
-                                    continue
-            fo.close()
-        fi.close()
-        os.remove('{}.tmp'.format(filename))
-        return True
-    elif line_number == -1:
-        print('Declarations section of {} is not empty'.format(filename))
-        return False
+    result, cycle_updates = inject_lines_of_code(section, filename, data_frame.tolist(), string, skip_count, spaces)
+    update_cycle_times(cycle_updates)
+
+    return result
+
+
+def insert_lines_of_code_in_files(jobs, processes=None):
+    """ inserts lines of code to many stubs across processes, see insert_lines_of_code
+
+    :param jobs: list of (section, filename, data frame or list of lines, string, skip_count, spaces)
+    :param processes: number of worker processes, default is the number of CPUs, 1 to disable
+    :return: list of the results of the jobs, True if updating the file is a success, otherwise, False
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    jobs = [(section, filename, rows.tolist() if hasattr(rows, 'tolist') else list(rows), string, skip_count,
+             spaces) for section, filename, rows, string, skip_count, spaces in jobs]
+    if processes == 1:
+        outcomes = [inject_lines_of_code(*job) for job in jobs]
     else:
-        print('Section header in {} not found'.format(filename))
-        return False
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            outcomes = list(pool.map(inject_lines_of_code, *zip(*jobs))) if jobs else []
+
+    # The timings of all the stubs go to the database in one transaction
+    update_cycle_times([update for result, cycle_updates in outcomes for update in cycle_updates])
+
+    return [result for result, cycle_updates in outcomes]
 
 
 def find_section_header(filename, string, skip_count):
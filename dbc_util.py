@@ -0,0 +1,124 @@
+from pathlib import Path
+from common_util import get_file_hash, read_pickle, write_pickle
+from signal_util import parse_signal_line
+
+import hashlib
+import os
+
+# Increase whenever the parsed format changes, so old cache files are re-parsed
+CACHE_VERSION = 2
+CACHE_FOLDER = '.dbc_cache'
+
+
+def find_dbc_files(dbc_folder, variant, dbc_names):
+    """ find the DBC file of each CAN channel in the variant folders
+
+    :param dbc_folder: the location of the DBC files, with 1 folder per variant
+    :param variant: str
+    :param dbc_names: list of the name parts identifying the DBC file of CAN 1 to CAN n
+    :return: list of (CAN channel, DBC file path)
+    """
+    dbc_files = []
+    can_ch = 0
+    for root, dirs, files in os.walk(dbc_folder):
+        if root.find(variant) == -1:
+            continue
+        # os.walk lists the files in the order of the file system, only defined on NTFS (by upper-case name),
+        # so the files of a folder are taken in upper-case name order on every file system
+        for file in sorted(files, key=str.upper):
+            if can_ch == len(dbc_names):
+                return dbc_files
+            if file.endswith('.dbc') and file.find(dbc_names[can_ch]) != -1:
+                dbc_files.append((can_ch + 1, os.path.join(root, file)))
+                can_ch += 1
+
+    return dbc_files
+
+
+def parse_dbc_file(dbc_file):
+    """ parse the messages sent by the EYE node, their cycle times and their signals in one pass
+
+    :param dbc_file: path of the DBC file
+    :return: dictionary of CAN ID -> (cycle time in ms, list of signals from parse_signal_line),
+             messages with a cycle time of 0 are left out
+    """
+    messages = {}
+    current_id = None
+    with open(dbc_file, 'r') as fp:
+        for line in fp:
+            if line.startswith('BO_ '):
+                if line.find('EYE') != -1:
+                    data = line.split()
+                    current_id = int(data[1])
+                    messages[current_id] = (0, [])
+                else:
+                    current_id = None
+
+            elif current_id is not None and line.lstrip().startswith('SG_ '):
+                signal = parse_signal_line(line)
+                if signal is not None:
+                    messages[current_id][1].append(signal)
+
+            elif line.startswith('BA_ ') and line.find('GenMsgCycleTime') != -1:
+                data = line.split()
+                can_id = int(data[3])
+                if can_id in messages:
+                    if int(data[4][:-1]) == 0:
+                        del messages[can_id]
+                    else:
+                        messages[can_id] = (int(data[4][:-1]), messages[can_id][1])
+
+    return messages
+
+
+def load_dbc_file(dbc_file, cache_folder=CACHE_FOLDER):
+    """ load a DBC file through the parse cache
+
+    The cache entry is used as is if the size and modification time of the file did not change,
+    otherwise it is used only if the content hash is still the same.
+
+    :param dbc_file: path of the DBC file
+    :param cache_folder: location of the parse cache, None to disable it
+    :return: same as parse_dbc_file
+    """
+    if cache_folder is None:
+        return parse_dbc_file(dbc_file)
+
+    dbc_file = os.path.abspath(dbc_file)
+    stat = os.stat(dbc_file)
+    cache_file = Path(cache_folder) / '{}.pickle'.format(hashlib.sha1(dbc_file.encode('utf-8')).hexdigest())
+    entry = read_pickle(cache_file)
+
+    if entry is not None and entry['version'] == CACHE_VERSION and entry['path'] == dbc_file:
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['messages']
+        file_hash = get_file_hash(dbc_file)
+        if entry['hash'] == file_hash:
+            messages = entry['messages']
+        else:
+            messages = parse_dbc_file(dbc_file)
+    else:
+        file_hash = get_file_hash(dbc_file)
+        messages = parse_dbc_file(dbc_file)
+
+    entry = {'version': CACHE_VERSION, 'path': dbc_file, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+             'hash': file_hash, 'messages': messages}
+    write_pickle(entry, cache_file)
+
+    return messages
+
+
+def load_messages(dbc_files, cache_folder=CACHE_FOLDER):
+    """ load the expected messages of all the CAN channels
+
+    :param dbc_files: list of (CAN channel, DBC file path), from find_dbc_files
+    :param cache_folder: location of the parse cache, None to disable it
+    :return: dictionary of (CAN channel, CAN ID) -> message dictionary
+    """
+    messages = {}
+    for can_ch, dbc_file in dbc_files:
+        for can_id, (cycle_ms, signals) in load_dbc_file(dbc_file, cache_folder).items():
+            messages[(can_ch, can_id)] = {'can_ch': can_ch, 'can_id': can_id, 'cycle_ms': cycle_ms,
+                                          'signals': signals}
+
+    return messages
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import print_function
+from can_log_util import EXTENDED_ID_FLAG
+from time import perf_counter, sleep
+from xcp_util import XCP_CMD_ID, XCP_RES_ID, PID_RES, PID_ERR, CONNECT, DISCONNECT, SET_MTA, UPLOAD, SHORT_UPLOAD
+
+import argparse
+import can
+import heapq
+import logging
+import struct
+import sys
+import threading
+import numpy as np
+
+BITRATE = 500000
+# Bits of an 8-byte standard frame on the wire, with typical bit stuffing and the interframe space
+FRAME_BITS = 125
+# XCP_ERR_CMD_UNKNOWN, the answer to the commands that are not simulated
+ERR_CMD_UNKNOWN = 0x20
+# CONNECT response: no resources, Intel byte order, no block mode, MAX_CTO and MAX_DTO of 8, versions 1
+CONNECT_RESPONSE = [PID_RES, 0x00, 0x00, 0x08, 0x08, 0x00, 0x01, 0x01]
+
+
+class XcpSlaveListener(can.Listener):
+    """ Answers the XCP commands of the target check: CONNECT, DISCONNECT, SHORT_UPLOAD, SET_MTA and UPLOAD """
+
+    def __init__(self, bus, memory, latency_ms=0.0):
+        """ initialize the slave
+        :param bus: can.BusABC the responses are sent on
+        :param memory: dictionary of address -> bytes, other addresses read as 0
+        :param latency_ms: delay of each response in ms
+        :return None
+        """
+        self.bus = bus
+        self.memory = {}
+        for address, data in memory.items():
+            for offset, value in enumerate(data):
+                self.memory[address + offset] = value
+        self.latency_s = latency_ms / 1000.0
+        self.connected = False
+        self.mta = 0
+        self.commands = 0
+
+    def read(self, address, size):
+        """ :return: list of the bytes at a memory range """
+        return [self.memory.get(address + offset, 0) for offset in range(size)]
+
+    def on_message_received(self, msg):
+        if msg.arbitration_id != XCP_CMD_ID or msg.is_extended_id or len(msg.data) == 0:
+            return
+        command = msg.data[0]
+        # A slave that is not connected only answers CONNECT
+        if not self.connected and command != CONNECT:
+            return
+        self.commands += 1
+        if command == CONNECT:
+            self.connected = True
+            response = CONNECT_RESPONSE
+        elif command == DISCONNECT:
+            self.connected = False
+            response = [PID_RES]
+        elif command == SHORT_UPLOAD:
+            response = [PID_RES] + self.read(struct.unpack('<I', bytes(msg.data[4:8]))[0], msg.data[1])
+        elif command == SET_MTA:
+            self.mta = struct.unpack('<I', bytes(msg.data[4:8]))[0]
+            response = [PID_RES]
+        elif command == UPLOAD:
+            response = [PID_RES] + self.read(self.mta, msg.data[1])
+            self.mta += msg.data[1]
+        else:
+            response = [PID_ERR, ERR_CMD_UNKNOWN]
+
+        if self.latency_s > 0:
+            sleep(self.latency_s)
+        self.bus.send(can.Message(arbitration_id=XCP_RES_ID, data=bytearray(response).ljust(8, b'\x00'),
+                                  is_extended_id=False))
+
+
+class EcuSimulator(object):
+    """ Stand-in for the target on python-can's virtual interface
+
+    Sends the expected messages of every CAN channel at their DBC cycle times, with jitter, dropouts and
+    filler frames up to a bus load, and answers the XCP commands of the stub version check.
+    Virtual buses only connect within a process, the check has to run in the same process.
+    """
+
+    def __init__(self, messages, bustype='virtual', jitter_ms=0.0, dropout=0.0, bus_load=0.0, xcp_channel=2,
+                 xcp_latency_ms=0.0, memory=None, seed=0):
+        """ initialize the simulator
+        :param messages: numpy array of MESSAGE_DTYPE rows, from MessageTable.definitions
+        :param bustype: python-can interface, the channels are opened as CAN channel - 1 like the target check
+        :param jitter_ms: standard deviation of the frame timing in ms
+        :param dropout: probability of a frame not being sent
+        :param bus_load: bus load of each channel from 0 to 1, filler frames are added to the expected messages
+        :param xcp_channel: CAN channel of the XCP slave
+        :param xcp_latency_ms: delay of each XCP response in ms
+        :param memory: dictionary of address -> bytes readable through XCP
+        :param seed: random seed
+        :return None
+        """
+        self.messages = messages
+        self.bustype = bustype
+        self.jitter_s = jitter_ms / 1000.0
+        self.dropout = dropout
+        self.bus_load = bus_load
+        self.xcp_channel = xcp_channel
+        self.xcp_latency_ms = xcp_latency_ms
+        self.memory = memory or {}
+        self.seed = seed
+        self.stopped = threading.Event()
+        self.threads = []
+        self.buses = []
+        self.notifier = None
+        self.xcp_slave = None
+        # CAN channel -> [frames sent, frames dropped]
+        self.counts = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_filler_id(self):
+        """ :return: highest standard CAN ID that is neither expected nor used by XCP """
+        used = set(self.messages['can_id'].tolist()) | {XCP_CMD_ID, XCP_RES_ID}
+        return next(can_id for can_id in range(0x7FF, -1, -1) if can_id not in used)
+
+    def get_schedule(self, can_ch):
+        """ list the frames sent on a CAN channel
+
+        :param can_ch: CAN channel
+        :return: list of (CAN ID, cycle time in s), the filler frames last
+        """
+        channel_messages = self.messages[self.messages['can_ch'] == can_ch]
+        channel_messages = channel_messages[channel_messages['cycle_ms'] > 0]
+        schedule = list(zip(channel_messages['can_id'].tolist(), (channel_messages['cycle_ms'] / 1000.0).tolist()))
+        frame_rate = sum(1 / cycle_s for can_id, cycle_s in schedule)
+        if frame_rate > BITRATE / FRAME_BITS:
+            logging.warning('CAN CH: {} expected messages need {:.0f} frames/s, more than the bus can carry'.format(
+                can_ch, frame_rate))
+        # Frames per second still free below the requested load
+        filler_rate = self.bus_load * BITRATE / FRAME_BITS - frame_rate
+        if filler_rate > 0:
+            schedule.append((self.get_filler_id(), 1 / filler_rate))
+
+        return schedule
+
+    def send_frames(self, can_ch, bus, schedule):
+        """ send the frames of a CAN channel until the simulator is stopped, runs in its own thread
+
+        Frames are sent in the order of their jittered send times from a heap of
+        (send time, nominal send time, CAN ID, cycle time). Late frames are sent at once.
+
+        :param can_ch: CAN channel
+        :param bus: can.BusABC
+        :param schedule: list of (CAN ID, cycle time in s), from get_schedule
+        :return: None
+        """
+        random = np.random.RandomState(self.seed + can_ch)
+        counts = self.counts[can_ch]
+        start_s = perf_counter()
+        heap = []
+        for can_id, cycle_s in schedule:
+            due_s = start_s + random.uniform(0, cycle_s)
+            heap.append((due_s, due_s, can_id, cycle_s))
+        heapq.heapify(heap)
+        msgs = {can_id: can.Message(arbitration_id=can_id & ~EXTENDED_ID_FLAG, is_extended_id=bool(
+            can_id & EXTENDED_ID_FLAG), data=bytearray(8)) for can_id, cycle_s in schedule}
+
+        while heap and not self.stopped.is_set():
+            send_s, nominal_s, can_id, cycle_s = heap[0]
+            delay_s = send_s - perf_counter()
+            if delay_s > 0 and self.stopped.wait(delay_s):
+                break
+            if self.dropout > 0 and random.random_sample() < self.dropout:
+                counts[1] += 1
+            else:
+                bus.send(msgs[can_id])
+                counts[0] += 1
+            nominal_s += cycle_s
+            send_s = nominal_s + random.normal(0, self.jitter_s) if self.jitter_s > 0 else nominal_s
+            heapq.heapreplace(heap, (send_s, nominal_s, can_id, cycle_s))
+
+    def start(self):
+        """ open the buses and start sending
+
+        :return: None
+        """
+        self.stopped.clear()
+        for can_ch in sorted(set(self.messages['can_ch'].tolist()) | {self.xcp_channel}):
+            bus = can.interface.Bus(interface=self.bustype, channel=can_ch-1, bitrate=BITRATE)
+            self.buses.append(bus)
+            self.counts[can_ch] = [0, 0]
+            schedule = self.get_schedule(can_ch)
+            logging.info('ECU simulator CAN CH: {} sends {} IDs'.format(can_ch, len(schedule)))
+            thread = threading.Thread(target=self.send_frames, args=(can_ch, bus, schedule), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        # The XCP slave has a bus of its own, its filter keeps the frames of the channel out of the listener
+        xcp_bus = can.interface.Bus(interface=self.bustype, channel=self.xcp_channel-1, bitrate=BITRATE,
+                                    can_filters=[{'can_id': XCP_CMD_ID, 'can_mask': 0x7FF, 'extended': False}])
+        self.buses.append(xcp_bus)
+        self.xcp_slave = XcpSlaveListener(xcp_bus, self.memory, self.xcp_latency_ms)
+        self.notifier = can.Notifier(xcp_bus, [self.xcp_slave], timeout=0.1)
+
+    def stop(self):
+        """ stop sending and close the buses
+
+        :return: dictionary of CAN channel -> (frames sent, frames dropped)
+        """
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        if self.notifier is not None:
+            self.notifier.stop()
+            self.notifier = None
+        for bus in self.buses:
+            bus.shutdown()
+        self.threads = []
+        self.buses = []
+
+        return {can_ch: tuple(counts) for can_ch, counts in self.counts.items()}
+
+
+def main(argv=None):
+    """ command line entry point: run the target check of PostFlashPreTestCheck.py against the simulator
+
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    from PostFlashPreTestCheck import MIN_PYTHON, PostFlashPreTestCheck, check_target
+
+    if sys.version_info < MIN_PYTHON:
+        sys.exit("Python %s.%s or later is required. Please check your Python version.\n" % MIN_PYTHON)
+    parser = argparse.ArgumentParser(description='check a simulated ECU on the virtual CAN interface',
+                                     epilog='the other arguments are passed on to the target check')
+    parser.add_argument("variant", help='variant to be simulated', choices=['GC7', 'HR3'])
+    parser.add_argument('-m', dest="map_folder", help='path of the MAP file', default='Build/')
+    parser.add_argument('-d', dest="dbc_folder", help='path of the DBC folders for each variant', default='DBC/')
+    parser.add_argument('-j', dest="jitter_ms", type=float, default=0.2,
+                        help='standard deviation of the frame timing in ms, default is 0.2')
+    parser.add_argument('-p', dest="dropout", type=float, default=0.0, help='probability of a frame being lost')
+    parser.add_argument('-g', dest="bus_load", type=float, default=0.0,
+                        help='bus load of each channel from 0 to 1, reached with filler frames')
+    parser.add_argument('-x', dest="xcp_latency_ms", type=float, default=1.0,
+                        help='delay of the XCP responses in ms, default is 1')
+    parser.add_argument('-v', dest="stub_version", type=int, nargs=2, default=[1, 0], metavar=('MAIN', 'SUB'),
+                        help='stub version read through XCP, default is 1 0')
+    args, check_args = parser.parse_known_args(argv)
+
+    logging.basicConfig(filename='run.log', filemode='w', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    pretest_check = PostFlashPreTestCheck(args.variant, args.map_folder, args.dbc_folder)
+    pretest_check.create_message_list()
+    memory = {}
+    addresses, found = pretest_check.get_stub_variable_addresses()
+    if found:
+        memory = {addresses['StubVersion_Main']: bytes([args.stub_version[0]]),
+                  addresses['StubVersion_Sub']: bytes([args.stub_version[1]])}
+
+    simulator = EcuSimulator(pretest_check.messages.definitions, jitter_ms=args.jitter_ms, dropout=args.dropout,
+                             bus_load=args.bus_load, xcp_latency_ms=args.xcp_latency_ms, memory=memory)
+    simulator.start()
+    try:
+        check_target([args.variant, '-m', args.map_folder, '-d', args.dbc_folder, '-u', 'virtual'] + check_args)
+    finally:
+        counts = simulator.stop()
+    print('')
+    print('Simulated frames:')
+    for can_ch, (sent, dropped) in sorted(counts.items()):
+        print('CAN CH {}: {} sent, {} dropped'.format(can_ch, sent, dropped))
+    print('XCP commands answered: {}'.format(simulator.xcp_slave.commands))
+
+
+if __name__ == '__main__':
+    main()
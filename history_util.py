@@ -0,0 +1,138 @@
+from datetime import datetime
+from common_util import get_database
+
+HISTORY_DB = 'run_history.db'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS runs (
+        run_id INTEGER PRIMARY KEY,
+        started TEXT NOT NULL,
+        variant TEXT NOT NULL,
+        source TEXT NOT NULL,
+        stub_main INTEGER,
+        stub_sub INTEGER,
+        map_hash TEXT,
+        dbc_hash TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS runs_variant ON runs (variant, run_id)',
+    # One row per checked message of a run. The primary key serves the lookups of a run,
+    # the index the history of a message.
+    '''CREATE TABLE IF NOT EXISTS message_stats (
+        run_id INTEGER NOT NULL REFERENCES runs (run_id),
+        can_ch INTEGER NOT NULL,
+        can_id INTEGER NOT NULL,
+        cycle_ms INTEGER,
+        mean_ms REAL,
+        min_ms REAL,
+        max_ms REAL,
+        std_ms REAL,
+        jitter_ms REAL,
+        missed INTEGER,
+        bursts INTEGER,
+        frames INTEGER,
+        status INTEGER,
+        timing INTEGER,
+        PRIMARY KEY (run_id, can_ch, can_id)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS message_stats_message ON message_stats (can_ch, can_id, run_id)',
+]
+
+STAT_COLUMNS = ['cycle_ms', 'mean_ms', 'min_ms', 'max_ms', 'std_ms', 'jitter_ms', 'missed', 'bursts', 'frames',
+                'status', 'timing']
+
+
+class RunHistory(object):
+    """ Indexed SQLite store of the per-message statistics of every run, for tracking regressions across builds """
+
+    def __init__(self, db_file=HISTORY_DB):
+        """ open the history database, creating the tables if needed
+        :param db_file: database file
+        :return None
+        """
+        self.database = get_database(db_file)
+        with self.database.transaction():
+            for sql_statement in SCHEMA:
+                self.database.execute(sql_statement)
+
+    def add_run(self, variant, source, messages, stub_version=None, map_hash=None, dbc_hash=None):
+        """ store the checked messages of a run
+
+        :param variant: str
+        :param source: 'target' or the recorded log files
+        :param messages: MessageTable with the results of the run
+        :param stub_version: dictionary with StubVersion_Main and StubVersion_Sub, if read
+        :param map_hash: SHA-1 of application.map
+        :param dbc_hash: SHA-1 of the DBC file hashes
+        :return: run ID
+        """
+        from message_util import UNCHECKED
+
+        stub_version = stub_version or {}
+        checked = messages.results['status'] != UNCHECKED
+        definitions = messages.definitions[checked]
+        results = messages.results[checked]
+        columns = [definitions['can_ch'].tolist(), definitions['can_id'].tolist()] + \
+            [(definitions if column == 'cycle_ms' else results)[column].tolist() for column in STAT_COLUMNS]
+        with self.database.transaction():
+            run_id = self.database.execute(
+                'INSERT INTO runs (started, variant, source, stub_main, stub_sub, map_hash, dbc_hash) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (datetime.now().isoformat(timespec='seconds'), variant, source, stub_version.get('StubVersion_Main'),
+                 stub_version.get('StubVersion_Sub'), map_hash, dbc_hash)).lastrowid
+            # NaN statistics are stored as NULL
+            self.database.execute_many(
+                'INSERT INTO message_stats (run_id, can_ch, can_id, {}) VALUES (?, ?, ?, {})'.format(
+                    ', '.join(STAT_COLUMNS), ', '.join('?' * len(STAT_COLUMNS))),
+                ((run_id,) + tuple(None if value != value else value for value in row) for row in zip(*columns)))
+
+        return run_id
+
+    def get_runs(self, variant, limit=20):
+        """ list the latest runs of a variant
+
+        :param variant: str
+        :param limit: number of runs
+        :return: list of (run ID, started, source, stub main, stub sub, map hash, DBC hash), latest first
+        """
+        return list(self.database.select(
+            'SELECT run_id, started, source, stub_main, stub_sub, map_hash, dbc_hash FROM runs '
+            'WHERE variant = ? ORDER BY run_id DESC LIMIT ?', (variant, limit)))
+
+    def get_latest_run(self, variant):
+        """ :return: ID of the latest run of a variant, or None """
+        row = self.database.select_one('SELECT MAX(run_id) FROM runs WHERE variant = ?', (variant,))
+        return row[0]
+
+    def find_regressions(self, base_run, run_id, change_pct, column='mean_ms'):
+        """ find the messages whose statistic changed more than change_pct since a base run
+
+        :param base_run: run ID of the reference build
+        :param run_id: run ID to compare
+        :param change_pct: smallest change in % of the base value
+        :param column: statistic to compare, one of STAT_COLUMNS
+        :return: list of (CAN channel, CAN ID, base value, value, change in %), largest change first
+        """
+        if column not in STAT_COLUMNS:
+            raise ValueError('unknown statistic {}'.format(column))
+        return list(self.database.select(
+            'SELECT run.can_ch, run.can_id, base.{0}, run.{0}, (run.{0} - base.{0}) * 100.0 / base.{0} AS change '
+            'FROM message_stats AS run JOIN message_stats AS base '
+            'ON base.run_id = ? AND base.can_ch = run.can_ch AND base.can_id = run.can_id '
+            'WHERE run.run_id = ? AND base.{0} != 0 AND ABS(run.{0} - base.{0}) * 100.0 > ? * ABS(base.{0}) '
+            'ORDER BY ABS(change) DESC'.format(column), (base_run, run_id, change_pct)))
+
+    def get_message_history(self, can_ch, can_id, variant, limit=100):
+        """ list the statistics of one message over the latest runs of a variant
+
+        :param can_ch: CAN channel
+        :param can_id: CAN ID
+        :param variant: str
+        :param limit: number of runs
+        :return: list of (run ID, started, stub main, stub sub, <STAT_COLUMNS>), latest first
+        """
+        return list(self.database.select(
+            'SELECT runs.run_id, runs.started, runs.stub_main, runs.stub_sub, {} '
+            'FROM message_stats JOIN runs ON runs.run_id = message_stats.run_id '
+            'WHERE message_stats.can_ch = ? AND message_stats.can_id = ? AND runs.variant = ? '
+            'ORDER BY message_stats.run_id DESC LIMIT ?'.format(', '.join(STAT_COLUMNS)),
+            (can_ch, can_id, variant, limit)))
@@ -0,0 +1,123 @@
+from bisect import bisect_right
+from pathlib import Path
+from common_util import get_file_hash, read_pickle, write_pickle
+
+import mmap
+import os
+import re
+
+CACHE_VERSION = 2
+CACHE_FOLDER = '.map_cache'
+
+SECTIONS_HEADER = b'* Sections'
+# | <chip> | <group> | <section> | <size> | <space address> | <chip address> | <alignment> |
+SECTION_LINE = re.compile(rb'^\|\s*(\S+)\s*\|[^|\n]*\|\s*([^|\n]+?)\s*\|'
+                          rb'\s*0x([0-9a-fA-F]+)\s*\|\s*0x([0-9a-fA-F]+)\s*\|', re.MULTILINE)
+NAME_SECTION_HEADER = b'* Symbols (sorted on name)'
+ADDRESS_SECTION_HEADER = b'* Symbols (sorted on address)'
+# | <name> | <address> | ...
+SYMBOL_LINE = re.compile(rb'^\|\s*(\S+)\s*\|\s*(?:0x)?([0-9a-fA-F]+)\s*\|', re.MULTILINE)
+
+
+def parse_map_file(map_file):
+    """ read the located sections and the symbols sorted on name from application.map
+
+    :param map_file: path of the map file
+    :return: dictionary of symbol name -> address, list of (chip, section name, space address, size)
+    """
+    symbols = {}
+    sections = []
+    with open(map_file, 'rb') as fp:
+        # An empty file cannot be mapped, e.g. application.map truncated by a failed build
+        if os.fstat(fp.fileno()).st_size == 0:
+            return symbols, sections
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = data.find(SECTIONS_HEADER)
+            if start != -1:
+                end = data.find(b'\n* ', start + 1)
+                for match in SECTION_LINE.finditer(data, start, end if end != -1 else len(data)):
+                    size = int(match.group(3), 16)
+                    if size > 0:
+                        sections.append((match.group(1).decode('ascii', 'replace'),
+                                         match.group(2).decode('ascii', 'replace'), int(match.group(4), 16), size))
+
+            start = data.find(NAME_SECTION_HEADER)
+            if start != -1:
+                end = data.find(ADDRESS_SECTION_HEADER, start)
+                for match in SYMBOL_LINE.finditer(data, start, end if end != -1 else len(data)):
+                    name = match.group(1).decode('ascii', 'replace')
+                    # Keep the first definition, as the original line-by-line search did
+                    if name not in symbols:
+                        symbols[name] = int(match.group(2), 16)
+
+    return symbols, sections
+
+
+class MapIndex(object):
+    """ Symbol index of application.map, with name -> address and address -> name lookups """
+
+    def __init__(self, map_file, cache_folder=CACHE_FOLDER):
+        """ load the index from the cache, or parse the map file if it changed
+        :param map_file: path of the map file
+        :param cache_folder: location of the index cache, None to disable it
+        :return None
+        """
+        self.map_hash = None
+        if cache_folder is None:
+            self.symbols, self.sections = parse_map_file(map_file)
+        else:
+            map_hash = get_file_hash(map_file)
+            cache_file = Path(cache_folder) / '{}.pickle'.format(map_hash)
+            entry = read_pickle(cache_file)
+            if entry is not None and entry['version'] == CACHE_VERSION:
+                self.symbols = entry['symbols']
+                self.sections = entry['sections']
+            else:
+                self.symbols, self.sections = parse_map_file(map_file)
+                write_pickle({'version': CACHE_VERSION, 'symbols': self.symbols, 'sections': self.sections},
+                             cache_file)
+            self.map_hash = map_hash
+
+        by_address = sorted((address, name) for name, address in self.symbols.items())
+        self.addresses = [address for address, name in by_address]
+        self.names = [name for address, name in by_address]
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def lookup(self, symbol_names):
+        """ resolve the addresses of a list of symbols
+
+        :param symbol_names: list of symbol names
+        :return: dictionary of symbol name -> address, for the symbols found
+        """
+        return {name: self.symbols[name] for name in symbol_names if name in self.symbols}
+
+    def get_section_ranges(self, chip_prefix='mpe:pfl'):
+        """ merge the located sections of the chips specified into contiguous memory ranges
+
+        :param chip_prefix: start of the chip names to include, default is the program flash
+        :return: list of (start address, size)
+        """
+        ranges = []
+        for address, size in sorted((address, size) for chip, name, address, size in self.sections
+                                    if chip.startswith(chip_prefix)):
+            if ranges and address <= ranges[-1][0] + ranges[-1][1]:
+                start = ranges[-1][0]
+                ranges[-1] = (start, max(ranges[-1][1], address + size - start))
+            else:
+                ranges.append((address, size))
+
+        return ranges
+
+    def find_symbol(self, address):
+        """ find the symbol at or right before an address
+
+        :param address: int
+        :return: (symbol name, offset from the symbol address), or None if the address is below all symbols
+        """
+        position = bisect_right(self.addresses, address) - 1
+        if position < 0:
+            return None
+
+        return self.names[position], address - self.addresses[position]
@@ -0,0 +1,140 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# One row per expected message
+MESSAGE_DTYPE = np.dtype([
+    ('can_ch', np.uint8),
+    ('can_id', np.uint32),
+    ('cycle_ms', np.int32),
+])
+
+# Check results, one row per expected message. Statistics are NaN when they cannot be computed.
+RESULT_DTYPE = np.dtype([
+    ('mean_ms', np.float64),
+    ('min_ms', np.float64),
+    ('max_ms', np.float64),
+    ('std_ms', np.float64),
+    ('jitter_ms', np.float64),
+    ('missed', np.int64),
+    ('bursts', np.int64),
+    ('frames', np.int64),
+    ('status', np.int8),
+    ('timing', np.int8),
+])
+
+# Values of the status column
+UNCHECKED = -1
+NOT_RECEIVED = 0
+RECEIVED = 1
+STATUS_NAMES = {UNCHECKED: 'Not Checked', NOT_RECEIVED: 'Not Received', RECEIVED: 'Received'}
+
+# Values of the timing column
+TIMING_NA = -1
+TIMING_FAILED = 0
+TIMING_PASSED = 1
+TIMING_NAMES = {TIMING_NA: 'N/A', TIMING_FAILED: 'Failed', TIMING_PASSED: 'Passed'}
+# Decimals of the millisecond statistics in the reports
+REPORT_DECIMALS = 3
+
+
+class MessageTable(object):
+    """ Columnar table of the expected CAN messages and their check results, backed by numpy structured arrays """
+
+    def __init__(self, messages):
+        """ build the table
+        :param messages: dictionary of (CAN channel, CAN ID) -> message dictionary, from dbc_util.load_messages
+        :return None
+        """
+        self.definitions = np.array([(message['can_ch'], message['can_id'], message['cycle_ms'])
+                                     for message in messages.values()], dtype=MESSAGE_DTYPE)
+        self.signals = [message.get('signals', []) for message in messages.values()]
+        # (CAN channel, CAN ID) -> row
+        self.rows = {key: row for row, key in enumerate(messages)}
+        self.results = None
+        self.reset_results()
+
+    def __len__(self):
+        return len(self.definitions)
+
+    @property
+    def cycle_ms(self):
+        """ expected cycle time of each row in ms, a view of the definitions """
+        return self.definitions['cycle_ms']
+
+    def reset_results(self):
+        """ mark every row as not checked, for a new check of the same messages
+
+        :return: None
+        """
+        self.results = np.zeros(len(self.definitions), dtype=RESULT_DTYPE)
+        self.results['status'] = UNCHECKED
+        self.results['timing'] = TIMING_NA
+        for column in ('mean_ms', 'min_ms', 'max_ms', 'std_ms', 'jitter_ms'):
+            self.results[column] = np.nan
+
+    def get_channels(self):
+        """ :return: sorted list of the CAN channels with expected messages """
+        return [int(can_ch) for can_ch in np.unique(self.definitions['can_ch'])]
+
+    def get_channel_rows(self, can_ch):
+        """ find the rows of the messages of a CAN channel
+
+        :param can_ch: CAN channel
+        :return: numpy array of rows
+        """
+        return np.flatnonzero(self.definitions['can_ch'] == can_ch)
+
+    def set_results(self, rows, results):
+        """ store the check results of some rows
+
+        :param rows: numpy array of rows
+        :param results: dictionary of column name -> numpy array over all rows, from CycleStatistics.get_results
+        :return: None
+        """
+        received = results['count'][rows] > 0
+        judged = results['judged'][rows]
+        self.results['frames'][rows] = results['count'][rows]
+        self.results['missed'][rows] = results['missed'][rows]
+        self.results['bursts'][rows] = results['bursts'][rows]
+        for column in ('mean_ms', 'min_ms', 'max_ms', 'std_ms', 'jitter_ms'):
+            self.results[column][rows] = np.where(judged, results[column][rows], np.nan)
+        self.results['status'][rows] = np.where(received, RECEIVED, NOT_RECEIVED)
+        self.results['timing'][rows] = np.where(judged, np.where(results['passed'][rows], TIMING_PASSED,
+                                                                 TIMING_FAILED), TIMING_NA)
+
+    def get_columns(self, jitter_percentile):
+        """ hand the checked rows over to the reporting layer
+
+        The statistics columns are copies rounded to REPORT_DECIMALS. When all rows were checked, the other numeric
+        columns are views of the table and must not be modified, otherwise they are copies.
+
+        :param jitter_percentile: percentile of the jitter column, for its name
+        :return: ordered dictionary of report column name -> numpy array
+        """
+        checked = self.results['status'] != UNCHECKED
+        if checked.all():
+            definitions = self.definitions
+            results = self.results
+        else:
+            definitions = self.definitions[checked]
+            results = self.results[checked]
+        status_names = np.array([STATUS_NAMES[UNCHECKED], STATUS_NAMES[NOT_RECEIVED], STATUS_NAMES[RECEIVED]])
+        timing_names = np.array([TIMING_NAMES[TIMING_NA], TIMING_NAMES[TIMING_FAILED], TIMING_NAMES[TIMING_PASSED]])
+
+        return OrderedDict([
+            ('CAN Channel', definitions['can_ch']),
+            ('CAN ID', np.array(['{:X}'.format(can_id) for can_id in definitions['can_id'].tolist()])),
+            ('Cycle (ms)', definitions['cycle_ms']),
+            ('Average Cycle (ms)', np.round(results['mean_ms'], REPORT_DECIMALS)),
+            ('Min Cycle (ms)', np.round(results['min_ms'], REPORT_DECIMALS)),
+            ('Max Cycle (ms)', np.round(results['max_ms'], REPORT_DECIMALS)),
+            ('Std Dev (ms)', np.round(results['std_ms'], REPORT_DECIMALS)),
+            ('P{} Jitter (ms)'.format(jitter_percentile), np.round(results['jitter_ms'], REPORT_DECIMALS)),
+            ('Missed', results['missed']),
+            ('Bursts', results['bursts']),
+            ('Frames', results['frames']),
+            # The codes start at -1
+            ('Status', status_names[results['status'] + 1]),
+            ('Timing', timing_names[results['timing'] + 1]),
+        ])
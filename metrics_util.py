@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter, process_time
+
+import json
+import os
+import platform
+import threading
+
+METRICS_FILE = 'run_metrics.json'
+# Values of the profiler option
+PROFILERS = ['cprofile', 'tracemalloc']
+# Allocation sites listed in the metrics file with tracemalloc
+TRACEMALLOC_TOP = 20
+
+
+class RunMetrics(object):
+    """ Records the wall and CPU time of the stages of a run and counters such as frame counts, written as JSON
+
+    CPU times are those of the whole process, including the threads running during the stage.
+    Stages and counters may be recorded from any thread.
+    """
+
+    def __init__(self, profiler=None):
+        """ start the run clock and the profiler
+        :param profiler: None, 'cprofile' to profile the run or 'tracemalloc' to trace its memory allocations
+        :return None
+        """
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.start_s = perf_counter()
+        self.start_cpu_s = process_time()
+        self.stages = []
+        self.counters = OrderedDict()
+        self.lock = threading.Lock()
+        self.profiler = profiler
+        self.profile = None
+        if profiler == 'cprofile':
+            import cProfile
+
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif profiler == 'tracemalloc':
+            import tracemalloc
+
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, **details):
+        """ time a stage, also if it raises
+
+        :param name: stage name, e.g. 'dbc parse' or 'analysis CAN1'
+        :param details: values stored with the stage
+        :return: context manager
+        """
+        start_s = perf_counter()
+        start_cpu_s = process_time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, perf_counter() - start_s, process_time() - start_cpu_s, start_s, **details)
+
+    def add_stage(self, name, wall_s, cpu_s=None, start_s=None, **details):
+        """ record a stage timed by the caller
+
+        :param name: stage name
+        :param wall_s: wall time in seconds
+        :param cpu_s: CPU time in seconds, None if not measured
+        :param start_s: perf_counter() at the start of the stage
+        :param details: values stored with the stage
+        :return: None
+        """
+        stage = OrderedDict([('stage', name),
+                             ('start_s', None if start_s is None else round(start_s - self.start_s, 6)),
+                             ('wall_s', round(wall_s, 6)),
+                             ('cpu_s', None if cpu_s is None else round(cpu_s, 6))])
+        if self.profiler == 'tracemalloc':
+            import tracemalloc
+
+            stage['traced_kb'] = tracemalloc.get_traced_memory()[0] // 1024
+        stage.update(details)
+        with self.lock:
+            self.stages.append(stage)
+
+    def set(self, name, value):
+        """ set a counter
+
+        :param name: counter name, e.g. 'CAN1 frames'
+        :param value: JSON-serializable value
+        :return: None
+        """
+        with self.lock:
+            self.counters[name] = value
+
+    def add(self, name, value=1):
+        """ add to a counter, starting from 0 """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def stop_profiler(self, metrics_file):
+        """ stop the profiler, the cProfile statistics are saved next to the metrics file
+
+        :param metrics_file: path of the metrics file
+        :return: dictionary of the profiler results for the metrics file
+        """
+        results = OrderedDict()
+        if self.profiler == 'cprofile' and self.profile is not None:
+            self.profile.disable()
+            profile_file = os.path.splitext(metrics_file)[0] + '.prof'
+            self.profile.dump_stats(profile_file)
+            self.profile = None
+            results['profile_file'] = profile_file
+        elif self.profiler == 'tracemalloc':
+            import tracemalloc
+
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                statistics = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP]
+                tracemalloc.stop()
+                results['traced_kb'] = current // 1024
+                results['peak_kb'] = peak // 1024
+                results['top_allocations'] = [OrderedDict([('site', str(statistic.traceback[0])),
+                                                           ('size_kb', statistic.size // 1024),
+                                                           ('count', statistic.count)])
+                                              for statistic in statistics]
+        return results
+
+    def write(self, metrics_file=METRICS_FILE):
+        """ stop the profiler and write the stages, counters and profiler results
+
+        :param metrics_file: path of the JSON file
+        :return: None
+        """
+        metrics = OrderedDict([('started', self.started),
+                               ('python', platform.python_version()),
+                               ('profiler', self.profiler),
+                               ('wall_s', round(perf_counter() - self.start_s, 6)),
+                               ('cpu_s', round(process_time() - self.start_cpu_s, 6))])
+        metrics.update(self.stop_profiler(metrics_file))
+        with self.lock:
+            metrics['stages'] = list(self.stages)
+            metrics['counters'] = OrderedDict(self.counters)
+        with open(metrics_file, 'w') as fp:
+            json.dump(metrics, fp, indent=2)
+        print('Metrics written to {}'.format(metrics_file))
@@ -0,0 +1,247 @@
+from can_log_util import EXTENDED_ID_FLAG
+from datetime import datetime
+from time import time
+from timing_util import BURST_FACTOR, DEFAULT_TOLERANCES, JITTER_PERCENTILE, MISSED_FACTOR
+
+import can
+import json
+import logging
+import queue
+import threading
+import numpy as np
+
+# Frame gaps kept per message for the rolling statistics
+RING_SIZE = 1000
+# A message is reported as stopped after this many cycles without a frame
+STOP_CYCLES = 3
+# Gaps within the jitter tolerance in a row before a message is back in tolerance
+RECOVERY_GAPS = 10
+SNAPSHOTS_FILE = 'soak_snapshots.jsonl'
+ALERTS_FILE = 'soak_alerts.jsonl'
+
+
+class AlertLog(object):
+    """ Collects the alerts raised by the monitors, which are written, logged and printed by the main loop
+
+    The monitors raise alerts from the notifier threads, which only queue them, so a slow disk or console
+    does not delay the reception of the frames.
+    """
+
+    def __init__(self, alerts_file=ALERTS_FILE):
+        """ open the alert file
+        :param alerts_file: JSON-lines file, appended to
+        :return None
+        """
+        self.fp = open(alerts_file, 'a')
+        self.pending = queue.Queue()
+        self.count = 0
+
+    def __call__(self, alert, can_ch, can_id, timestamp, **details):
+        """ raise an alert, it is written by the next write_pending()
+
+        :param alert: 'stopped', 'resumed', 'out of tolerance' or 'in tolerance'
+        :param can_ch: CAN channel
+        :param can_id: CAN ID, extended IDs with EXTENDED_ID_FLAG
+        :param timestamp: local time of the reception of the frame or of the check in seconds, as time()
+        :param details: values stored with the alert
+        :return: None
+        """
+        self.pending.put((alert, can_ch, can_id, timestamp, details))
+
+    def write_pending(self):
+        """ write, log and print the alerts raised since the last call, in the order they were raised
+
+        :return: number of alerts written
+        """
+        count = 0
+        while True:
+            try:
+                alert, can_ch, can_id, timestamp, details = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            record = dict(time=datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds'), alert=alert,
+                          can_ch=can_ch, can_id='{:X}'.format(can_id & ~EXTENDED_ID_FLAG), **details)
+            self.fp.write(json.dumps(record) + '\n')
+            message = 'CAN CH: {} ID {}: {} {}'.format(can_ch, record['can_id'], alert, details or '')
+            logging.warning(message)
+            print(message)
+            count += 1
+        if count > 0:
+            self.fp.flush()
+            self.count += count
+
+        return count
+
+    def close(self):
+        """ write the pending alerts and close the alert file
+
+        :return: None
+        """
+        self.write_pending()
+        self.fp.close()
+
+
+class RingBufferMonitor(can.Listener):
+    """ Continuous monitor of the expected messages of one CAN channel, for soak tests
+
+    The last ring_size frame gaps of each message are kept in a fixed-size array for the rolling statistics,
+    with lifetime frame, missed frame and burst counters, so memory use does not grow with the run time.
+    An alert is raised at the first gap outside the jitter tolerance, and when a message stops or resumes.
+    """
+
+    def __init__(self, can_ch, messages, alert, ring_size=RING_SIZE, tolerances=None):
+        """ allocate the buffers
+        :param can_ch: CAN channel
+        :param messages: numpy array of MESSAGE_DTYPE rows of the channel, from MessageTable.definitions
+        :param alert: callable(alert, can_ch, can_id, timestamp, **details) called from the notifier thread,
+                      e.g. AlertLog
+        :param ring_size: frame gaps kept per message
+        :param tolerances: dictionary overriding timing_util.DEFAULT_TOLERANCES
+        :return None
+        """
+        self.can_ch = can_ch
+        self.can_ids = messages['can_id'].tolist()
+        self.cycle_ms = messages['cycle_ms'].astype(np.float64)
+        self.alert = alert
+        self.ring_size = ring_size
+        self.tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+        self.rows = {can_id: row for row, can_id in enumerate(self.can_ids)}
+        self.gaps_ms = np.full((len(self.can_ids), ring_size), np.nan)
+        # Per-frame state in lists, which are faster than numpy arrays for one value at a time
+        self.cycles_ms = self.cycle_ms.tolist()
+        self.last = [None] * len(self.can_ids)
+        # Local reception times, the timestamps of the interface do not have to count from the epoch
+        self.received = [None] * len(self.can_ids)
+        self.positions = [0] * len(self.can_ids)
+        self.frames = [0] * len(self.can_ids)
+        self.missed = [0] * len(self.can_ids)
+        self.bursts = [0] * len(self.can_ids)
+        self.good_gaps = [0] * len(self.can_ids)
+        # Largest deviation from the cycle time within tolerance, in ms
+        self.jitter_limits_ms = (self.cycle_ms * self.tolerances['jitter_pct'] / 100).tolist()
+        self.out_of_tolerance = set()
+        self.stopped = set()
+        self.lock = threading.Lock()
+        self.start_s = time()
+
+    def on_message_received(self, msg):
+        if msg.is_error_frame:
+            return
+        row = self.rows.get(msg.arbitration_id | EXTENDED_ID_FLAG if msg.is_extended_id else msg.arbitration_id)
+        if row is None:
+            return
+        received_s = time()
+        self.received[row] = received_s
+        timestamp = msg.timestamp
+        last = self.last[row]
+        self.last[row] = timestamp
+        self.frames[row] += 1
+        with self.lock:
+            resumed = row in self.stopped
+            self.stopped.discard(row)
+        if resumed:
+            self.alert('resumed', self.can_ch, self.can_ids[row], received_s,
+                       gap_ms=None if last is None else round((timestamp - last) * 1000, 3))
+        cycle_ms = self.cycles_ms[row]
+        if last is None or cycle_ms <= 0:
+            return
+
+        gap_ms = (timestamp - last) * 1000
+        position = self.positions[row]
+        self.gaps_ms[row, position % self.ring_size] = gap_ms
+        self.positions[row] = position + 1
+        if gap_ms > MISSED_FACTOR * cycle_ms:
+            self.missed[row] += int(round(gap_ms / cycle_ms)) - 1
+        elif gap_ms < BURST_FACTOR * cycle_ms:
+            self.bursts[row] += 1
+
+        if abs(gap_ms - cycle_ms) > self.jitter_limits_ms[row]:
+            self.good_gaps[row] = 0
+            if row not in self.out_of_tolerance:
+                with self.lock:
+                    self.out_of_tolerance.add(row)
+                self.alert('out of tolerance', self.can_ch, self.can_ids[row], received_s, gap_ms=round(gap_ms, 3),
+                           cycle_ms=cycle_ms)
+        elif row in self.out_of_tolerance:
+            self.good_gaps[row] += 1
+            if self.good_gaps[row] >= RECOVERY_GAPS:
+                with self.lock:
+                    self.out_of_tolerance.discard(row)
+                self.alert('in tolerance', self.can_ch, self.can_ids[row], received_s, cycle_ms=cycle_ms)
+
+    def check_stopped(self, now_s=None):
+        """ raise an alert for each message without a frame for STOP_CYCLES cycles, once until it resumes
+
+        :param now_s: current local time in seconds, as time()
+        :return: None
+        """
+        now_s = time() if now_s is None else now_s
+        # Messages never received are measured from the start of the monitor
+        last = np.array([self.start_s if received_s is None else received_s for received_s in self.received])
+        late = np.flatnonzero((self.cycle_ms > 0) & ((now_s - last) * 1000 > STOP_CYCLES * self.cycle_ms))
+        for row in late.tolist():
+            with self.lock:
+                stopped = row not in self.stopped
+                self.stopped.add(row)
+            if stopped:
+                self.alert('stopped', self.can_ch, self.can_ids[row], now_s,
+                           silent_ms=round((now_s - last[row]) * 1000, 3), cycle_ms=self.cycles_ms[row])
+
+    def get_results(self):
+        """ rolling statistics of the kept gaps and lifetime counters, judged against the tolerances
+
+        :return: dictionary of column name -> numpy array, as timing_util.CycleStatistics.get_results
+        """
+        gaps_ms = self.gaps_ms.copy()
+        gap_count = np.minimum(np.array(self.positions), self.ring_size)
+        judged = (gap_count > 0) & (self.cycle_ms > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            filled = gaps_ms[judged]
+            cycle_ms = self.cycle_ms[judged][:, None]
+            results = {column: np.full(len(self.can_ids), np.nan)
+                       for column in ('mean_ms', 'std_ms', 'min_ms', 'max_ms', 'jitter_ms')}
+            if len(filled) > 0:
+                results['mean_ms'][judged] = np.nanmean(filled, axis=1)
+                results['std_ms'][judged] = np.nanstd(filled, axis=1)
+                results['min_ms'][judged] = np.nanmin(filled, axis=1)
+                results['max_ms'][judged] = np.nanmax(filled, axis=1)
+                results['jitter_ms'][judged] = np.nanpercentile(np.abs(filled - cycle_ms), JITTER_PERCENTILE, axis=1)
+            # Missed frames and bursts within the kept gaps
+            window_missed = np.zeros(len(self.can_ids), dtype=np.int64)
+            window_bursts = np.zeros(len(self.can_ids), dtype=np.int64)
+            if len(filled) > 0:
+                window_missed[judged] = np.nansum(np.where(filled > MISSED_FACTOR * cycle_ms,
+                                                           np.round(filled / cycle_ms) - 1, 0), axis=1)
+                window_bursts[judged] = (filled < BURST_FACTOR * cycle_ms).sum(axis=1)
+
+            deviation_pct = np.abs(results['mean_ms'] - self.cycle_ms) * 100 / self.cycle_ms
+            passed = judged & (deviation_pct <= self.tolerances['mean_pct']) & \
+                (results['jitter_ms'] * 100 / self.cycle_ms <= self.tolerances['jitter_pct']) & \
+                (window_missed <= self.tolerances['max_missed'])
+            if self.tolerances['max_bursts'] is not None:
+                passed &= window_bursts <= self.tolerances['max_bursts']
+
+        results.update(count=np.array(self.frames, dtype=np.int64), missed=np.array(self.missed, dtype=np.int64),
+                       bursts=np.array(self.bursts, dtype=np.int64), passed=passed, judged=judged)
+        return results
+
+    def get_snapshot(self):
+        """ summarize the channel for the periodic snapshots
+
+        :return: dictionary of JSON-serializable values, the failing and stopped messages with their statistics
+        """
+        results = self.get_results()
+        failing = np.flatnonzero(results['judged'] & ~results['passed'])
+        with self.lock:
+            stopped = sorted(self.stopped)
+
+        def describe(row):
+            return {'can_id': '{:X}'.format(self.can_ids[row] & ~EXTENDED_ID_FLAG), 'cycle_ms': self.cycles_ms[row],
+                    'mean_ms': round(float(results['mean_ms'][row]), 3),
+                    'max_ms': round(float(results['max_ms'][row]), 3),
+                    'jitter_ms': round(float(results['jitter_ms'][row]), 3), 'missed': int(results['missed'][row])}
+
+        return {'frames': int(results['count'].sum()), 'missed': int(results['missed'].sum()),
+                'bursts': int(results['bursts'].sum()), 'expected': len(self.can_ids),
+                'passed': int(results['passed'].sum()), 'failing': [describe(row) for row in failing.tolist()],
+                'stopped': ['{:X}'.format(self.can_ids[row] & ~EXTENDED_ID_FLAG) for row in stopped]}
@@ -0,0 +1,223 @@
+import csv
+import json
+import math
+
+# Rows of one Excel sheet, without the header. Longer sheets continue on '<name> 2', '<name> 3', ..
+MAX_EXCEL_ROWS = 1048575
+# Rows per Parquet row group
+PARQUET_BATCH_ROWS = 65536
+# Column types given to ReportWriter.write_rows -> Arrow type names
+PARQUET_TYPES = {int: 'int64', float: 'float64', str: 'string', bool: 'bool'}
+# numpy dtype kinds -> column types
+DTYPE_KINDS = {'b': bool, 'i': int, 'u': int, 'f': float, 'U': str, 'S': str}
+
+
+def to_cell(value, na_rep):
+    """ convert a report value to a plain Python value
+
+    :param value: value of a column, numpy scalars included
+    :param na_rep: value written for NaN and None
+    :return: int, float, str or bool
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return na_rep
+    return value
+
+
+def get_column_types(columns):
+    """ find the types of a set of columns from their numpy dtypes
+
+    :param columns: ordered dictionary of column name -> numpy array or list
+    :return: list of int, float, str or bool, None for the columns of unknown type
+    """
+    return [DTYPE_KINDS.get(column.dtype.kind) if hasattr(column, 'dtype') else None for column in columns.values()]
+
+
+def iter_column_rows(columns):
+    """ iterate over the rows of a set of columns
+
+    :param columns: ordered dictionary of column name -> numpy array or list
+    :return: generator of row tuples
+    """
+    return zip(*[column.tolist() if hasattr(column, 'tolist') else column for column in columns.values()])
+
+
+class ReportWriter(object):
+    """ Report backend, writes sheets of rows to one or more files named after the report
+
+    Sheets are streamed: rows are taken from any iterable and are not kept by the writer.
+    """
+    extension = None
+
+    def __init__(self, report_name, na_rep=None):
+        """ initialize the writer
+        :param report_name: file name of the report without the extension
+        :param na_rep: value written for missing values
+        :return None
+        """
+        self.report_name = report_name
+        self.na_rep = na_rep
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_file_name(self, sheet_name):
+        """ :return: file name of a sheet, for the formats with one file per sheet """
+        return '{}_{}.{}'.format(self.report_name, sheet_name.replace(' ', '_'), self.extension)
+
+    def write_columns(self, sheet_name, columns):
+        """ write a sheet from a set of columns
+
+        :param sheet_name: str
+        :param columns: ordered dictionary of column name -> numpy array or list
+        :return: None
+        """
+        self.write_rows(sheet_name, list(columns), iter_column_rows(columns), get_column_types(columns))
+
+    def write_rows(self, sheet_name, header, rows, types=None):
+        """ write a sheet from an iterable of rows
+
+        :param sheet_name: str
+        :param header: list of column names
+        :param rows: iterable of row tuples
+        :param types: list of the column types, int, float, str, bool or None, for the formats with a schema.
+                      By default the types are taken from the first rows.
+        :return: None
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """ finish the report
+
+        :return: list of the files written
+        """
+        return self.files
+
+
+class CsvReportWriter(ReportWriter):
+    """ One CSV file per sheet """
+    extension = 'csv'
+
+    def __init__(self, report_name, na_rep=''):
+        super(CsvReportWriter, self).__init__(report_name, na_rep)
+
+    def write_rows(self, sheet_name, header, rows, types=None):
+        file_name = self.get_file_name(sheet_name)
+        with open(file_name, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(header)
+            na_rep = self.na_rep
+            writer.writerows([to_cell(value, na_rep) for value in row] for row in rows)
+        self.files.append(file_name)
+
+
+class JsonLinesReportWriter(ReportWriter):
+    """ One JSON-lines file per sheet, one object per row, missing values are null """
+    extension = 'jsonl'
+
+    def write_rows(self, sheet_name, header, rows, types=None):
+        file_name = self.get_file_name(sheet_name)
+        with open(file_name, 'w') as fp:
+            for row in rows:
+                fp.write(json.dumps(dict(zip(header, [to_cell(value, self.na_rep) for value in row]))))
+                fp.write('\n')
+        self.files.append(file_name)
+
+
+class ParquetReportWriter(ReportWriter):
+    """ One Parquet file per sheet, written in row groups of PARQUET_BATCH_ROWS rows, needs pyarrow """
+    extension = 'parquet'
+
+    def __init__(self, report_name, na_rep=None):
+        super(ParquetReportWriter, self).__init__(report_name, na_rep)
+        # Fail before the check rather than at the report
+        import pyarrow.parquet
+
+    def write_batch(self, writer, file_name, header, types, batch):
+        """ write a row group, the file is created with the schema of the first row group
+
+        :return: pyarrow.parquet.ParquetWriter
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = list(zip(*batch)) if batch else [[] for _ in header]
+        arrays = []
+        for column, column_type in zip(columns, types):
+            array = pa.array([to_cell(value, None) for value in column],
+                             type=pa.type_for_alias(PARQUET_TYPES[column_type]) if column_type else None)
+            # A column of unknown type without a value in the first row group would get the null type,
+            # which later values cannot be cast to
+            if writer is None and pa.types.is_null(array.type):
+                array = array.cast(pa.string())
+            arrays.append(array)
+        table = pa.Table.from_arrays(arrays, names=header)
+        if writer is None:
+            writer = pq.ParquetWriter(file_name, table.schema)
+        elif table.schema != writer.schema:
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+
+        return writer
+
+    def write_rows(self, sheet_name, header, rows, types=None):
+        file_name = self.get_file_name(sheet_name)
+        types = types or [None] * len(header)
+        writer = None
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == PARQUET_BATCH_ROWS:
+                writer = self.write_batch(writer, file_name, header, types, batch)
+                batch = []
+        if batch or writer is None:
+            writer = self.write_batch(writer, file_name, header, types, batch)
+        writer.close()
+        self.files.append(file_name)
+
+
+class ExcelReportWriter(ReportWriter):
+    """ One Excel workbook, each sheet streamed in openpyxl write-only mode """
+    extension = 'xlsx'
+
+    def __init__(self, report_name, na_rep='N/A'):
+        from openpyxl import Workbook
+
+        super(ExcelReportWriter, self).__init__(report_name, na_rep)
+        self.workbook = Workbook(write_only=True)
+
+    def write_rows(self, sheet_name, header, rows, types=None):
+        part = 1
+        sheet = self.workbook.create_sheet(sheet_name[:31])
+        sheet.append(header)
+        row_count = 0
+        for row in rows:
+            if row_count == MAX_EXCEL_ROWS:
+                part += 1
+                sheet = self.workbook.create_sheet('{} {}'.format(sheet_name[:28], part))
+                sheet.append(header)
+                row_count = 0
+            sheet.append([to_cell(value, self.na_rep) for value in row])
+            row_count += 1
+
+    def close(self):
+        if self.workbook is not None:
+            file_name = '{}.{}'.format(self.report_name, self.extension)
+            self.workbook.save(file_name)
+            self.workbook = None
+            self.files.append(file_name)
+        return self.files
+
+
+REPORT_WRITERS = {
+    'xlsx': ExcelReportWriter,
+    'csv': CsvReportWriter,
+    'jsonl': JsonLinesReportWriter,
+    'parquet': ParquetReportWriter,
+}
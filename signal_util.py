@@ -0,0 +1,85 @@
+import re
+import numpy as np
+
+# SG_ <name> [<multiplexer>] : <start bit>|<length>@<byte order><sign> (<factor>,<offset>) [<min>|<max>] ...
+SIGNAL_LINE = re.compile(r'^\s*SG_\s+(\w+)\s*(?:\w+\s*)?:\s*(\d+)\|(\d+)@([01])([+-])\s*'
+                         r'\(([^,]+),([^)]+)\)\s*\[([^|]+)\|([^\]]+)\]')
+
+
+def parse_signal_line(line):
+    """ parse a SG_ line of a DBC file
+
+    :param line: str
+    :return: (name, start bit, length, little endian, signed, factor, offset, minimum, maximum) or None
+    """
+    match = SIGNAL_LINE.match(line)
+    if match is None:
+        return None
+    name, start, length, byte_order, sign, factor, offset, minimum, maximum = match.groups()
+
+    return (name, int(start), int(length), byte_order == '1', sign == '-', float(factor), float(offset),
+            float(minimum), float(maximum))
+
+
+class SignalLayout(object):
+    """ Bit-extraction table of the signals of one message, decoding whole batches of payloads with numpy """
+
+    def __init__(self, signals):
+        """ compile the signal definitions
+        :param signals: list of signal tuples from parse_signal_line
+        :return None
+        """
+        self.names = [signal[0] for signal in signals]
+        start = np.array([signal[1] for signal in signals], dtype=np.int64)
+        length = np.array([signal[2] for signal in signals], dtype=np.int64)
+        self.little_endian = np.array([signal[3] for signal in signals], dtype=bool)
+        self.signed = np.array([signal[4] for signal in signals], dtype=bool)
+        self.factor = np.array([signal[5] for signal in signals])
+        self.offset = np.array([signal[6] for signal in signals])
+        self.minimum = np.array([signal[7] for signal in signals])
+        self.maximum = np.array([signal[8] for signal in signals])
+        # Signals with [0|0] have no range
+        self.ranged = (self.minimum != 0) | (self.maximum != 0)
+
+        # Intel signals are taken from the payload read as a little-endian integer, starting at their LSB.
+        # Motorola signals are taken from the payload read as a big-endian integer, the start bit is their MSB.
+        motorola_lsb = (7 - start // 8) * 8 + start % 8 - length + 1
+        self.shift = np.where(self.little_endian, start, motorola_lsb).astype(np.uint64)
+        self.length = length
+        self.mask = np.array([(1 << int(bits)) - 1 for bits in length], dtype=np.uint64)
+
+    def decode(self, payloads):
+        """ decode a batch of payloads
+
+        :param payloads: numpy array of uint64, each the 8 payload bytes read as a little-endian integer
+        :return: numpy array of physical values, one row per payload and one column per signal
+        """
+        payloads = np.asarray(payloads, dtype=np.uint64)
+        little = payloads[:, None]
+        big = payloads.byteswap()[:, None]
+        raw = np.where(self.little_endian, little >> self.shift, big >> self.shift) & self.mask
+
+        values = raw.astype(np.float64)
+        negative = self.signed & ((raw >> (self.length - 1).astype(np.uint64)) & np.uint64(1)).astype(bool)
+        values = np.where(negative, values - np.exp2(self.length.astype(np.float64)), values)
+
+        return values * self.factor + self.offset
+
+    def check(self, payloads):
+        """ decode a batch of payloads and check the signals against their DBC ranges
+
+        :param payloads: numpy array of uint64, see decode
+        :return: dictionary of column name -> numpy array, one value per signal
+        """
+        values = self.decode(payloads)
+        out_of_range = self.ranged & ((values < self.minimum) | (values > self.maximum))
+
+        return {
+            'min': values.min(axis=0),
+            'max': values.max(axis=0),
+            'last': values[-1],
+            'out_of_range': out_of_range.sum(axis=0),
+            # A signal that never changes during the capture, for information: many signals are constant while the
+            # vehicle stands still
+            'constant': (values == values[0]).all(axis=0) & (len(values) > 1),
+        }
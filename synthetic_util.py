@@ -0,0 +1,150 @@
+from pathlib import Path
+
+import os
+import numpy as np
+
+# Cycle times of the generated messages in ms
+CYCLE_TIMES_MS = [10, 20, 50, 100, 200, 500, 1000]
+# DBC name parts of CAN 1 to CAN 4, as in PostFlashPreTestCheck.create_message_list
+DBC_NAMES = {
+    'GC7': ['LOCAL1', 'LOCAL2', 'SA', 'PU'],
+    'HR3': ['LOCAL1', 'LOCAL2', 'LOCAL', 'MAIN'],
+}
+
+
+def generate_messages(message_count, signal_count=4, seed=0):
+    """ generate the expected messages of the 4 CAN channels
+
+    :param message_count: number of messages of all the channels
+    :param signal_count: number of 8-bit signals per message, at most 8
+    :param seed: random seed
+    :return: list of message dictionaries with can_ch, can_id, cycle_ms and signals (name, start bit, length)
+    """
+    random = np.random.RandomState(seed)
+    messages = []
+    for index in range(message_count):
+        can_ch = index % 4 + 1
+        # Standard IDs while they last, then extended IDs
+        can_id = 0x100 + index // 4 if 0x100 + index // 4 < 0x7FF else (0x18000000 + index) | 0x80000000
+        signals = [('Signal{}_{}'.format(index, bit // 8), bit, 8) for bit in range(0, 8 * signal_count, 8)]
+        messages.append({'can_ch': can_ch, 'can_id': can_id, 'cycle_ms': int(random.choice(CYCLE_TIMES_MS)),
+                         'signals': signals})
+
+    return messages
+
+
+def write_dbc_tree(dbc_folder, variant, messages):
+    """ write one DBC file per CAN channel in the DBC/<variant>/ layout, the messages are sent by the EYE node
+
+    :param dbc_folder: root of the DBC tree
+    :param variant: 'GC7' or 'HR3'
+    :param messages: list of message dictionaries, from generate_messages
+    :return: list of the DBC files
+    """
+    variant_folder = Path(dbc_folder) / variant
+    os.makedirs(str(variant_folder), exist_ok=True)
+    dbc_files = []
+    for can_ch, dbc_name in enumerate(DBC_NAMES[variant], 1):
+        # find_dbc_files takes the DBC files of CAN 1 to CAN 4 in upper-case name order
+        dbc_file = variant_folder / 'CAN{}_{}_{}.dbc'.format(can_ch, dbc_name, variant)
+        channel_messages = [message for message in messages if message['can_ch'] == can_ch]
+        with open(str(dbc_file), 'w') as fp:
+            fp.write('VERSION ""\n\nBU_: EYE TESTER\n\n')
+            for message in channel_messages:
+                fp.write('BO_ {} MSG_{:X}: 8 EYE\n'.format(message['can_id'], message['can_id']))
+                for name, start, length in message['signals']:
+                    fp.write(' SG_ {} : {}|{}@1+ (1,0) [0|200] "" TESTER\n'.format(name, start, length))
+                fp.write('\n')
+            fp.write('BA_DEF_ BO_  "GenMsgCycleTime" INT 0 65535;\n')
+            for message in channel_messages:
+                fp.write('BA_ "GenMsgCycleTime" BO_ {} {};\n'.format(message['can_id'], message['cycle_ms']))
+        dbc_files.append(str(dbc_file))
+
+    return dbc_files
+
+
+def write_map_file(map_file, symbol_count, section_count=64, seed=0):
+    """ write a TASKING application.map with sections and symbols, including StubVersion_Main and StubVersion_Sub
+
+    :param map_file: path of the map file
+    :param symbol_count: number of symbols
+    :param section_count: number of program flash sections
+    :param seed: random seed
+    :return: dictionary of symbol name -> address of the stub version variables
+    """
+    random = np.random.RandomState(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(map_file)), exist_ok=True)
+    addresses = 0x70000000 + np.sort(random.choice(0x100000, symbol_count, replace=False)).astype(np.int64)
+    names = ['Symbol_{:06d}'.format(index) for index in range(symbol_count)]
+    names[symbol_count // 2] = 'StubVersion_Main'
+    names[symbol_count // 2 + 1] = 'StubVersion_Sub'
+    with open(map_file, 'w') as fp:
+        fp.write('Synthetic TASKING linker map\n\n* Sections\n')
+        fp.write('| Chip    | Group | Section | Size (MAU) | Space addr | Chip addr | Alignment |\n')
+        for index in range(section_count):
+            address = 0x80000000 + index * 0x4000
+            fp.write('| mpe:pflash0 | | .text.section{} | 0x{:08x} | 0x{:08x} | 0x{:08x} | 0x00000002 |\n'.format(
+                index, 0x3F00, address, address & 0x0FFFFFFF))
+        fp.write('\n* Symbols (sorted on name)\n| Name | Space addr | Chip addr |\n')
+        for name, address in sorted(zip(names, addresses.tolist())):
+            fp.write('| {} | 0x{:08x} | 0x{:08x} |\n'.format(name, address, address & 0x0FFFFFFF))
+        fp.write('\n* Symbols (sorted on address)\n| Name | Space addr | Chip addr |\n')
+        for name, address in zip(names, addresses.tolist()):
+            fp.write('| {} | 0x{:08x} | 0x{:08x} |\n'.format(name, address, address & 0x0FFFFFFF))
+
+    return {name: address for name, address in zip(names, addresses.tolist()) if name.startswith('StubVersion')}
+
+
+def generate_timestamps(messages, duration_s, jitter_ms=0.2, dropout=0.0, seed=0):
+    """ generate the receive timestamps of cyclic messages
+
+    The frame rate is the sum of 1000 / cycle_ms over the messages.
+
+    :param messages: list of message dictionaries, from generate_messages
+    :param duration_s: length of the capture in seconds
+    :param jitter_ms: standard deviation of the frame timing in ms
+    :param dropout: probability of a frame being lost
+    :param seed: random seed
+    :return: list of numpy arrays of timestamps in seconds, one per message
+    """
+    random = np.random.RandomState(seed)
+    timestamps = []
+    for message in messages:
+        cycle_s = message['cycle_ms'] / 1000.0
+        message_timestamps = np.arange(random.uniform(0, cycle_s), duration_s, cycle_s)
+        message_timestamps += random.normal(0, jitter_ms / 1000.0, len(message_timestamps))
+        if dropout > 0:
+            message_timestamps = message_timestamps[random.random_sample(len(message_timestamps)) >= dropout]
+        timestamps.append(np.sort(message_timestamps))
+
+    return timestamps
+
+
+def write_asc_log(asc_file, messages, duration_s, jitter_ms=0.2, dropout=0.0, seed=0):
+    """ write an ASC log of cyclic messages, in the format of can.ASCWriter
+
+    :param asc_file: path of the log
+    :param messages: list of message dictionaries, from generate_messages
+    :param duration_s: length of the log in seconds
+    :param jitter_ms: standard deviation of the frame timing in ms
+    :param dropout: probability of a frame being lost
+    :param seed: random seed
+    :return: number of frames written
+    """
+    timestamps = generate_timestamps(messages, duration_s, jitter_ms, dropout, seed)
+    frame_timestamps = np.concatenate(timestamps)
+    frame_messages = np.repeat(np.arange(len(messages)), [len(message_timestamps) for message_timestamps in timestamps])
+    order = np.argsort(frame_timestamps, kind='stable')
+    ids = ['{:X}x'.format(message['can_id'] & 0x1FFFFFFF) if message['can_id'] & 0x80000000
+           else '{:X}'.format(message['can_id']) for message in messages]
+    channels = [message['can_ch'] for message in messages]
+    data = 'd 8 00 11 22 33 44 55 66 77'
+    with open(asc_file, 'w') as fp:
+        fp.write('date Sat Oct 17 12:00:00.000 am 2026\nbase hex  timestamps absolute\ninternal events logged\n')
+        fp.write('Begin Triggerblock Sat Oct 17 12:00:00.000 am 2026\n')
+        for timestamp, message in zip(frame_timestamps[order].tolist(), frame_messages[order].tolist()):
+            fp.write('{:>12.6f} {}  {:<15s} Rx   {}\n'.format(max(timestamp, 0.0), channels[message], ids[message],
+                                                            data))
+        fp.write('End TriggerBlock\n')
+
+    return len(order)
@@ -0,0 +1,36 @@
+from PostFlashPreTestCheck import PostFlashPreTestCheck
+from signal_util import SignalLayout
+from synthetic_util import write_dbc_tree
+from timing_util import CycleStatistics
+
+import numpy as np
+
+
+def test_messages_with_too_few_frames_are_listed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_dbc_tree('DBC', 'GC7', [{'can_ch': 1, 'can_id': can_id, 'cycle_ms': cycle_ms, 'signals': []}
+                                  for can_id, cycle_ms in [(0x100, 10), (0x3E8, 1000), (0x3E9, 1000)]])
+    pretest_check = PostFlashPreTestCheck('GC7', 'Build/', 'DBC/')
+    pretest_check.create_message_list()
+    rows = pretest_check.messages.rows
+    # 5 frames of 0x3E8 are all skipped, 0x3E9 has 3 gaps after the skipped frames
+    timestamps = {rows[(1, 0x100)]: np.arange(50) * 0.01, rows[(1, 0x3E8)]: np.arange(5) * 1.0,
+                  rows[(1, 0x3E9)]: np.arange(8) * 1.0}
+
+    result, summary = pretest_check.analyse_messages(1, CycleStatistics.from_timestamps(
+        pretest_check.messages.cycle_ms, timestamps))
+
+    assert result == 0
+    assert summary.splitlines() == ['Result: All expected messages received from CAN channel 1',
+                                    'Warning: too few frames to judge the cycle time of 3E8 from CAN channel 1']
+
+
+def test_constant_signals_are_reported_for_information():
+    pretest_check = PostFlashPreTestCheck('GC7', 'Build/', 'DBC/')
+    layout = SignalLayout([('Level', 0, 8, True, False, 1.0, 0.0, 0.0, 100.0),
+                           ('Gear', 8, 8, True, False, 1.0, 0.0, 0.0, 0.0)])
+
+    pretest_check.check_signals(1, 0x100, layout, np.array([0x0332, 0x0396, 0x0314], dtype=np.uint64))
+
+    assert [(row[2], row[8], row[9], row[10]) for row in pretest_check.signal_status] == [
+        ('Level', 1, False, 'Out of Range'), ('Gear', 0, True, 'OK')]
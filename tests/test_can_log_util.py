@@ -0,0 +1,60 @@
+from can_log_util import EXTENDED_ID_FLAG, analyse_log, parse_asc_line, read_log_frames
+
+import numpy as np
+
+ASC_LOG = '''date Sat Oct 17 11:37:18 am 2026
+base hex  timestamps absolute
+Begin Triggerblock Sat Oct 17 11:37:18 am 2026
+   0.000000 Start of measurement
+   0.010000 1  100             Rx   d 8 00 00 00 00 00 00 00 00
+   0.015000 2  18FF0010x       Rx   d 8 00 00 00 00 00 00 00 00
+   0.020000 1  100             Rx   d 8 00 00 00 00 00 00 00 00
+   0.021000 1  200             Tx   d 8 00 00 00 00 00 00 00 00
+   0.025000 1  ErrorFrame
+   0.030000 1  100             Rx   d 8 00 00 00 00 00 00 00 00
+End TriggerBlock
+'''
+
+
+def write_cyclic_log(asc_file, cycles_ms, frame_count):
+    """ ASC log of messages on CAN 1, sent every cycle from 0 """
+    frames = sorted((index * cycle_ms / 1000.0, can_id) for can_id, cycle_ms in cycles_ms.items()
+                    for index in range(frame_count))
+    with open(str(asc_file), 'w') as fp:
+        fp.write('base hex  timestamps absolute\n')
+        for timestamp, can_id in frames:
+            fp.write('{:11.6f} 1  {:X}             Rx   d 8 00 00 00 00 00 00 00 00\n'.format(timestamp, can_id))
+
+
+def test_parse_asc_line():
+    assert parse_asc_line('   0.010000 1  100             Rx   d 8 00 00 00 00 00 00 00 00') == \
+        (0.01, 0x100, 'Rx', '1')
+    assert parse_asc_line('   0.015000 2  18FF0010x       Rx   d 8 00') == \
+        (0.015, 0x18FF0010 | EXTENDED_ID_FLAG, 'Rx', '2')
+    assert parse_asc_line('base hex  timestamps absolute') is None
+    assert parse_asc_line('   0.025000 1  ErrorFrame') is None
+
+
+def test_read_log_frames(tmp_path):
+    asc_file = tmp_path / 'bus.asc'
+    asc_file.write_text(ASC_LOG)
+
+    assert list(read_log_frames(str(asc_file))) == [(0.01, 0x100, 1), (0.015, 0x18FF0010 | EXTENDED_ID_FLAG, 2),
+                                                    (0.02, 0x100, 1), (0.03, 0x100, 1)]
+    assert list(read_log_frames(str(asc_file), 'Tx')) == [(0.021, 0x200, 1)]
+
+
+def test_chunked_log_gives_the_single_pass_result(tmp_path):
+    asc_file = tmp_path / 'bus.asc'
+    write_cyclic_log(asc_file, {0x100: 10, 0x200: 20, 0x300: 50}, 200)
+    message_rows = {(1, 0x100): 0, (1, 0x200): 1, (1, 0x300): 2}
+    cycle_ms = [10, 20, 50]
+
+    single = analyse_log(str(asc_file), message_rows, cycle_ms, processes=1).get_results()
+    chunked = analyse_log(str(asc_file), message_rows, cycle_ms, processes=2, chunk_size=1000).get_results()
+
+    assert single['count'].tolist() == [200, 200, 200]
+    np.testing.assert_allclose(single['mean_ms'], cycle_ms)
+    for column in single:
+        np.testing.assert_allclose(chunked[column], single[column], rtol=1e-9, atol=1e-6, equal_nan=True,
+                                   err_msg=column)
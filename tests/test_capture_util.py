@@ -0,0 +1,60 @@
+from capture_util import (STANDARD_ID_BITS, EXTENDED_ID_BITS, TimestampListener, get_capture_window,
+                          merge_acceptance_filters)
+from message_util import MESSAGE_DTYPE
+
+import can
+import capture_util
+import numpy as np
+import pytest
+
+
+def accepts(filters, can_id):
+    return any(can_id & mask == code for code, mask in filters)
+
+
+def test_one_exact_filter_per_id_without_a_limit():
+    filters = merge_acceptance_filters([0x200, 0x100, 0x100], STANDARD_ID_BITS, None)
+
+    assert filters == [(0x100, 0x7FF), (0x200, 0x7FF)]
+
+
+def test_one_filter_keeps_the_common_bits():
+    assert merge_acceptance_filters([0x100, 0x101], STANDARD_ID_BITS, 1) == [(0x100, 0x7FE)]
+    assert merge_acceptance_filters([0x100, 0x102, 0x104], STANDARD_ID_BITS, 1) == [(0x100, 0x7F9)]
+
+
+def test_neighbours_are_merged_first():
+    filters = merge_acceptance_filters([0x100, 0x101, 0x200, 0x201], STANDARD_ID_BITS, 2)
+
+    assert sorted(filters) == [(0x100, 0x7FE), (0x200, 0x7FE)]
+
+
+@pytest.mark.parametrize('max_filters', [1, 2, 3, 5])
+def test_every_id_is_accepted(max_filters):
+    can_ids = [0x18FF0010, 0x18FF0011, 0x18FEF100, 0x0CF00400, 0x18FF0050, 0x1CFFAA00]
+
+    filters = merge_acceptance_filters(can_ids, EXTENDED_ID_BITS, max_filters)
+
+    assert len(filters) <= max_filters
+    assert all(accepts(filters, can_id) for can_id in can_ids)
+    # A merged filter lets through fewer other IDs than the single filter of all the IDs
+    assert sum(2 ** (EXTENDED_ID_BITS - bin(mask).count('1')) for code, mask in filters) <= \
+        2 ** (EXTENDED_ID_BITS - bin(merge_acceptance_filters(can_ids, EXTENDED_ID_BITS, 1)[0][1]).count('1'))
+
+
+@pytest.mark.parametrize('cycles_ms, window_s', [([10, 100], 5), ([10, 1000], 11), ([5000], 12), ([0], 5)])
+def test_capture_window_is_extended_for_long_cycle_times(cycles_ms, window_s):
+    messages = np.array([(1, 0x100 + index, cycle_ms) for index, cycle_ms in enumerate(cycles_ms)], dtype=MESSAGE_DTYPE)
+
+    assert get_capture_window(messages, 10, 5, 12) == pytest.approx(window_s)
+
+
+def test_lag_against_the_timestamps_of_the_interface(monkeypatch):
+    listener = TimestampListener({0x100: 4})
+    # The interface counts from its own start, the frames are handled 0, 0 and 30 ms later than the first
+    for local_s, timestamp in [(1000.0, 0.0), (1000.01, 0.01), (1000.05, 0.02)]:
+        monkeypatch.setattr(capture_util, 'time', lambda: local_s)
+        listener.on_message_received(can.Message(timestamp=timestamp, arbitration_id=0x100, is_extended_id=False))
+
+    assert listener.max_lag_s == pytest.approx(0.03)
+    assert listener.get_timestamps()[0x100].tolist() == [0.0, 0.01, 0.02]
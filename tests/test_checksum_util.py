@@ -0,0 +1,58 @@
+from checksum_util import (ADD_11, ADD_12, ADD_14, ADD_22, ADD_24, ADD_44, CRC_16, CRC_16_CITT, CRC_32, ERASED_BYTE,
+                           compute_checksum, get_memory, read_intel_hex)
+
+import pytest
+
+CHECK_DATA = b'123456789'
+
+
+def hex_record(record_type, address, data):
+    record = bytes([len(data), address >> 8, address & 0xFF, record_type]) + bytes(data)
+    return ':{}{:02X}\n'.format(record.hex().upper(), (-sum(record)) & 0xFF)
+
+
+@pytest.mark.parametrize('checksum_type, checksum', [(CRC_16, 0xBB3D), (CRC_16_CITT, 0x29B1), (CRC_32, 0xCBF43926)])
+def test_crc_check_values(checksum_type, checksum):
+    assert compute_checksum(CHECK_DATA, checksum_type) == checksum
+
+
+@pytest.mark.parametrize('checksum_type, byte_order, checksum', [
+    (ADD_11, '<', 0xFF & (0x01 + 0x02 + 0x03 + 0xFF + 0xFE)),
+    (ADD_12, '<', 0x01 + 0x02 + 0x03 + 0xFF + 0xFE),
+    (ADD_14, '<', 0x01 + 0x02 + 0x03 + 0xFF + 0xFE),
+    (ADD_22, '<', (0x0201 + 0xFF03) & 0xFFFF),
+    (ADD_22, '>', 0x0102 + 0x03FF),
+    (ADD_24, '<', 0x0201 + 0xFF03),
+    (ADD_44, '<', 0xFF030201),
+    (ADD_44, '>', 0x010203FF),
+])
+def test_add_checksums_ignore_the_incomplete_last_element(checksum_type, byte_order, checksum):
+    assert compute_checksum(bytes([0x01, 0x02, 0x03, 0xFF, 0xFE]), checksum_type, byte_order) == checksum
+
+
+def test_add_checksum_wraps_around():
+    assert compute_checksum(bytes([0xFF, 0xFF]) * 3, ADD_22) == (3 * 0xFFFF) & 0xFFFF
+
+
+def test_unsupported_checksum_type():
+    with pytest.raises(ValueError):
+        compute_checksum(CHECK_DATA, 0x0A)
+
+
+def test_read_intel_hex(tmp_path):
+    hex_file = tmp_path / 'application.hex'
+    hex_file.write_text(hex_record(0x04, 0, [0x80, 0x00]) + hex_record(0x00, 0x0000, [1, 2]) +
+                        hex_record(0x00, 0x0010, [4, 5, 6]) + hex_record(0x00, 0x0013, [7]) +
+                        hex_record(0x02, 0, [0x10, 0x00]) + hex_record(0x00, 0x0000, [8]) +
+                        hex_record(0x01, 0, []) + hex_record(0x00, 0x0100, [9]))
+
+    assert read_intel_hex(str(hex_file)) == [(0x00010000, bytearray([8])), (0x80000000, bytearray([1, 2])),
+                                             (0x80000010, bytearray([4, 5, 6, 7]))]
+
+
+def test_get_memory_fills_the_gaps():
+    blocks = [(0x100, bytearray([1, 2])), (0x104, bytearray([3, 4, 5]))]
+
+    assert get_memory(blocks, 0xFF, 8) == bytes([ERASED_BYTE, 1, 2, ERASED_BYTE, ERASED_BYTE, 3, 4, 5])
+    assert get_memory(blocks, 0x105, 4) == bytes([4, 5, ERASED_BYTE, ERASED_BYTE])
+    assert get_memory(blocks, 0x200, 2) == bytes([ERASED_BYTE, ERASED_BYTE])
@@ -0,0 +1,187 @@
+from common_util import (Database, close_databases, find_section_header, get_database, inject_lines_of_code,
+                         insert_lines_of_code_in_files)
+
+import os
+import subprocess
+import sys
+import threading
+import pytest
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STUB = '''/* Swc stub */
+ * Input Interfaces:
+ *   Std_ReturnType Rte_Read_Speed(uint16 *data)
+ * << Start of documentation area >>
+ *   Std_ReturnType Rte_Write_Torque(sint16 data)
+#include "Rte_Swc.h"
+/* DECLARATIONS */
+
+FUNC(void, Swc_10ms_CODE) Run_Swc_10ms(void)
+{
+    /* FUNCTIONS */
+
+}
+'''
+
+
+@pytest.fixture
+def database(tmp_path):
+    with Database(str(tmp_path / 'test.db')) as database:
+        database.execute('CREATE TABLE runs (name TEXT, value INTEGER)')
+        yield database
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    # The module name is taken from the file name
+    monkeypatch.chdir(tmp_path)
+    with open('Swc_10ms.c', 'w') as fp:
+        fp.write(STUB)
+    return 'Swc_10ms.c'
+
+
+def read_lines(filename):
+    with open(filename, 'r') as fp:
+        return fp.read().splitlines()
+
+
+def test_transaction_commits_the_block(database):
+    with database.transaction():
+        database.execute('INSERT INTO runs VALUES (?, ?)', ('a', 1))
+        with database.transaction():
+            database.execute('INSERT INTO runs VALUES (?, ?)', ('b', 2))
+
+    assert database.count('runs') == 2
+
+
+def test_transaction_rolls_back_the_outer_block(database):
+    with pytest.raises(RuntimeError):
+        with database.transaction():
+            database.execute('INSERT INTO runs VALUES (?, ?)', ('a', 1))
+            with database.transaction():
+                database.execute('INSERT INTO runs VALUES (?, ?)', ('b', 2))
+            raise RuntimeError
+
+    assert database.count('runs') == 0
+    assert database.depth == 0
+
+
+def test_execute_many_and_select(database):
+    assert database.execute_many('INSERT INTO runs VALUES (?, ?)', (('run', value) for value in range(25))) == 25
+
+    assert list(database.select('SELECT value FROM runs WHERE value >= ?', (20,), fetch_rows=2)) == [
+        (20,), (21,), (22,), (23,), (24,)]
+    assert database.select_one('SELECT MAX(value) FROM runs') == (24,)
+    assert database.count('runs', 'value < ?', (10,)) == 10
+
+
+def test_get_database_reuses_one_connection_per_thread(tmp_path):
+    db_file = str(tmp_path / 'test.db')
+    other = []
+
+    def use_database():
+        other.append(get_database(db_file))
+        other[0].close()
+
+    try:
+        database = get_database(db_file)
+        assert get_database(os.path.join(str(tmp_path), '.', 'test.db')) is database
+
+        thread = threading.Thread(target=use_database)
+        thread.start()
+        thread.join()
+        assert other[0] is not database
+    finally:
+        close_databases()
+
+    assert get_database(db_file) is not database
+    close_databases()
+
+
+def test_close_databases_leaves_the_connections_of_other_threads(tmp_path):
+    db_file = str(tmp_path / 'test.db')
+    opened = threading.Event()
+    closing = threading.Event()
+    other = []
+
+    def use_database():
+        other.append(get_database(db_file))
+        opened.set()
+        closing.wait()
+        # The connection is still open
+        other.append(other[0].select_one('SELECT 1'))
+        close_databases()
+
+    thread = threading.Thread(target=use_database)
+    thread.start()
+    try:
+        opened.wait()
+        database = get_database(db_file)
+        close_databases()
+        assert get_database(db_file) is not database
+        close_databases()
+    finally:
+        closing.set()
+        thread.join()
+
+    assert other[1] == (1,)
+
+
+def test_databases_are_closed_at_exit(tmp_path):
+    db_file = str(tmp_path / 'test.db')
+    script = ('from common_util import get_database\n'
+              'get_database({!r}).execute("CREATE TABLE runs (value INTEGER)")\n'
+              'raise KeyboardInterrupt\n').format(db_file)
+
+    process = subprocess.run([sys.executable, '-c', script], cwd=ROOT_FOLDER)
+
+    assert process.returncode != 0
+    assert os.path.exists(db_file)
+    assert not os.path.exists(db_file + '-wal') and not os.path.exists(db_file + '-shm')
+
+
+def test_inject_declarations(stub):
+    result, cycle_updates = inject_lines_of_code('declarations', stub, ['uint8 StubVersion_Main;', 'uint16 Speed;'],
+                                                 '/* DECLARATIONS */', 1, '')
+
+    assert result
+    assert cycle_updates == [('10', 'Swc_10ms')]
+    lines = read_lines(stub)
+    assert lines[6:10] == ['/* DECLARATIONS */', 'uint8 StubVersion_Main;', 'uint16 Speed;', '']
+    assert len(lines) == len(STUB.splitlines()) + 2
+
+
+def test_inject_functions_comments_the_unlisted_rte_apis(stub):
+    result, cycle_updates = inject_lines_of_code('functions', stub, ['Rte_Read_Speed(&Speed);',
+                                                                     'Rte_Write_Torque(Torque);'],
+                                                 '/* FUNCTIONS */', 1, '    ')
+
+    assert result
+    assert read_lines(stub)[10:14] == ['    /* FUNCTIONS */', '    Rte_Read_Speed(&Speed);',
+                                       '    // Rte_Write_Torque(Torque);', '']
+
+
+@pytest.mark.parametrize('string, skip_count', [('/* DECLARATIONS */', 2), ('/* MISSING */', 1)])
+def test_inject_leaves_the_stub_unchanged_on_failure(stub, string, skip_count):
+    assert inject_lines_of_code('declarations', stub, ['uint8 Speed;'], string, skip_count, '') == (False, [])
+    assert read_lines(stub) == STUB.splitlines()
+
+
+def test_find_section_header_agrees_with_inject(stub):
+    # 1-based line number of the section header, -1 if the insertion point is not empty
+    assert find_section_header(stub, '/* DECLARATIONS */', 1) == 7
+    assert find_section_header(stub, '/* DECLARATIONS */', 2) == -1
+
+
+def test_insert_lines_of_code_in_files_stores_the_timings(stub):
+    with Database('interface.db') as database:
+        database.execute('CREATE TABLE internal_signals (module TEXT, cycle_ms TEXT)')
+        database.execute("INSERT INTO internal_signals VALUES ('Swc_10ms', NULL)")
+    try:
+        assert insert_lines_of_code_in_files([('declarations', stub, ['uint8 Speed;'], '/* DECLARATIONS */', 1, ''),
+                                              ('declarations', stub, [], '/* MISSING */', 1, '')],
+                                             processes=1) == [True, False]
+        assert get_database('interface.db').select_one('SELECT cycle_ms FROM internal_signals') == ('10',)
+    finally:
+        close_databases()
@@ -0,0 +1,82 @@
+from dbc_util import find_dbc_files, load_dbc_file, load_messages, parse_dbc_file
+
+import dbc_util
+import os
+import pytest
+
+DBC = '''VERSION ""
+
+BU_: EYE TESTER
+
+BO_ 256 MSG_100: 8 EYE
+ SG_ Speed : 7|16@0+ (0.01,0) [0|655.35] "km/h" TESTER
+
+BO_ 512 MSG_200: 8 EYE
+ SG_ Counter : 0|4@1+ (1,0) [0|15] "" TESTER
+
+BO_ 768 MSG_300: 8 TESTER
+ SG_ Request : 0|8@1+ (1,0) [0|0] "" EYE
+
+BO_ 1024 MSG_400: 8 EYE
+ SG_ Event : 0|8@1+ (1,0) [0|0] "" TESTER
+
+BA_ "GenMsgCycleTime" BO_ 256 10;
+BA_ "GenMsgCycleTime" BO_ 512 100;
+BA_ "GenMsgCycleTime" BO_ 768 20;
+BA_ "GenMsgCycleTime" BO_ 1024 0;
+'''
+
+
+@pytest.fixture
+def dbc_file(tmp_path):
+    path = tmp_path / 'CAN1_Body_GC7.dbc'
+    path.write_text(DBC)
+    return str(path)
+
+
+SPEED = ('Speed', 7, 16, False, False, 0.01, 0.0, 0.0, 655.35)
+COUNTER = ('Counter', 0, 4, True, False, 1.0, 0.0, 0.0, 15.0)
+
+
+def test_parse_dbc_file(dbc_file):
+    # Only the cyclic messages sent by EYE, with their signals
+    assert parse_dbc_file(dbc_file) == {256: (10, [SPEED]), 512: (100, [COUNTER])}
+
+
+def test_parse_cache(dbc_file, tmp_path, monkeypatch):
+    cache_folder = str(tmp_path / 'cache')
+    assert load_dbc_file(dbc_file, cache_folder) == {256: (10, [SPEED]), 512: (100, [COUNTER])}
+
+    def parse_again(dbc_file):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(dbc_util, 'parse_dbc_file', parse_again)
+    assert load_dbc_file(dbc_file, cache_folder) == {256: (10, [SPEED]), 512: (100, [COUNTER])}
+    # Same content, other modification time: the content hash still matches
+    os.utime(dbc_file, (0, 0))
+    assert load_dbc_file(dbc_file, cache_folder) == {256: (10, [SPEED]), 512: (100, [COUNTER])}
+
+    monkeypatch.undo()
+    with open(dbc_file, 'a') as fp:
+        fp.write('BA_ "GenMsgCycleTime" BO_ 512 50;\n')
+    assert load_dbc_file(dbc_file, cache_folder) == {256: (10, [SPEED]), 512: (50, [COUNTER])}
+
+
+def test_load_messages(dbc_file):
+    messages = load_messages([(2, dbc_file)], cache_folder=None)
+
+    assert sorted(messages) == [(2, 256), (2, 512)]
+    assert messages[(2, 512)] == {'can_ch': 2, 'can_id': 512, 'cycle_ms': 100, 'signals': [COUNTER]}
+
+
+
+def test_find_dbc_files_in_upper_case_name_order(tmp_path):
+    (tmp_path / 'GC7').mkdir()
+    (tmp_path / 'HR3').mkdir()
+    for name in ['GC7/can2_Chassis_GC7.dbc', 'GC7/CAN1_Body_GC7.dbc', 'GC7/CAN1_Body_GC7.txt', 'GC7/CAN3_Body_GC7.dbc',
+                 'HR3/CAN1_Body_HR3.dbc']:
+        (tmp_path / name).write_text(DBC)
+
+    assert find_dbc_files(str(tmp_path), 'GC7', ['Body', 'Chassis', 'Body']) == [
+        (1, os.path.join(str(tmp_path / 'GC7'), 'CAN1_Body_GC7.dbc')),
+        (2, os.path.join(str(tmp_path / 'GC7'), 'can2_Chassis_GC7.dbc')),
+        (3, os.path.join(str(tmp_path / 'GC7'), 'CAN3_Body_GC7.dbc'))]
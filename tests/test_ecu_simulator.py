@@ -0,0 +1,51 @@
+from common_util import close_databases
+from ecu_simulator import EcuSimulator, main
+from synthetic_util import write_dbc_tree, write_map_file
+from time import sleep
+
+import PostFlashPreTestCheck
+import csv
+import pytest
+
+
+@pytest.fixture
+def target_files(tmp_path, monkeypatch):
+    """ DBC tree and map of four messages with short cycle times, so the capture ends as soon as they are judged """
+    monkeypatch.chdir(tmp_path)
+    messages = [{'can_ch': can_ch, 'can_id': 0x100 + can_ch, 'cycle_ms': cycle_ms, 'signals': [('Signal', 0, 8)]}
+                for can_ch, cycle_ms in [(1, 10), (2, 20), (3, 10), (4, 20)]]
+    write_dbc_tree('DBC', 'GC7', messages)
+    write_map_file('Build/application.map', 100)
+    return messages
+
+
+def test_target_check_against_the_simulator(target_files, capsys):
+    try:
+        main(['GC7', '-j', '0.1', '-v', '3', '1', '-o', 'csv'])
+    finally:
+        close_databases()
+
+    output = capsys.readouterr().out
+    assert 'Stub version (Main): 3' in output
+    assert 'Stub version (Sub):  1' in output
+    with open('SVS350_GC7_CANTx_Checklist_GC7.csv', newline='') as fp:
+        rows = list(csv.DictReader(fp))
+    assert sorted(row['CAN ID'] for row in rows) == ['101', '102', '103', '104']
+    assert [row['Timing'] for row in rows] == ['Passed'] * 4
+
+
+def test_capture_ends_with_its_window(target_files, monkeypatch):
+    monkeypatch.setattr(PostFlashPreTestCheck, 'CAPTURE_TIME_S', 0.3)
+    pretest_check = PostFlashPreTestCheck.PostFlashPreTestCheck('GC7', 'Build/', 'DBC/', bustype='virtual')
+    pretest_check.create_message_list()
+
+    with EcuSimulator(pretest_check.messages.definitions):
+        pretest_check.start_capture([1])
+        listener = pretest_check.captures[1][2][0]
+        # finish_capture held up past the window, e.g. by the XCP stage
+        sleep(0.6)
+        frames = sum(listener.counts.values())
+        sleep(0.2)
+        assert sum(listener.counts.values()) == frames
+        assert pretest_check.finish_capture() == {1: 0}
+    assert 0 < frames < 0.6 / 0.01
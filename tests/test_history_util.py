@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+from common_util import close_databases
+from history_util import RunHistory
+from message_util import RECEIVED, UNCHECKED, MessageTable
+
+import numpy as np
+import pytest
+
+
+def checked_messages(mean_ms):
+    """ a table of three 10 ms messages, the last one not checked """
+    messages = MessageTable(OrderedDict(((1, can_id), {'can_ch': 1, 'can_id': can_id, 'cycle_ms': 10})
+                                        for can_id in (0x100, 0x200, 0x300)))
+    messages.results['mean_ms'] = mean_ms
+    messages.results['frames'] = 500
+    messages.results['status'] = [RECEIVED, RECEIVED, UNCHECKED]
+    return messages
+
+
+@pytest.fixture
+def history(tmp_path):
+    yield RunHistory(str(tmp_path / 'run_history.db'))
+    close_databases()
+
+
+def test_find_regressions(history):
+    base_run = history.add_run('GC7', 'target', checked_messages([10.0, 10.0, 10.0]), {'StubVersion_Main': 1})
+    run_id = history.add_run('GC7', 'target', checked_messages([10.4, 12.0, 50.0]), map_hash='abc')
+
+    # Only the checked messages are stored
+    assert history.database.count('message_stats', 'run_id = ?', (run_id,)) == 2
+    regressions = history.find_regressions(base_run, run_id, 5)
+    assert [row[:4] for row in regressions] == [(1, 0x200, 10.0, 12.0)]
+    assert regressions[0][4] == pytest.approx(20.0)
+    assert [row[1] for row in history.find_regressions(base_run, run_id, 1)] == [0x200, 0x100]
+    assert history.find_regressions(base_run, run_id, 5, 'frames') == []
+    with pytest.raises(ValueError):
+        history.find_regressions(base_run, run_id, 5, 'run_id')
+
+
+def test_runs_and_message_history(history):
+    base_run = history.add_run('GC7', 'target', checked_messages([10.0, np.nan, 10.0]), {'StubVersion_Main': 1,
+                                                                                        'StubVersion_Sub': 2})
+    history.add_run('GC8', 'log.asc', checked_messages([10.0, 10.0, 10.0]))
+    run_id = history.add_run('GC7', 'target', checked_messages([11.0, 10.0, 10.0]))
+
+    assert history.get_latest_run('GC7') == run_id
+    assert history.get_latest_run('GC9') is None
+    assert [row[0] for row in history.get_runs('GC7')] == [run_id, base_run]
+    assert history.get_runs('GC7', limit=1)[0][2:5] == ('target', None, None)
+    assert [row[0] for row in history.get_message_history(1, 0x200, 'GC7')] == [run_id, base_run]
+    # NaN is stored as NULL
+    assert [row[5] for row in history.get_message_history(1, 0x200, 'GC7')] == [10.0, None]
+    assert history.find_regressions(base_run, run_id, 5) == [(1, 0x100, 10.0, 11.0, pytest.approx(10.0))]
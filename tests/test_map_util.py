@@ -0,0 +1,93 @@
+from map_util import MapIndex, parse_map_file
+
+import map_util
+import pytest
+
+MAP = '''TASKING linker map
+
+* Sections
+| Chip        | Group | Section        | Size (MAU) | Space addr | Chip addr  | Alignment  |
+| mpe:pflash0 |       | .text.main     | 0x00000100 | 0x80000000 | 0x00000000 | 0x00000002 |
+| mpe:pflash0 |       | .text.stub     | 0x00000080 | 0x80000100 | 0x00000100 | 0x00000002 |
+| mpe:pflash0 |       | .text.empty    | 0x00000000 | 0x80000180 | 0x00000180 | 0x00000002 |
+| mpe:pflash1 |       | .rodata.tables | 0x00000040 | 0x80200000 | 0x00200000 | 0x00000002 |
+| mpe:dspr0   |       | .bss.state     | 0x00000100 | 0x70000000 | 0x00000000 | 0x00000004 |
+
+* Symbols (sorted on name)
+| Name             | Space addr | Chip addr  |
+| Counter          | 0x70000010 | 0x00000010 |
+| StubVersion_Main | 0x70000020 | 0x00000020 |
+| StubVersion_Sub  | 0x70000021 | 0x00000021 |
+| main             | 0x80000000 | 0x00000000 |
+| main             | 0x80000040 | 0x00000040 |
+
+* Symbols (sorted on address)
+| Name             | Space addr | Chip addr  |
+| Counter          | 0x70000010 | 0x00000010 |
+| Shadowed         | 0x70000018 | 0x00000018 |
+'''
+
+
+@pytest.fixture
+def map_file(tmp_path):
+    path = tmp_path / 'application.map'
+    path.write_text(MAP)
+    return str(path)
+
+
+def test_parse_map_file_keeps_the_first_definition(map_file):
+    symbols, sections = parse_map_file(map_file)
+
+    assert symbols == {'Counter': 0x70000010, 'StubVersion_Main': 0x70000020, 'StubVersion_Sub': 0x70000021,
+                       'main': 0x80000000}
+    # Empty sections are left out
+    assert sections == [('mpe:pflash0', '.text.main', 0x80000000, 0x100),
+                        ('mpe:pflash0', '.text.stub', 0x80000100, 0x80),
+                        ('mpe:pflash1', '.rodata.tables', 0x80200000, 0x40),
+                        ('mpe:dspr0', '.bss.state', 0x70000000, 0x100)]
+
+
+def test_empty_map_file(tmp_path):
+    map_file = tmp_path / 'application.map'
+    map_file.write_text('')
+
+    assert parse_map_file(str(map_file)) == ({}, [])
+    assert MapIndex(str(map_file), cache_folder=None).lookup(['StubVersion_Main']) == {}
+
+
+def test_lookup(map_file):
+    index = MapIndex(map_file, cache_folder=None)
+
+    assert len(index) == 4
+    assert index.lookup(['StubVersion_Main', 'StubVersion_Sub', 'Missing']) == {'StubVersion_Main': 0x70000020,
+                                                                                'StubVersion_Sub': 0x70000021}
+
+
+def test_find_symbol(map_file):
+    index = MapIndex(map_file, cache_folder=None)
+
+    assert index.find_symbol(0x70000020) == ('StubVersion_Main', 0)
+    assert index.find_symbol(0x7000001F) == ('Counter', 0x0F)
+    assert index.find_symbol(0x80001000) == ('main', 0x1000)
+    assert index.find_symbol(0x7000000F) is None
+
+
+def test_get_section_ranges(map_file):
+    index = MapIndex(map_file, cache_folder=None)
+
+    assert index.get_section_ranges() == [(0x80000000, 0x180), (0x80200000, 0x40)]
+    assert index.get_section_ranges('mpe:dspr') == [(0x70000000, 0x100)]
+
+
+def test_index_cache(map_file, tmp_path, monkeypatch):
+    cache_folder = str(tmp_path / 'cache')
+    cached = MapIndex(map_file, cache_folder)
+
+    def parse_again(map_file):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(map_util, 'parse_map_file', parse_again)
+    index = MapIndex(map_file, cache_folder)
+
+    assert index.symbols == cached.symbols
+    assert index.sections == cached.sections
+    assert index.map_hash is not None
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+
+from message_util import MessageTable
+
+import numpy as np
+
+
+def message_table():
+    return MessageTable(OrderedDict(((can_ch, can_id), {'can_ch': can_ch, 'can_id': can_id, 'cycle_ms': cycle_ms})
+                                    for can_ch, can_id, cycle_ms in [(1, 0x100, 10), (2, 0x200, 100),
+                                                                     (1, 0x300, 1000)]))
+
+
+def channel_results(mean_ms, count, judged, passed):
+    """ results of CycleStatistics.get_results, over all rows """
+    return {'mean_ms': np.array(mean_ms), 'min_ms': np.array(mean_ms), 'max_ms': np.array(mean_ms),
+            'std_ms': np.zeros(len(mean_ms)), 'jitter_ms': np.zeros(len(mean_ms)), 'count': np.array(count),
+            'missed': np.zeros(len(mean_ms), dtype=np.int64), 'bursts': np.zeros(len(mean_ms), dtype=np.int64),
+            'judged': np.array(judged), 'passed': np.array(passed)}
+
+
+def test_channel_rows():
+    messages = message_table()
+
+    assert messages.get_channels() == [1, 2]
+    assert messages.get_channel_rows(1).tolist() == [0, 2]
+    assert messages.cycle_ms.tolist() == [10, 100, 1000]
+
+
+def test_report_columns_of_the_checked_rows():
+    messages = message_table()
+    rows = messages.get_channel_rows(1)
+    messages.set_results(rows, channel_results([10.2, 100.0, 1000.0], [500, 50, 4], [True, True, False],
+                                               [True, True, False]))
+
+    columns = messages.get_columns(95)
+
+    assert columns['CAN ID'].tolist() == ['100', '300']
+    assert columns['Frames'].tolist() == [500, 4]
+    assert columns['Average Cycle (ms)'][0] == 10.2
+    # Not judged: the statistics are left out
+    assert np.isnan(columns['Average Cycle (ms)'][1])
+    assert columns['Status'].tolist() == ['Received', 'Received']
+    assert columns['Timing'].tolist() == ['Passed', 'N/A']
+    assert 'P95 Jitter (ms)' in columns
+
+
+def test_messages_not_received():
+    messages = message_table()
+    messages.set_results(np.arange(3), channel_results([np.nan] * 3, [0, 0, 0], [False] * 3, [False] * 3))
+
+    columns = messages.get_columns(95)
+
+    assert columns['Status'].tolist() == ['Not Received'] * 3
+    assert columns['Timing'].tolist() == ['N/A'] * 3
+
+
+def test_report_statistics_are_rounded():
+    messages = message_table()
+    messages.set_results(np.arange(3), channel_results([10.00049, 99.99951, 1000.0], [500, 50, 5], [True] * 3,
+                                                       [True] * 3))
+
+    columns = messages.get_columns(95)
+
+    assert columns['Average Cycle (ms)'].tolist() == [10.0, 100.0, 1000.0]
+    # The check results keep the full precision
+    assert messages.results['mean_ms'][0] == 10.00049
@@ -0,0 +1,116 @@
+from monitor_util import AlertLog, RingBufferMonitor, RECOVERY_GAPS
+from message_util import MESSAGE_DTYPE
+
+import can
+import json
+import monitor_util
+import numpy as np
+import pytest
+
+# The timestamps of the interface count from its own start, not from the epoch
+LOCAL_OFFSET_S = 1000.0
+
+
+class Alerts(list):
+    """ alert callable recording (alert, CAN ID, timestamp, details) """
+
+    def __call__(self, alert, can_ch, can_id, timestamp, **details):
+        self.append((alert, can_id, timestamp, details))
+
+
+class Clock(object):
+    """ stand-in for time(), the frames are received LOCAL_OFFSET_S after their timestamp """
+
+    def __init__(self):
+        self.now_s = LOCAL_OFFSET_S
+
+    def __call__(self):
+        return self.now_s
+
+
+def frame(can_id, timestamp):
+    return can.Message(arbitration_id=can_id, timestamp=timestamp, is_extended_id=False, data=bytearray(8))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(monitor_util, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def monitor(clock):
+    messages = np.array([(1, 0x100, 10), (1, 0x200, 100)], dtype=MESSAGE_DTYPE)
+    monitor = RingBufferMonitor(1, messages, Alerts(), ring_size=5)
+
+    def receive(can_id, timestamp):
+        clock.now_s = LOCAL_OFFSET_S + timestamp
+        monitor.on_message_received(frame(can_id, timestamp))
+
+    monitor.receive = receive
+    return monitor
+
+
+def test_rolling_statistics_of_the_last_gaps(monitor):
+    # 0x100: a 30 ms gap (2 missed frames), then 9 gaps of 10 ms, of which the last 5 are kept
+    for timestamp in [0.0, 0.03] + [0.03 + 0.01 * frame_number for frame_number in range(1, 10)]:
+        monitor.on_message_received(frame(0x100, timestamp))
+    # Unexpected IDs and error frames are ignored
+    monitor.on_message_received(frame(0x300, 0.5))
+    monitor.on_message_received(can.Message(arbitration_id=0x100, timestamp=0.5, is_error_frame=True))
+
+    results = monitor.get_results()
+
+    assert results['count'].tolist() == [11, 0]
+    assert results['missed'].tolist() == [2, 0]
+    assert results['judged'].tolist() == [True, False]
+    assert results['mean_ms'][0] == pytest.approx(10.0)
+    assert results['passed'][0]
+    assert np.isnan(results['mean_ms'][1])
+
+
+def test_out_of_tolerance_and_recovery_alerts(monitor):
+    timestamps = [0.0, 0.01, 0.03] + [0.03 + 0.01 * frame_number for frame_number in range(1, RECOVERY_GAPS + 1)]
+    for timestamp in timestamps:
+        monitor.receive(0x100, timestamp)
+
+    # The alerts are raised at the local time of the frames
+    assert [alert[:3] for alert in monitor.alert] == [('out of tolerance', 0x100, LOCAL_OFFSET_S + 0.03),
+                                                      ('in tolerance', 0x100, LOCAL_OFFSET_S + timestamps[-1])]
+    assert monitor.alert[0][3]['gap_ms'] == pytest.approx(20.0)
+
+
+def test_stopped_and_resumed_alerts(monitor):
+    monitor.receive(0x100, 0.0)
+    monitor.receive(0x200, 0.0)
+
+    # Checked against the local time, not the timestamps of the interface
+    monitor.check_stopped(LOCAL_OFFSET_S + 0.02)
+    assert monitor.alert == []
+    monitor.check_stopped(LOCAL_OFFSET_S + 0.05)
+    monitor.check_stopped(LOCAL_OFFSET_S + 0.06)
+    assert [alert[:3] for alert in monitor.alert] == [('stopped', 0x100, LOCAL_OFFSET_S + 0.05)]
+    assert monitor.get_snapshot()['stopped'] == ['100']
+
+    monitor.receive(0x100, 0.07)
+    assert [alert[:2] for alert in monitor.alert[1:]] == [('resumed', 0x100), ('out of tolerance', 0x100)]
+    assert monitor.get_snapshot()['stopped'] == []
+
+
+def test_alert_log_appends_json_lines(tmp_path):
+    alerts_file = tmp_path / 'soak_alerts.jsonl'
+    alert_log = AlertLog(str(alerts_file))
+    alert_log('stopped', 1, 0x100, 0.0, silent_ms=30.0)
+    alert_log('resumed', 1, 0x80000200, 0.0, gap_ms=None)
+    # Alerts are queued by the notifier threads and written by the main loop
+    assert alerts_file.read_text() == ''
+    assert alert_log.write_pending() == 2
+    alert_log('in tolerance', 1, 0x100, 0.0)
+    alert_log.close()
+
+    records = [json.loads(line) for line in alerts_file.read_text().splitlines()]
+    assert [(record['alert'], record['can_id']) for record in records] == [('stopped', '100'), ('resumed', '200'),
+                                                                           ('in tolerance', '100')]
+    assert records[0]['silent_ms'] == 30.0
+    assert alert_log.count == 3
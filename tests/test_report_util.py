@@ -0,0 +1,75 @@
+from collections import OrderedDict
+
+import report_util
+from report_util import CsvReportWriter, ExcelReportWriter, JsonLinesReportWriter, ParquetReportWriter
+
+import json
+import numpy as np
+import pytest
+
+COLUMNS = OrderedDict([('ID', np.array([0x100, 0x200])), ('Cycle', np.array([10.0, np.nan])),
+                       ('Status', ['Passed', None])])
+
+
+def test_excel_sheets_are_split_at_the_row_limit(tmp_path, monkeypatch):
+    from openpyxl import load_workbook
+
+    monkeypatch.setattr(report_util, 'MAX_EXCEL_ROWS', 2)
+    report_name = str(tmp_path / 'report')
+    with ExcelReportWriter(report_name) as writer:
+        writer.write_rows('Messages', ['ID', 'Cycle'], ((can_id, can_id * 0.5) for can_id in range(5)))
+        writer.write_columns('Results', COLUMNS)
+
+    workbook = load_workbook(report_name + '.xlsx')
+    assert workbook.sheetnames == ['Messages', 'Messages 2', 'Messages 3', 'Results']
+    assert [[cell.value for cell in row] for row in workbook['Messages 3'].rows] == [['ID', 'Cycle'], [4, 2]]
+    assert [[cell.value for cell in row] for row in workbook['Results'].rows] == [
+        ['ID', 'Cycle', 'Status'], [0x100, 10, 'Passed'], [0x200, 'N/A', 'N/A']]
+
+
+def test_csv_writes_the_missing_values_as_empty_cells(tmp_path):
+    writer = CsvReportWriter(str(tmp_path / 'report'))
+    writer.write_columns('Results', COLUMNS)
+
+    assert writer.close() == [str(tmp_path / 'report_Results.csv')]
+    assert (tmp_path / 'report_Results.csv').read_text().splitlines() == ['ID,Cycle,Status', '256,10.0,Passed',
+                                                                         '512,,']
+
+
+def test_json_lines_writes_the_missing_values_as_null(tmp_path):
+    writer = JsonLinesReportWriter(str(tmp_path / 'report'))
+    writer.write_columns('Signal Results', COLUMNS)
+
+    lines = (tmp_path / 'report_Signal_Results.jsonl').read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [{'ID': 256, 'Cycle': 10.0, 'Status': 'Passed'},
+                                                    {'ID': 512, 'Cycle': None, 'Status': None}]
+
+
+def test_parquet_is_written_in_row_groups(tmp_path, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    monkeypatch.setattr(report_util, 'PARQUET_BATCH_ROWS', 2)
+    writer = ParquetReportWriter(str(tmp_path / 'report'))
+    writer.write_rows('Messages', ['ID', 'Cycle'], [(1, 1.5), (2, 2.5), (3, None)])
+
+    parquet_file = pq.ParquetFile(str(tmp_path / 'report_Messages.parquet'))
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.read().to_pydict() == {'ID': [1, 2, 3], 'Cycle': [1.5, 2.5, None]}
+
+
+def test_parquet_schema_does_not_depend_on_the_first_row_group(tmp_path, monkeypatch):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    monkeypatch.setattr(report_util, 'PARQUET_BATCH_ROWS', 2)
+    writer = ParquetReportWriter(str(tmp_path / 'report'))
+    # The first gap of each message is missing, the whole first row group has no gap or status
+    writer.write_rows('Frames', ['ID', 'Gap', 'Status'], [(1, np.nan, None), (2, None, None), (3, 10.0, 'Passed')],
+                      [int, float, None])
+    # No message received: all the statistics are NaN
+    writer.write_columns('Results', OrderedDict([('ID', np.array([0x100])), ('Cycle', np.array([np.nan]))]))
+
+    frames = pq.read_table(str(tmp_path / 'report_Frames.parquet'))
+    assert frames.schema.types == [pa.int64(), pa.float64(), pa.string()]
+    assert frames.to_pydict() == {'ID': [1, 2, 3], 'Gap': [None, None, 10.0], 'Status': [None, None, 'Passed']}
+    assert pq.read_table(str(tmp_path / 'report_Results.parquet')).schema.types == [pa.int64(), pa.float64()]
@@ -0,0 +1,70 @@
+from signal_util import SignalLayout, parse_signal_line
+
+import numpy as np
+import pytest
+
+
+def payload(*data):
+    """ the payload as decode takes it: the 8 data bytes read as a little-endian integer """
+    return int.from_bytes(bytes(data).ljust(8, b'\x00'), 'little')
+
+
+def test_parse_signal_line():
+    signal = parse_signal_line(' SG_ VehSpeed : 7|16@0+ (0.01,0) [0|655.35] "km/h"  TESTER')
+
+    assert signal == ('VehSpeed', 7, 16, False, False, 0.01, 0.0, 0.0, 655.35)
+    assert parse_signal_line('BO_ 256 MSG_100: 8 EYE') is None
+
+
+def test_decode_motorola():
+    layout = SignalLayout([
+        # MSB at bit 7 of byte 0, the whole of bytes 0 and 1
+        ('Speed', 7, 16, False, False, 0.01, 0.0, 0.0, 655.35),
+        # MSB at bit 3 of byte 2, bits 3..0 of byte 2 and byte 3
+        ('Torque', 19, 12, False, False, 0.5, -10.0, 0.0, 0.0),
+        # Signed, bits 7..4 of byte 4
+        ('Mode', 39, 4, False, True, 1.0, 0.0, -8.0, 7.0),
+    ])
+
+    values = layout.decode(np.array([payload(0x12, 0x34, 0xAB, 0xCD, 0xE0)], dtype=np.uint64))
+
+    np.testing.assert_allclose(values, [[0x1234 * 0.01, 0xBCD * 0.5 - 10, -2]])
+
+
+def test_decode_intel():
+    layout = SignalLayout([
+        # LSB at bit 0 of byte 0, bytes 0 and 1
+        ('Counter', 0, 16, True, False, 1.0, 0.0, 0.0, 0.0),
+        # Signed byte 2
+        ('Offset', 16, 8, True, True, 0.1, 0.0, 0.0, 0.0),
+        # Bits 4..5 of byte 3
+        ('State', 28, 2, True, False, 1.0, 0.0, 0.0, 0.0),
+    ])
+
+    values = layout.decode(np.array([payload(0x34, 0x12, 0xFE, 0x20)], dtype=np.uint64))
+
+    np.testing.assert_allclose(values, [[0x1234, -0.2, 2]])
+
+
+def test_check_ranges_and_constant_signals():
+    layout = SignalLayout([
+        ('Level', 0, 8, True, False, 1.0, 0.0, 0.0, 100.0),
+        ('Constant', 8, 8, True, False, 1.0, 0.0, 0.0, 0.0),
+    ])
+
+    results = layout.check(np.array([payload(50, 3), payload(150, 3), payload(20, 3)], dtype=np.uint64))
+
+    assert results['min'].tolist() == [20, 3]
+    assert results['max'].tolist() == [150, 3]
+    assert results['last'].tolist() == [20, 3]
+    assert results['out_of_range'].tolist() == [1, 0]
+    assert results['constant'].tolist() == [False, True]
+
+
+@pytest.mark.parametrize('start, length, value', [(7, 8, 0xA5), (15, 8, 0x5A), (7, 64, 0xA55A000000000000)])
+def test_decode_motorola_whole_bytes(start, length, value):
+    layout = SignalLayout([('Value', start, length, False, False, 1.0, 0.0, 0.0, 0.0)])
+
+    values = layout.decode(np.array([payload(0xA5, 0x5A)], dtype=np.uint64))
+
+    assert values[0, 0] == pytest.approx(float(value))
@@ -0,0 +1,78 @@
+from timing_util import SKIPPED_FRAMES, CycleStatistics
+
+import numpy as np
+import pytest
+
+CYCLE_MS = [10, 20, 0]
+
+
+def make_frames():
+    """ frames of three messages in time order, with jitter, one missed frame and one burst """
+    random = np.random.RandomState(1)
+    rows = []
+    timestamps = []
+    for row, cycle_ms in enumerate([10, 20, 15]):
+        row_timestamps = np.arange(60) * cycle_ms / 1000.0 + random.normal(0, 0.0002, 60)
+        if row == 0:
+            # One missed frame and one burst
+            row_timestamps = np.delete(row_timestamps, 30)
+            row_timestamps = np.insert(row_timestamps, 40, row_timestamps[39] + 0.002)
+        rows.append(np.full(len(row_timestamps), row))
+        timestamps.append(row_timestamps)
+    rows = np.concatenate(rows)
+    timestamps = np.concatenate(timestamps)
+    order = np.argsort(timestamps, kind='stable')
+
+    return rows[order], timestamps[order]
+
+
+def assert_same_results(expected, actual):
+    assert sorted(expected) == sorted(actual)
+    for column in expected:
+        np.testing.assert_allclose(actual[column], expected[column], rtol=1e-9, equal_nan=True, err_msg=column)
+
+
+@pytest.mark.parametrize('split', [2, SKIPPED_FRAMES + 1, 50, 120])
+def test_merged_chunks_equal_one_pass(split):
+    rows, timestamps = make_frames()
+    expected = CycleStatistics.from_frames(CYCLE_MS, rows, timestamps).get_results()
+
+    statistics = CycleStatistics.from_frames(CYCLE_MS, rows[:split], timestamps[:split])
+    statistics.merge(CycleStatistics.from_frames(CYCLE_MS, rows[split:], timestamps[split:]))
+
+    assert_same_results(expected, statistics.get_results())
+
+
+def test_merge_of_many_chunks():
+    rows, timestamps = make_frames()
+    expected = CycleStatistics.from_frames(CYCLE_MS, rows, timestamps).get_results()
+
+    statistics = CycleStatistics(CYCLE_MS)
+    for start in range(0, len(rows), 7):
+        statistics.merge(CycleStatistics.from_frames(CYCLE_MS, rows[start:start + 7], timestamps[start:start + 7]))
+
+    assert_same_results(expected, statistics.get_results())
+
+
+def test_known_statistics():
+    # Frames every 10 ms, the first SKIPPED_FRAMES gaps are not used
+    timestamps = np.arange(SKIPPED_FRAMES + 11) * 0.01
+    results = CycleStatistics.from_frames([10], np.zeros(len(timestamps), dtype=np.int64), timestamps).get_results()
+
+    assert results['count'][0] == SKIPPED_FRAMES + 11
+    assert results['mean_ms'][0] == pytest.approx(10)
+    assert results['std_ms'][0] == pytest.approx(0, abs=1e-6)
+    assert results['missed'][0] == 0
+    assert results['bursts'][0] == 0
+    assert results['passed'][0]
+
+
+def test_missed_and_burst_frames():
+    rows, timestamps = make_frames()
+    results = CycleStatistics.from_frames(CYCLE_MS, rows, timestamps).get_results()
+
+    assert results['missed'].tolist() == [1, 0, 0]
+    assert results['bursts'].tolist() == [1, 0, 0]
+    assert results['judged'].tolist() == [True, True, False]
+    assert not results['passed'][0]
+    assert results['passed'][1]
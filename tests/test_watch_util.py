@@ -0,0 +1,73 @@
+from watch_util import FileWatcher, ResultPublisher, get_file_states
+
+import json
+import os
+import socket
+
+
+def test_get_file_states_of_missing_files(tmp_path):
+    (tmp_path / 'a.dbc').write_text('BO_')
+
+    states = get_file_states([tmp_path / 'a.dbc', tmp_path / 'b.dbc'])
+
+    assert states[str(tmp_path / 'a.dbc')][0] == 3
+    assert states[str(tmp_path / 'b.dbc')] is None
+
+
+def test_file_watcher_reports_a_change_once_the_files_are_stable(tmp_path):
+    map_file = tmp_path / 'application.map'
+    map_file.write_text('')
+    watcher = FileWatcher({'map': lambda: [map_file], 'dbc': lambda: sorted(tmp_path.glob('*.dbc'))})
+
+    assert watcher.poll() == set()
+    map_file.write_text('being linked')
+    assert watcher.poll() == set()
+    map_file.write_text('being linked, complete')
+    assert watcher.poll() == set()
+    assert watcher.poll() == {'map'}
+    assert watcher.poll() == set()
+
+    # An added file changes the group
+    (tmp_path / 'can1.dbc').write_text('BO_')
+    assert watcher.poll() == set()
+    assert watcher.poll() == {'dbc'}
+
+
+def test_file_watcher_forgets_a_change_that_is_undone(tmp_path):
+    map_file = tmp_path / 'application.map'
+    map_file.write_text('linked')
+    os.utime(str(map_file), ns=(1000000000, 1000000000))
+    watcher = FileWatcher({'map': lambda: [map_file]})
+
+    map_file.write_text('linking')
+    assert watcher.poll() == set()
+    map_file.write_text('linked')
+    os.utime(str(map_file), ns=(1000000000, 1000000000))
+    assert watcher.poll() == set()
+    assert watcher.poll() == set()
+
+
+def test_result_publisher_replaces_the_file_and_serves_the_result(tmp_path):
+    results_file = tmp_path / 'watch_result.json'
+    publisher = ResultPublisher(str(results_file), port=0)
+    try:
+        publisher.publish({'passed': 10})
+        publisher.publish({'passed': 12})
+
+        assert json.loads(results_file.read_text())['passed'] == 12
+        assert not os.path.exists('{}.tmp'.format(results_file))
+        with socket.create_connection(publisher.server.server_address, timeout=5) as client:
+            data = b''
+            while not data.endswith(b'}\n'):
+                data += client.recv(4096)
+        assert json.loads(data.decode('utf-8')) == json.loads(results_file.read_text())
+    finally:
+        publisher.close()
+
+
+def test_result_publisher_without_a_port(tmp_path):
+    publisher = ResultPublisher(str(tmp_path / 'watch_result.json'))
+    publisher.publish({'passed': 1})
+    publisher.close()
+
+    assert 'published' in json.loads((tmp_path / 'watch_result.json').read_text())
@@ -0,0 +1,299 @@
+from checksum_util import CRC_16, compute_checksum
+from xcp_util import (ALLOC_DAQ, ALLOC_ODT, ALLOC_ODT_ENTRY, BUILD_CHECKSUM, CONNECT, DISCONNECT, FREE_DAQ, PID_ERR,
+                      PID_RES, SET_DAQ_LIST_MODE, SET_DAQ_PTR, SET_MTA, SHORT_UPLOAD, START_STOP_DAQ_LIST,
+                      START_STOP_SYNCH, UPLOAD, WRITE_DAQ, XCP_CMD_ID, XCP_RES_ID, DaqRecorder, XcpClient, XcpError,
+                      XcpTimeout, group_address_ranges, pack_odts, parse_variable)
+
+import can
+import queue
+import struct
+import pytest
+
+MEMORY_START = 0x1000
+MEMORY = bytes(range(256))
+FIRST_PID = 0x10
+
+
+class FakeXcpSlave(can.BusABC):
+    """ Bus answering the XCP commands like a slave, and recording the command packets """
+
+    def __init__(self, block_mode=False, big_endian=False, lost=None, error=None, max_checksum_block_size=None):
+        super(FakeXcpSlave, self).__init__(channel=None)
+        self.byte_order = '>' if big_endian else '<'
+        self.comm_mode = (0x40 if block_mode else 0x00) | (0x01 if big_endian else 0x00)
+        # Command code -> number of commands answered with no response
+        self.lost = dict(lost or {})
+        self.error = error
+        # Largest BUILD_CHECKSUM range, larger ranges are answered with XCP_ERR_OUT_OF_RANGE and this size, 0 for none
+        self.max_checksum_block_size = max_checksum_block_size
+        self.commands = []
+        self.responses = queue.Queue()
+        self.mta = None
+
+    def reply(self, data):
+        self.responses.put(can.Message(arbitration_id=XCP_RES_ID, data=bytearray(data), is_extended_id=False))
+
+    def read(self, address, size):
+        return list(MEMORY[address - MEMORY_START:address - MEMORY_START + size])
+
+    def send(self, msg, timeout=None):
+        assert msg.arbitration_id == XCP_CMD_ID and not msg.is_extended_id and len(msg.data) == 8
+        data = bytes(msg.data)
+        self.commands.append(data)
+        command = data[0]
+        responses = []
+        if command == self.error:
+            responses = [[PID_ERR, 0x22]]
+        elif command == CONNECT:
+            responses = [[PID_RES, 0x05, self.comm_mode, 8] + list(struct.pack(self.byte_order + 'H', 8)) + [1, 1]]
+        elif command == SET_MTA:
+            self.mta = struct.unpack(self.byte_order + 'I', data[4:8])[0]
+            responses = [[PID_RES]]
+        elif command == UPLOAD:
+            values = self.read(self.mta, data[1])
+            self.mta += data[1]
+            responses = [[PID_RES] + values[start:start + 7] for start in range(0, len(values), 7)]
+        elif command == BUILD_CHECKSUM:
+            size = struct.unpack(self.byte_order + 'I', data[4:8])[0]
+            if self.max_checksum_block_size is not None and size > self.max_checksum_block_size:
+                responses = [[PID_ERR, 0x22, 0, 0] + list(struct.pack(self.byte_order + 'I',
+                                                                      self.max_checksum_block_size))]
+            else:
+                checksum = compute_checksum(bytes(self.read(self.mta, size)), CRC_16)
+                responses = [[PID_RES, CRC_16, 0, 0] + list(struct.pack(self.byte_order + 'I', checksum))]
+        elif command == SHORT_UPLOAD:
+            responses = [[PID_RES] + self.read(struct.unpack(self.byte_order + 'I', data[4:8])[0], data[1])]
+        elif command == START_STOP_DAQ_LIST:
+            responses = [[PID_RES, FIRST_PID]]
+        else:
+            responses = [[PID_RES]]
+        if self.lost.get(command, 0) > 0:
+            self.lost[command] -= 1
+            return
+        for response in responses:
+            self.reply(response)
+
+    def _recv_internal(self, timeout):
+        try:
+            return self.responses.get(timeout=timeout), False
+        except queue.Empty:
+            return None, False
+
+
+@pytest.fixture
+def connect():
+    clients = []
+
+    def connect_client(retries=None, **slave_options):
+        bus = FakeXcpSlave(**slave_options)
+        client = XcpClient(bus, retries=retries)
+        clients.append(client)
+        client.connect()
+        bus.commands = []
+        return client, bus
+
+    yield connect_client
+    for client in clients:
+        client.close()
+        client.bus.shutdown()
+
+
+def test_connect_reads_the_communication_parameters(connect):
+    client, bus = connect(block_mode=True, big_endian=True)
+
+    assert client.byte_order == '>'
+    assert client.slave_block_mode
+    assert client.max_cto == 8
+    assert client.max_dto == 8
+
+
+def test_command_packets(connect):
+    client, bus = connect()
+
+    assert client.short_upload(0x1002, 3) == bytes([2, 3, 4])
+    client.disconnect()
+
+    assert bus.commands == [bytes([SHORT_UPLOAD, 3, 0x00, 0x00, 0x02, 0x10, 0x00, 0x00]),
+                            bytes([DISCONNECT, 0, 0, 0, 0, 0, 0, 0])]
+
+
+def test_command_packets_in_big_endian(connect):
+    client, bus = connect(big_endian=True)
+
+    client.short_upload(0x1002, 1, 0x01)
+
+    assert bus.commands == [bytes([SHORT_UPLOAD, 1, 0x00, 0x01, 0x00, 0x00, 0x10, 0x02])]
+
+
+def test_lost_response_is_retried(connect):
+    client, bus = connect(lost={SHORT_UPLOAD: 2})
+
+    assert client.short_upload(0x1002, 3) == bytes([2, 3, 4])
+    assert len(bus.commands) == 3
+
+
+def test_timeout_after_the_retries(connect):
+    client, bus = connect(lost={SHORT_UPLOAD: 100}, retries={SHORT_UPLOAD: 1})
+
+    with pytest.raises(XcpTimeout):
+        client.short_upload(0x1002, 3)
+    assert len(bus.commands) == 2
+
+
+def test_error_response(connect):
+    client, bus = connect(error=SHORT_UPLOAD)
+
+    with pytest.raises(XcpError) as error:
+        client.short_upload(0x1000, 1)
+    assert error.value.error_code == 0x22
+    assert len(bus.commands) == 1
+
+
+def test_set_mta_packet(connect):
+    client, bus = connect()
+
+    client.set_mta(0x12345678, 0x01)
+
+    assert bus.commands == [bytes([SET_MTA, 0x00, 0x00, 0x01, 0x78, 0x56, 0x34, 0x12])]
+
+
+@pytest.mark.parametrize('block_mode', [False, True])
+def test_read_memory_in_packets(connect, block_mode):
+    client, bus = connect(block_mode=block_mode)
+
+    assert client.read_memory(0x1010, 20) == MEMORY[0x10:0x24]
+    if block_mode:
+        assert [command[:2] for command in bus.commands] == [bytes([SET_MTA, 0]), bytes([UPLOAD, 20])]
+    else:
+        assert [command[:2] for command in bus.commands] == [bytes([SET_MTA, 0]), bytes([UPLOAD, 7]),
+                                                             bytes([UPLOAD, 7]), bytes([UPLOAD, 6])]
+
+
+@pytest.mark.parametrize('block_mode', [False, True])
+def test_lost_upload_restarts_from_the_start_address(connect, block_mode):
+    client, bus = connect(block_mode=block_mode, lost={UPLOAD: 1})
+
+    assert client.read_memory(0x1010, 20) == MEMORY[0x10:0x24]
+    set_mta = [command for command in bus.commands if command[0] == SET_MTA]
+    assert set_mta == [bytes([SET_MTA, 0x00, 0x00, 0x00, 0x10, 0x10, 0x00, 0x00])] * 2
+
+
+def test_read_memory_gives_up_after_the_restarts(connect):
+    client, bus = connect(lost={UPLOAD: 100})
+
+    with pytest.raises(XcpTimeout):
+        client.read_memory(0x1010, 20)
+
+
+def test_read_variables(connect):
+    client, bus = connect()
+
+    values = client.read_variables([('a', 0x1001, 'B'), ('b', 0x1004, 'H'), ('c', 0x1010, 'I'), ('d', 0x1080, 'H')])
+
+    assert values == {'a': 0x01, 'b': 0x0504, 'c': 0x13121110, 'd': 0x8180}
+    # a, b and c in one range read with an upload, d alone in a short upload
+    assert [command[0] for command in bus.commands] == [SET_MTA, UPLOAD, UPLOAD, UPLOAD, SHORT_UPLOAD]
+
+
+def test_group_address_ranges():
+    ranges = group_address_ranges([('c', 0x1008, 'I'), ('a', 0x1000, 'B'), ('b', 0x1001, 'H'), ('d', 0x1100, 'H')])
+
+    assert ranges == [(0x1000, 12, [('a', 0, 'B'), ('b', 1, 'H'), ('c', 8, 'I')]), (0x1100, 2, [('d', 0, 'H')])]
+
+
+def test_group_address_ranges_uses_standard_sizes():
+    ranges = group_address_ranges([('c', 0x1008, 'd'), ('a', 0x1000, 'B'), ('b', 0x1001, 'I'), ('d', 0x1100, 'H')],
+                                  '>')
+
+    assert ranges == [(0x1000, 16, [('a', 0, 'B'), ('b', 1, 'I'), ('c', 8, 'd')]),
+                      (0x1100, 2, [('d', 0, 'H')])]
+
+
+def test_pack_odts():
+    odts = pack_odts([('a', 0x10, 'I'), ('b', 0x20, 'H'), ('c', 0x30, 'H'), ('d', 0x40, 'B')], 7)
+
+    assert odts == [[('a', 0x10, 'I'), ('b', 0x20, 'H')], [('c', 0x30, 'H'), ('d', 0x40, 'B')]]
+    with pytest.raises(ValueError):
+        pack_odts([('e', 0x50, 'q')], 7)
+
+
+def test_start_daq_packets(connect):
+    client, bus = connect()
+
+    client.start_daq([('a', 0x1010, 'I'), ('b', 0x1020, 'H'), ('c', 0x1030, 'H')], event_channel=2)
+
+    assert bus.commands == [bytes([FREE_DAQ, 0, 0, 0, 0, 0, 0, 0]),
+                            bytes([ALLOC_DAQ, 0, 1, 0, 0, 0, 0, 0]),
+                            bytes([ALLOC_ODT, 0, 0, 0, 2, 0, 0, 0]),
+                            bytes([ALLOC_ODT_ENTRY, 0, 0, 0, 0, 2, 0, 0]),
+                            bytes([ALLOC_ODT_ENTRY, 0, 0, 0, 1, 1, 0, 0]),
+                            bytes([SET_DAQ_PTR, 0, 0, 0, 0, 0, 0, 0]),
+                            bytes([WRITE_DAQ, 0xFF, 4, 0, 0x10, 0x10, 0, 0]),
+                            bytes([WRITE_DAQ, 0xFF, 2, 0, 0x20, 0x10, 0, 0]),
+                            bytes([SET_DAQ_PTR, 0, 0, 0, 1, 0, 0, 0]),
+                            bytes([WRITE_DAQ, 0xFF, 2, 0, 0x30, 0x10, 0, 0]),
+                            bytes([SET_DAQ_LIST_MODE, 0, 0, 0, 2, 0, 1, 0]),
+                            bytes([START_STOP_DAQ_LIST, 2, 0, 0, 0, 0, 0, 0]),
+                            bytes([START_STOP_SYNCH, 1, 0, 0, 0, 0, 0, 0])]
+    assert client.listener.daq_recorder.first_pid == FIRST_PID
+
+
+def test_lost_daq_allocation_restarts_from_free_daq(connect):
+    client, bus = connect(lost={ALLOC_ODT: 1})
+
+    client.start_daq([('a', 0x1010, 'I')])
+
+    assert [command[0] for command in bus.commands][:6] == [FREE_DAQ, ALLOC_DAQ, ALLOC_ODT, FREE_DAQ, ALLOC_DAQ,
+                                                            ALLOC_ODT]
+
+
+def test_daq_recorder_decodes_the_dtos():
+    recorder = DaqRecorder([[('a', 0x10, 'I'), ('b', 0x20, 'H')], [('c', 0x30, 'h')]], 0x10, '<')
+
+    for timestamp, data in [(1.0, [0x10, 1, 0, 0, 0, 2, 0]), (1.1, [0x11, 0xFE, 0xFF]), (1.2, [0x12, 0]),
+                            (1.3, [0x10, 3, 0, 0, 0, 4, 0])]:
+        recorder.on_dto(can.Message(arbitration_id=XCP_RES_ID, data=bytearray(data), timestamp=timestamp))
+    samples = recorder.get_samples()
+
+    assert samples['a'][0].tolist() == [1.0, 1.3]
+    assert samples['a'][1].tolist() == [1, 3]
+    assert samples['b'][1].tolist() == [2, 4]
+    assert samples['c'][1].tolist() == [-2]
+
+
+@pytest.mark.parametrize('text, variable', [('Speed', ('Speed', 'B')), ('Speed:h', ('Speed', 'h')),
+                                            ('Speed:d', ('Speed', 'd'))])
+def test_parse_variable(text, variable):
+    assert parse_variable(text) == variable
+
+
+@pytest.mark.parametrize('text', ['Speed:x', 'Speed:2H', 'Speed:', 'Speed:<H', 'Speed:s'])
+def test_parse_variable_rejects_other_formats(text):
+    with pytest.raises(ValueError):
+        parse_variable(text)
+
+
+@pytest.mark.parametrize('big_endian', [False, True])
+def test_build_checksums_splits_the_range_in_the_blocks_of_the_slave(connect, big_endian):
+    client, bus = connect(big_endian=big_endian, max_checksum_block_size=100)
+
+    checksums = client.build_checksums(MEMORY_START, 256)
+
+    assert checksums == [(MEMORY_START + start, size, CRC_16, compute_checksum(MEMORY[start:start + size], CRC_16))
+                         for start, size in [(0, 100), (100, 100), (200, 56)]]
+
+
+def test_build_checksums_in_one_block(connect):
+    client, bus = connect()
+
+    assert client.build_checksums(MEMORY_START, 256) == [(MEMORY_START, 256, CRC_16,
+                                                          compute_checksum(MEMORY, CRC_16))]
+    assert [command[0] for command in bus.commands] == [SET_MTA, BUILD_CHECKSUM]
+
+
+def test_build_checksums_without_a_block_size(connect):
+    client, bus = connect(max_checksum_block_size=0)
+
+    with pytest.raises(XcpError) as error:
+        client.build_checksums(MEMORY_START, 256)
+    assert (error.value.command, error.value.error_code) == (BUILD_CHECKSUM, 0x22)
@@ -0,0 +1,215 @@
+import numpy as np
+
+# Frames at the start of each capture that are not used for the cycle time
+SKIPPED_FRAMES = 4
+# A gap longer than MISSED_FACTOR cycles counts round(gap / cycle) - 1 missed frames
+MISSED_FACTOR = 1.5
+# A gap shorter than BURST_FACTOR cycles counts as a burst
+BURST_FACTOR = 0.5
+# Histogram of the deviation from the cycle time, relative to the cycle time, for the percentile jitter
+HISTOGRAM_BIN_WIDTH = 0.005
+HISTOGRAM_BINS = 400
+JITTER_PERCENTILE = 99
+
+# Pass/fail bands of get_results
+DEFAULT_TOLERANCES = {
+    # Largest deviation of the average cycle time, in % of the cycle time
+    'mean_pct': 10.0,
+    # Largest JITTER_PERCENTILE percentile of the deviation, in % of the cycle time
+    'jitter_pct': 50.0,
+    # Largest number of missed frames
+    'max_missed': 0,
+    # Largest number of bursts, None to ignore bursts
+    'max_bursts': None,
+}
+
+
+def parse_tolerance(text):
+    """ parse a KEY=VALUE command line override of DEFAULT_TOLERANCES
+
+    :param text: str, e.g. 'mean_pct=5'
+    :return: (key, value)
+    """
+    key, value = text.split('=', 1)
+    if key not in DEFAULT_TOLERANCES:
+        raise ValueError('unknown tolerance {}'.format(key))
+    if value.lower() == 'none':
+        return key, None
+
+    return key, float(value)
+
+
+class CycleStatistics(object):
+    """ Cycle time statistics of a table of CAN messages, one row per message, computed with numpy in batches
+
+    Statistics of consecutive batches or log chunks are merged with merge(), the frames themselves are not kept.
+    """
+
+    def __init__(self, cycle_ms):
+        """ initialize empty statistics
+        :param cycle_ms: expected cycle time of each row in ms, 0 if unknown
+        :return None
+        """
+        self.cycle_ms = np.asarray(cycle_ms, dtype=np.float64)
+        rows = len(self.cycle_ms)
+        self.count = np.zeros(rows, dtype=np.int64)
+        # Timestamps of the frames up to the first frame used for the cycle time
+        self.head = np.full((rows, SKIPPED_FRAMES + 1), np.nan)
+        self.last = np.full(rows, np.nan)
+        # Statistics of the frame gaps in ms, each gap starting at or after frame SKIPPED_FRAMES
+        self.gap_count = np.zeros(rows, dtype=np.int64)
+        self.gap_sum = np.zeros(rows)
+        self.gap_sum_squares = np.zeros(rows)
+        self.gap_min = np.full(rows, np.inf)
+        self.gap_max = np.full(rows, -np.inf)
+        self.missed = np.zeros(rows, dtype=np.int64)
+        self.bursts = np.zeros(rows, dtype=np.int64)
+        self.histogram = np.zeros((rows, HISTOGRAM_BINS + 1), dtype=np.int64)
+
+    @classmethod
+    def from_frames(cls, cycle_ms, rows, timestamps):
+        """ compute the statistics of a batch of frames
+
+        :param cycle_ms: expected cycle time of each row in ms
+        :param rows: numpy array of the row of each frame
+        :param timestamps: numpy array of the timestamp of each frame in seconds, in time order per row
+        :return: CycleStatistics
+        """
+        statistics = cls(cycle_ms)
+        if len(rows) == 0:
+            return statistics
+        # A stable sort keeps the time order within each row
+        order = np.argsort(rows, kind='stable')
+        rows = np.asarray(rows)[order]
+        timestamps = np.asarray(timestamps, dtype=np.float64)[order]
+
+        statistics.count = np.bincount(rows, minlength=len(statistics.cycle_ms)).astype(np.int64)
+        first = np.concatenate(([0], np.cumsum(statistics.count)[:-1]))
+        position = np.arange(len(rows)) - first[rows]
+        in_head = position <= SKIPPED_FRAMES
+        statistics.head[rows[in_head], position[in_head]] = timestamps[in_head]
+        received = statistics.count > 0
+        statistics.last[received] = timestamps[first[received] + statistics.count[received] - 1]
+
+        used = (rows[1:] == rows[:-1]) & (position[:-1] >= SKIPPED_FRAMES)
+        statistics.add_gaps(rows[1:][used], np.diff(timestamps)[used] * 1000)
+
+        return statistics
+
+    @classmethod
+    def from_timestamps(cls, cycle_ms, timestamps):
+        """ compute the statistics of the timestamp arrays of a capture
+
+        :param cycle_ms: expected cycle time of each row in ms
+        :param timestamps: dictionary of row -> numpy array of timestamps in seconds
+        :return: CycleStatistics
+        """
+        if not timestamps:
+            return cls(cycle_ms)
+        rows = np.repeat(np.fromiter(timestamps.keys(), dtype=np.int64),
+                         [len(row_timestamps) for row_timestamps in timestamps.values()])
+        return cls.from_frames(cycle_ms, rows, np.concatenate(list(timestamps.values())))
+
+    def add_gaps(self, rows, gaps_ms):
+        """ add frame gaps to the statistics
+
+        :param rows: numpy array of the row of each gap
+        :param gaps_ms: numpy array of the gaps in ms
+        :return: None
+        """
+        if len(rows) == 0:
+            return
+        order = np.argsort(rows, kind='stable')
+        rows = rows[order]
+        gaps_ms = gaps_ms[order]
+        row_count = len(self.cycle_ms)
+
+        self.gap_count += np.bincount(rows, minlength=row_count)
+        self.gap_sum += np.bincount(rows, weights=gaps_ms, minlength=row_count)
+        self.gap_sum_squares += np.bincount(rows, weights=gaps_ms * gaps_ms, minlength=row_count)
+        starts = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+        gap_rows = rows[starts]
+        self.gap_min[gap_rows] = np.minimum(self.gap_min[gap_rows], np.minimum.reduceat(gaps_ms, starts))
+        self.gap_max[gap_rows] = np.maximum(self.gap_max[gap_rows], np.maximum.reduceat(gaps_ms, starts))
+
+        cycle_ms = self.cycle_ms[rows]
+        known = cycle_ms > 0
+        rows = rows[known]
+        gaps_ms = gaps_ms[known]
+        cycle_ms = cycle_ms[known]
+        ratio = gaps_ms / cycle_ms
+        missed = ratio > MISSED_FACTOR
+        self.missed += np.bincount(rows[missed], weights=np.round(ratio[missed]) - 1,
+                                   minlength=row_count).astype(np.int64)
+        self.bursts += np.bincount(rows[ratio < BURST_FACTOR], minlength=row_count)
+        bins = np.minimum((np.abs(ratio - 1) / HISTOGRAM_BIN_WIDTH).astype(np.int64), HISTOGRAM_BINS)
+        self.histogram += np.bincount(rows * (HISTOGRAM_BINS + 1) + bins,
+                                      minlength=row_count * (HISTOGRAM_BINS + 1)).reshape(self.histogram.shape)
+
+    def merge(self, other):
+        """ append the statistics of the next batch or log chunk of the same rows
+
+        :param other: CycleStatistics computed from later frames
+        :return: None
+        """
+        # The gaps between the last frame here and the first frames of other are added here, including the
+        # gaps at the start of other that are only skipped when other starts the capture
+        both = np.flatnonzero((self.count > 0) & (other.count > 0))
+        if len(both) > 0:
+            earlier = np.concatenate((self.last[both][:, None], other.head[both][:, :-1]), axis=1)
+            gaps_ms = (other.head[both] - earlier) * 1000
+            first_frame = self.count[both][:, None] - 1 + np.arange(SKIPPED_FRAMES + 1)
+            used = (first_frame >= SKIPPED_FRAMES) & ~np.isnan(gaps_ms)
+            self.add_gaps(np.repeat(both, used.sum(axis=1)), gaps_ms[used])
+
+        for row in np.flatnonzero((self.count <= SKIPPED_FRAMES) & (other.count > 0)):
+            head = np.concatenate((self.head[row][:self.count[row]], other.head[row][:other.count[row]]))
+            self.head[row][:min(len(head), SKIPPED_FRAMES + 1)] = head[:SKIPPED_FRAMES + 1]
+
+        self.gap_count += other.gap_count
+        self.gap_sum += other.gap_sum
+        self.gap_sum_squares += other.gap_sum_squares
+        self.gap_min = np.minimum(self.gap_min, other.gap_min)
+        self.gap_max = np.maximum(self.gap_max, other.gap_max)
+        self.missed += other.missed
+        self.bursts += other.bursts
+        self.histogram += other.histogram
+        self.last = np.where(other.count > 0, other.last, self.last)
+        self.count += other.count
+
+    def get_results(self, tolerances=None):
+        """ compute the final statistics and the pass/fail result of each row
+
+        :param tolerances: dictionary overriding DEFAULT_TOLERANCES
+        :return: dictionary of column name -> numpy array, NaN where a row has no gaps
+        """
+        tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gap_count = self.gap_count.astype(np.float64)
+            mean_ms = np.where(self.gap_count > 0, self.gap_sum / gap_count, np.nan)
+            std_ms = np.sqrt(np.maximum(self.gap_sum_squares / gap_count - mean_ms * mean_ms, 0))
+            # Upper edge of the bin reaching the percentile
+            cumulative = np.cumsum(self.histogram, axis=1)
+            percentile_bin = (cumulative < (cumulative[:, -1] * JITTER_PERCENTILE / 100.0)[:, None]).sum(axis=1)
+            jitter_ms = np.where(cumulative[:, -1] > 0,
+                                 (percentile_bin + 1) * HISTOGRAM_BIN_WIDTH * self.cycle_ms, np.nan)
+
+            deviation_pct = np.abs(mean_ms - self.cycle_ms) * 100 / self.cycle_ms
+            passed = (deviation_pct <= tolerances['mean_pct']) & \
+                     ((jitter_ms * 100 / self.cycle_ms <= tolerances['jitter_pct']) | np.isnan(jitter_ms)) & \
+                     (self.missed <= tolerances['max_missed'])
+            if tolerances['max_bursts'] is not None:
+                passed &= self.bursts <= tolerances['max_bursts']
+
+        return {
+            'count': self.count,
+            'mean_ms': mean_ms,
+            'std_ms': np.where(self.gap_count > 0, std_ms, np.nan),
+            'min_ms': np.where(self.gap_count > 0, self.gap_min, np.nan),
+            'max_ms': np.where(self.gap_count > 0, self.gap_max, np.nan),
+            'jitter_ms': jitter_ms,
+            'missed': self.missed,
+            'bursts': self.bursts,
+            'passed': passed,
+            'judged': (self.gap_count > 0) & (self.cycle_ms > 0),
+        }
@@ -0,0 +1,113 @@
+from datetime import datetime
+
+import json
+import os
+import socketserver
+import threading
+
+WATCH_RESULTS = 'watch_result.json'
+
+
+def get_file_states(file_names):
+    """ read the size and modification time of files
+
+    :param file_names: list of paths
+    :return: dictionary of path -> (size, modification time in ns), None for missing files
+    """
+    states = {}
+    for file_name in file_names:
+        try:
+            stat = os.stat(str(file_name))
+            states[str(file_name)] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            states[str(file_name)] = None
+
+    return states
+
+
+class FileWatcher(object):
+    """ Polls groups of files for changes
+
+    A change is reported once the files of a group are unchanged for one poll, so a file being written,
+    e.g. application.map by the linker, is only reported when it is complete.
+    """
+
+    def __init__(self, groups):
+        """ take the current state of the files as the reference
+        :param groups: dictionary of group name -> callable returning the list of files of the group
+        :return None
+        """
+        self.groups = groups
+        self.states = {name: get_file_states(list_files()) for name, list_files in groups.items()}
+        self.pending = {}
+
+    def poll(self):
+        """ compare the files against their last state
+
+        :return: set of the names of the groups whose files changed, were added or were removed
+        """
+        changed = set()
+        for name, list_files in self.groups.items():
+            states = get_file_states(list_files())
+            if states == self.states[name]:
+                self.pending.pop(name, None)
+            elif states == self.pending.get(name):
+                # Stable since the last poll
+                self.states[name] = states
+                del self.pending[name]
+                changed.add(name)
+            else:
+                self.pending[name] = states
+
+        return changed
+
+
+class ResultRequestHandler(socketserver.StreamRequestHandler):
+    """ Sends the latest result to a client, one JSON document per connection """
+
+    def handle(self):
+        self.wfile.write(self.server.result)
+
+
+class ResultPublisher(object):
+    """ Makes the latest result of the watch mode available in a JSON file and, optionally, on a local TCP port """
+
+    def __init__(self, results_file=WATCH_RESULTS, port=None):
+        """ start the TCP server
+        :param results_file: JSON file replaced with every result
+        :param port: TCP port on 127.0.0.1, None for the file only
+        :return None
+        """
+        self.results_file = results_file
+        self.server = None
+        if port is not None:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            self.server = socketserver.ThreadingTCPServer(('127.0.0.1', port), ResultRequestHandler)
+            self.server.daemon_threads = True
+            self.server.result = b'{}\n'
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def publish(self, result):
+        """ publish a result, readers never see a partly written file
+
+        :param result: dictionary of JSON-serializable values, the publication time is added
+        :return: None
+        """
+        result = dict(result, published=datetime.now().isoformat(timespec='seconds'))
+        data = (json.dumps(result, indent=2) + '\n').encode('utf-8')
+        temp_file = '{}.tmp'.format(self.results_file)
+        with open(temp_file, 'wb') as fp:
+            fp.write(data)
+        os.replace(temp_file, self.results_file)
+        if self.server is not None:
+            self.server.result = data
+
+    def close(self):
+        """ stop the TCP server
+
+        :return: None
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,536 @@
+from time import sleep, time
+
+import can
+import logging
+import queue
+import struct
+import numpy as np
+
+# CAN IDs of the XCP slave
+XCP_CMD_ID = 0x7E0
+XCP_RES_ID = 0x7E1
+
+# Packet IDs of the slave -> master packets
+PID_RES = 0xFF
+PID_ERR = 0xFE
+PID_EV = 0xFD
+PID_SERV = 0xFC
+
+# Command codes
+CONNECT = 0xFF
+DISCONNECT = 0xFE
+SET_MTA = 0xF6
+UPLOAD = 0xF5
+SHORT_UPLOAD = 0xF4
+BUILD_CHECKSUM = 0xF3
+SET_DAQ_PTR = 0xE2
+WRITE_DAQ = 0xE1
+SET_DAQ_LIST_MODE = 0xE0
+START_STOP_DAQ_LIST = 0xDE
+START_STOP_SYNCH = 0xDD
+FREE_DAQ = 0xD6
+ALLOC_DAQ = 0xD5
+ALLOC_ODT = 0xD4
+ALLOC_ODT_ENTRY = 0xD3
+
+COMMAND_NAMES = {
+    CONNECT: 'CONNECT',
+    DISCONNECT: 'DISCONNECT',
+    SET_MTA: 'SET_MTA',
+    UPLOAD: 'UPLOAD',
+    SHORT_UPLOAD: 'SHORT_UPLOAD',
+    BUILD_CHECKSUM: 'BUILD_CHECKSUM',
+    SET_DAQ_PTR: 'SET_DAQ_PTR',
+    WRITE_DAQ: 'WRITE_DAQ',
+    SET_DAQ_LIST_MODE: 'SET_DAQ_LIST_MODE',
+    START_STOP_DAQ_LIST: 'START_STOP_DAQ_LIST',
+    START_STOP_SYNCH: 'START_STOP_SYNCH',
+    FREE_DAQ: 'FREE_DAQ',
+    ALLOC_DAQ: 'ALLOC_DAQ',
+    ALLOC_ODT: 'ALLOC_ODT',
+    ALLOC_ODT_ENTRY: 'ALLOC_ODT_ENTRY',
+}
+
+ERR_OUT_OF_RANGE = 0x22
+ERROR_NAMES = {
+    0x00: 'XCP_ERR_CMD_SYNCH',
+    0x10: 'XCP_ERR_CMD_BUSY',
+    0x11: 'XCP_ERR_DAQ_ACTIVE',
+    0x12: 'XCP_ERR_PGM_ACTIVE',
+    0x20: 'XCP_ERR_CMD_UNKNOWN',
+    0x21: 'XCP_ERR_CMD_SYNTAX',
+    0x22: 'XCP_ERR_OUT_OF_RANGE',
+    0x23: 'XCP_ERR_WRITE_PROTECTED',
+    0x24: 'XCP_ERR_ACCESS_DENIED',
+    0x25: 'XCP_ERR_ACCESS_LOCKED',
+    0x26: 'XCP_ERR_PAGE_NOT_VALID',
+    0x27: 'XCP_ERR_MODE_NOT_VALID',
+    0x28: 'XCP_ERR_SEGMENT_NOT_VALID',
+    0x29: 'XCP_ERR_SEQUENCE',
+    0x2A: 'XCP_ERR_DAQ_CONFIG',
+    0x30: 'XCP_ERR_MEMORY_OVERFLOW',
+    0x31: 'XCP_ERR_GENERIC',
+    0x32: 'XCP_ERR_VERIFY',
+}
+
+# Time to wait for the response of each command, in seconds
+DEFAULT_TIMEOUT_S = 0.05
+COMMAND_TIMEOUTS_S = {
+    CONNECT: 0.2,
+    # The slave computes the checksum before answering
+    BUILD_CHECKSUM: 5.0,
+}
+# Retries after a timeout, with a backoff starting at BACKOFF_S and doubling up to MAX_BACKOFF_S
+DEFAULT_RETRIES = 3
+COMMAND_RETRIES = {
+    CONNECT: 10,
+    DISCONNECT: 10,
+    BUILD_CHECKSUM: 0,
+    # UPLOAD advances the memory transfer address, read_memory restarts from SET_MTA instead
+    UPLOAD: 0,
+    # The DAQ allocation and WRITE_DAQ change the DAQ configuration, start_daq restarts from FREE_DAQ instead
+    ALLOC_DAQ: 0,
+    ALLOC_ODT: 0,
+    ALLOC_ODT_ENTRY: 0,
+    WRITE_DAQ: 0,
+}
+# Restarts of SET_MTA + UPLOAD from the original address after an UPLOAD timeout
+UPLOAD_RESTARTS = 3
+# Restarts of the DAQ configuration from FREE_DAQ after a timeout
+DAQ_CONFIG_RESTARTS = 3
+BACKOFF_S = 0.01
+MAX_BACKOFF_S = 0.5
+# Bytes between two variables that are read along rather than starting a new range
+MAX_RANGE_GAP = 16
+# UPLOAD counts elements in one byte
+MAX_UPLOAD_SIZE = 0xFF
+# Struct formats of the variables that are read or streamed, one number each
+VARIABLE_FORMATS = 'bBhHiIlLqQfd'
+# Initial number of samples kept per DAQ variable, the buffers grow when full
+DAQ_BUFFER_SIZE = 4096
+
+
+def parse_variable(text):
+    """ parse a SYMBOL[:FORMAT] command line variable
+
+    :param text: str, e.g. 'StubVersion_Main:B'
+    :return: (symbol, struct format), the format is B if not given
+    """
+    symbol, value_format = (text.split(':', 1) + ['B'])[:2]
+    if len(value_format) != 1 or value_format not in VARIABLE_FORMATS:
+        raise ValueError('format of {} must be one of {}'.format(symbol, VARIABLE_FORMATS))
+
+    return symbol, value_format
+
+
+def group_address_ranges(variables, byte_order='<', max_gap=MAX_RANGE_GAP, max_size=MAX_UPLOAD_SIZE):
+    """ group variables into contiguous memory ranges, each read with one upload
+
+    :param variables: list of (name, address, struct format) of the variables
+    :param byte_order: '<' or '>', the variables have the standard sizes of the struct module
+    :param max_gap: largest gap in bytes between two variables of the same range
+    :param max_size: largest range in bytes
+    :return: list of (start address, size, list of (name, offset in the range, struct format))
+    """
+    ranges = []
+    for name, address, value_format in sorted(variables, key=lambda variable: variable[1]):
+        end = address + struct.calcsize(byte_order + value_format)
+        if ranges:
+            start, size, members = ranges[-1]
+            if address - (start + size) <= max_gap and end - start <= max_size:
+                members.append((name, address - start, value_format))
+                ranges[-1] = (start, max(size, end - start), members)
+                continue
+        ranges.append((address, end - address, [(name, 0, value_format)]))
+
+    return ranges
+
+
+def pack_odts(variables, odt_size, byte_order='<'):
+    """ pack variables into ODTs, one ODT entry per variable
+
+    :param variables: list of (name, address, struct format) of the variables
+    :param odt_size: payload bytes of one DTO after the PID
+    :param byte_order: '<' or '>'
+    :return: list of ODTs, each a list of (name, address, struct format)
+    """
+    odts = []
+    odt_used = odt_size
+    for name, address, value_format in variables:
+        size = struct.calcsize(byte_order + value_format)
+        if size > odt_size:
+            raise ValueError('{} does not fit in one ODT'.format(name))
+        if odt_used + size > odt_size:
+            odts.append([])
+            odt_used = 0
+        odts[-1].append((name, address, value_format))
+        odt_used += size
+
+    return odts
+
+
+class DaqRecorder(object):
+    """ Decodes the DTOs of one DAQ list into timestamped numeric arrays """
+
+    def __init__(self, odts, first_pid, byte_order):
+        """ prepare the decoding of each ODT
+        :param odts: list of ODTs from pack_odts
+        :param first_pid: PID of the first ODT, from START_STOP_DAQ_LIST
+        :param byte_order: '<' or '>'
+        :return None
+        """
+        self.first_pid = first_pid
+        self.layouts = [struct.Struct(byte_order + ''.join(value_format for name, address, value_format in odt))
+                        for odt in odts]
+        self.names = [[name for name, address, value_format in odt] for odt in odts]
+        self.timestamps = [np.empty(DAQ_BUFFER_SIZE, dtype=np.float64) for odt in odts]
+        self.values = [np.empty((DAQ_BUFFER_SIZE, len(odt)), dtype=np.float64) for odt in odts]
+        self.counts = [0] * len(odts)
+
+    def on_dto(self, msg):
+        odt = msg.data[0] - self.first_pid
+        if not 0 <= odt < len(self.layouts):
+            return
+        count = self.counts[odt]
+        if count == len(self.timestamps[odt]):
+            self.timestamps[odt] = np.resize(self.timestamps[odt], 2 * count)
+            self.values[odt] = np.resize(self.values[odt], (2 * count, self.values[odt].shape[1]))
+        self.timestamps[odt][count] = msg.timestamp
+        self.values[odt][count] = self.layouts[odt].unpack_from(bytes(msg.data), 1)
+        self.counts[odt] = count + 1
+
+    def get_samples(self):
+        """ copy out the received samples
+
+        :return: dictionary of variable name -> (numpy array of timestamps in seconds, numpy array of values)
+        """
+        samples = {}
+        for odt, names in enumerate(self.names):
+            count = self.counts[odt]
+            for column, name in enumerate(names):
+                samples[name] = (self.timestamps[odt][:count].copy(), self.values[odt][:count, column].copy())
+
+        return samples
+
+
+class XcpError(Exception):
+    """ The XCP slave answered a command with an error packet """
+
+    def __init__(self, command, error_code, data=b''):
+        self.command = command
+        self.error_code = error_code
+        # The whole error packet, some errors carry parameters after the error code
+        self.data = bytes(data)
+        super(XcpError, self).__init__('Command: {} Response: {}'.format(
+            COMMAND_NAMES.get(command, hex(command)), ERROR_NAMES.get(error_code, hex(error_code))))
+
+
+class XcpTimeout(Exception):
+    """ The XCP slave did not answer a command """
+
+    def __init__(self, command, tries):
+        self.command = command
+        super(XcpTimeout, self).__init__('Command: {} Response: timeout after {} tries'.format(
+            COMMAND_NAMES.get(command, hex(command)), tries))
+
+
+class XcpResponseListener(can.Listener):
+    """ Passes the response packets of the XCP slave to the waiting command """
+
+    def __init__(self, res_id):
+        self.res_id = res_id
+        self.responses = queue.Queue()
+        self.daq_recorder = None
+
+    def on_message_received(self, msg):
+        if msg.arbitration_id != self.res_id or msg.is_error_frame or len(msg.data) == 0:
+            return
+        if msg.data[0] in (PID_RES, PID_ERR):
+            self.responses.put(msg)
+        elif msg.data[0] in (PID_EV, PID_SERV):
+            logging.info('XCP event/service packet: {}'.format(bytes(msg.data).hex()))
+        elif self.daq_recorder is not None:
+            self.daq_recorder.on_dto(msg)
+
+    def clear(self):
+        """ drop late responses of earlier commands """
+        try:
+            while True:
+                self.responses.get_nowait()
+        except queue.Empty:
+            pass
+
+
+class XcpClient(object):
+    """ XCP on CAN master, one outstanding command at a time as required by the standard """
+
+    def __init__(self, bus, cmd_id=XCP_CMD_ID, res_id=XCP_RES_ID, timeouts_s=None, retries=None):
+        """ attach the client to an open CAN bus
+        :param bus: can.BusABC, e.g. can.ThreadSafeBus
+        :param cmd_id: CAN ID of the master -> slave packets
+        :param res_id: CAN ID of the slave -> master packets
+        :param timeouts_s: dictionary of command code -> response timeout in seconds, overrides the defaults
+        :param retries: dictionary of command code -> number of retries, overrides the defaults
+        :return None
+        """
+        self.bus = bus
+        self.cmd_id = cmd_id
+        # The command codes are ints, which dict() does not take as keyword arguments
+        self.timeouts_s = dict(COMMAND_TIMEOUTS_S)
+        self.timeouts_s.update(timeouts_s or {})
+        self.retries = dict(COMMAND_RETRIES)
+        self.retries.update(retries or {})
+        self.listener = XcpResponseListener(res_id)
+        self.notifier = can.Notifier(bus, [self.listener], timeout=0.01)
+        # Updated by connect()
+        self.byte_order = '<'
+        self.max_cto = 8
+        self.max_dto = 8
+        self.slave_block_mode = False
+
+    def command(self, data):
+        """ send a command and wait for its response
+
+        :param data: command packet, the first byte is the command code
+        :return: data of the positive response
+        """
+        command = data[0]
+        timeout_s = self.timeouts_s.get(command, DEFAULT_TIMEOUT_S)
+        retries = self.retries.get(command, DEFAULT_RETRIES)
+        msg = can.Message(arbitration_id=self.cmd_id, data=bytearray(data).ljust(8, b'\x00'), is_extended_id=False)
+        backoff_s = BACKOFF_S
+
+        for tries in range(retries + 1):
+            if tries > 0:
+                logging.info('XCP {} retry {}'.format(COMMAND_NAMES.get(command, hex(command)), tries))
+                sleep(backoff_s)
+                backoff_s = min(2 * backoff_s, MAX_BACKOFF_S)
+            self.listener.clear()
+            start_s = time()
+            self.bus.send(msg)
+            try:
+                response = self.listener.responses.get(timeout=timeout_s)
+            except queue.Empty:
+                continue
+            logging.debug('XCP {} answered in {:.1f} ms'.format(COMMAND_NAMES.get(command, hex(command)),
+                                                                 (time() - start_s) * 1000))
+            if response.data[0] == PID_ERR:
+                raise XcpError(command, response.data[1] if len(response.data) > 1 else 0x31, response.data)
+            return bytes(response.data)
+
+        raise XcpTimeout(command, retries + 1)
+
+    def connect(self, mode=0x00):
+        """ connect to the XCP slave and read its communication parameters
+
+        :param mode: 0x00 for normal, 0x01 for user-defined
+        :return: data of the CONNECT response
+        """
+        response = self.command([CONNECT, mode])
+        if len(response) >= 8:
+            self.byte_order = '>' if response[2] & 0x01 else '<'
+            self.slave_block_mode = bool(response[2] & 0x40)
+            self.max_cto = response[3]
+            self.max_dto = struct.unpack(self.byte_order + 'H', response[4:6])[0]
+        return response
+
+    def disconnect(self):
+        """ disconnect from the XCP slave
+
+        :return: data of the DISCONNECT response
+        """
+        return self.command([DISCONNECT])
+
+    def short_upload(self, address, size, address_extension=0x00):
+        """ read up to max_cto - 1 bytes of memory
+
+        :param address: int
+        :param size: number of bytes
+        :param address_extension: int
+        :return: bytes read
+        """
+        response = self.command([SHORT_UPLOAD, size, 0x00, address_extension] +
+                                list(struct.pack(self.byte_order + 'I', address)))
+        return response[1:1 + size]
+
+    def set_mta(self, address, address_extension=0x00):
+        """ set the memory transfer address used by the following UPLOAD commands
+
+        :param address: int
+        :param address_extension: int
+        :return: None
+        """
+        self.command([SET_MTA, 0x00, 0x00, address_extension] + list(struct.pack(self.byte_order + 'I', address)))
+
+    def upload(self, size):
+        """ read memory from the memory transfer address, which is incremented by the slave
+
+        In slave block mode the whole size is requested at once and the slave answers with consecutive
+        response packets, otherwise one UPLOAD is sent per packet.
+
+        :param size: number of bytes, up to MAX_UPLOAD_SIZE
+        :return: bytes read
+        """
+        packet_size = self.max_cto - 1
+        data = b''
+        if self.slave_block_mode:
+            data += self.command([UPLOAD, size])[1:]
+            timeout_s = self.timeouts_s.get(UPLOAD, DEFAULT_TIMEOUT_S)
+            while len(data) < size:
+                try:
+                    response = self.listener.responses.get(timeout=timeout_s)
+                except queue.Empty:
+                    raise XcpTimeout(UPLOAD, 1)
+                if response.data[0] == PID_ERR:
+                    raise XcpError(UPLOAD, response.data[1] if len(response.data) > 1 else 0x31, response.data)
+                data += bytes(response.data[1:])
+        else:
+            while len(data) < size:
+                data += self.command([UPLOAD, min(packet_size, size - len(data))])[1:]
+
+        return data[:size]
+
+    def read_memory(self, address, size, address_extension=0x00):
+        """ read a memory range with SET_MTA + UPLOAD, or one SHORT_UPLOAD if it fits in one packet
+
+        :param address: int
+        :param size: number of bytes
+        :param address_extension: int
+        :return: bytes read
+        """
+        if size <= self.max_cto - 1:
+            return self.short_upload(address, size, address_extension)
+        backoff_s = BACKOFF_S
+        for restarts in range(UPLOAD_RESTARTS + 1):
+            if restarts > 0:
+                logging.info('XCP UPLOAD restart {} at 0x{:X}'.format(restarts, address))
+                # Let the late packets of the timed out upload arrive before they are dropped
+                sleep(max(backoff_s, self.timeouts_s.get(UPLOAD, DEFAULT_TIMEOUT_S)))
+                backoff_s = min(2 * backoff_s, MAX_BACKOFF_S)
+                self.listener.clear()
+            self.set_mta(address, address_extension)
+            try:
+                return self.upload(size)
+            except XcpTimeout:
+                continue
+
+        raise XcpTimeout(UPLOAD, UPLOAD_RESTARTS + 1)
+
+    def read_variables(self, variables):
+        """ read many variables with one round trip per contiguous memory range
+
+        :param variables: list of (name, address, struct format) of the variables, e.g. ('StubVersion_Main', a, 'B')
+        :return: dictionary of name -> value
+        """
+        values = {}
+        for start, size, members in group_address_ranges(variables, self.byte_order):
+            data = self.read_memory(start, size)
+            for name, offset, value_format in members:
+                values[name] = struct.unpack_from(self.byte_order + value_format, data, offset)[0]
+
+        return values
+
+    def build_checksum(self, address, size, address_extension=0x00):
+        """ let the slave compute the checksum of a memory range
+
+        :param address: int
+        :param size: number of bytes
+        :param address_extension: int
+        :return: checksum type, checksum
+        """
+        self.set_mta(address, address_extension)
+        response = self.command([BUILD_CHECKSUM, 0x00, 0x00, 0x00] + list(struct.pack(self.byte_order + 'I', size)))
+        return response[1], struct.unpack(self.byte_order + 'I', response[4:8])[0]
+
+    def build_checksums(self, address, size, address_extension=0x00):
+        """ let the slave compute the checksum of a memory range, split in blocks of MAX_CHECKSUM_BLOCKSIZE
+        if the slave answers that the range is too large for one BUILD_CHECKSUM
+
+        :param address: int
+        :param size: number of bytes
+        :param address_extension: int
+        :return: list of (address, size, checksum type, checksum), one per block
+        """
+        try:
+            return [(address, size) + self.build_checksum(address, size, address_extension)]
+        except XcpError as e:
+            # XCP_ERR_OUT_OF_RANGE of BUILD_CHECKSUM carries MAX_CHECKSUM_BLOCKSIZE in bytes 4 to 7
+            if e.error_code != ERR_OUT_OF_RANGE or len(e.data) < 8:
+                raise
+            block_size = struct.unpack(self.byte_order + 'I', e.data[4:8])[0]
+            if not 0 < block_size < size:
+                raise
+        logging.info('BUILD_CHECKSUM of {} bytes at {} is split in blocks of {} bytes'.format(
+            size, hex(address), block_size))
+
+        checksums = []
+        for start in range(address, address + size, block_size):
+            block = min(block_size, address + size - start)
+            checksums.append((start, block) + self.build_checksum(start, block, address_extension))
+        return checksums
+
+    def configure_daq(self, odts):
+        """ free all DAQ lists and allocate and write one dynamic DAQ list for the ODTs
+
+        :param odts: list of ODTs from pack_odts
+        :return: None
+        """
+        word = self.byte_order + 'H'
+        self.command([FREE_DAQ])
+        self.command([ALLOC_DAQ, 0x00] + list(struct.pack(word, 1)))
+        self.command([ALLOC_ODT, 0x00] + list(struct.pack(word, 0)) + [len(odts)])
+        for odt_number, odt in enumerate(odts):
+            self.command([ALLOC_ODT_ENTRY, 0x00] + list(struct.pack(word, 0)) + [odt_number, len(odt)])
+        for odt_number, odt in enumerate(odts):
+            # WRITE_DAQ moves the DAQ pointer to the next ODT entry
+            self.command([SET_DAQ_PTR, 0x00] + list(struct.pack(word, 0)) + [odt_number, 0])
+            for name, address, value_format in odt:
+                self.command([WRITE_DAQ, 0xFF, struct.calcsize(self.byte_order + value_format), 0x00] +
+                             list(struct.pack(self.byte_order + 'I', address)))
+
+    def start_daq(self, variables, event_channel=0, prescaler=1):
+        """ configure one dynamic DAQ list for the variables and start it
+
+        The DTOs are timestamped on reception, with the timestamps of the CAN interface.
+
+        :param variables: list of (name, address, struct format) of the variables
+        :param event_channel: ECU event channel that triggers the DAQ list
+        :param prescaler: transmit every n-th event
+        :return: None
+        """
+        odts = pack_odts(variables, self.max_dto - 1, self.byte_order)
+        backoff_s = BACKOFF_S
+        for restarts in range(DAQ_CONFIG_RESTARTS + 1):
+            if restarts > 0:
+                logging.info('XCP DAQ configuration restart {}'.format(restarts))
+                sleep(backoff_s)
+                backoff_s = min(2 * backoff_s, MAX_BACKOFF_S)
+            try:
+                self.configure_daq(odts)
+                break
+            except XcpTimeout:
+                continue
+        else:
+            raise XcpTimeout(FREE_DAQ, DAQ_CONFIG_RESTARTS + 1)
+
+        word = self.byte_order + 'H'
+        # Mode 0x00: DAQ direction, no timestamp, absolute ODT numbers in the PID
+        self.command([SET_DAQ_LIST_MODE, 0x00] + list(struct.pack(word, 0)) + list(struct.pack(word, event_channel)) +
+                     [prescaler, 0x00])
+        first_pid = self.command([START_STOP_DAQ_LIST, 0x02] + list(struct.pack(word, 0)))[1]
+        self.listener.daq_recorder = DaqRecorder(odts, first_pid, self.byte_order)
+        self.command([START_STOP_SYNCH, 0x01])
+
+    def stop_daq(self):
+        """ stop all DAQ lists
+
+        :return: dictionary of variable name -> (numpy array of timestamps in seconds, numpy array of values)
+        """
+        self.command([START_STOP_SYNCH, 0x00])
+        daq_recorder = self.listener.daq_recorder
+        self.listener.daq_recorder = None
+        return daq_recorder.get_samples() if daq_recorder is not None else {}
+
+    def close(self):
+        """ stop receiving responses, the bus itself is left open """
+        self.notifier.stop()